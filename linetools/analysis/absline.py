@@ -9,7 +9,6 @@ import warnings
 from astropy import units as u
 from astropy import constants as const
 from astropy.io import ascii
-from astropy.utils import isiterable
 from linetools.lists.linelist import LineList
 
 # Atomic constant
@@ -20,6 +19,68 @@ atom_cst = (const.m_e.cgs*const.c.cgs / (np.pi *
 e2_me_c_cgs = (const.e.esu**2 / (const.c.to('cm/s') * const.m_e.to('g')))
 
 
+
+# Line lists and their name indices, for bulk look-ups of transitions
+_llist_cache = {}
+_transition_index = {}
+
+
+def _get_linelist(linelist=None):
+    """ The input LineList, or a shared LineList('ISM') if None
+    """
+    if linelist is not None:
+        return linelist
+    if 'ISM' not in _llist_cache:
+        _llist_cache['ISM'] = LineList('ISM')
+    return _llist_cache['ISM']
+
+
+def transition_data(transition, linelist=None):
+    """ Atomic data of a set of transitions, looked up at once
+
+    Parameters
+    ----------
+    transition : str or array of str
+        Names of the transitions using linetools' naming
+        convention, e.g. 'HI 1215'
+    linelist : LineList, optional
+        Default is a LineList('ISM'), made once and shared by
+        all calls
+
+    Returns
+    -------
+    wrest : Quantity
+        Rest-frame wavelengths, of the shape of transition
+    fosc : float or ndarray
+        Oscillator strengths
+    gamma : Quantity
+        Gamma parameters
+    """
+    llist = _get_linelist(linelist)
+    data = llist._data
+    # Index of names;  rebuilt if the table has been replaced (e.g. sorted)
+    cached = _transition_index.get(id(llist))
+    if (cached is None) or (cached[0] is not data):
+        cached = (data, dict((name, ii) for ii, name in enumerate(data['name'])))
+        _transition_index[id(llist)] = cached
+    index = cached[1]
+    names = np.asarray(transition)
+    uni, inv = np.unique(names.ravel(), return_inverse=True)
+    try:
+        rows = np.array([index[str(name)] for name in uni], dtype=int)[inv]
+    except KeyError as err:
+        raise ValueError('Transition {:s} not found within LineList {:s}'.format(
+            str(err.args[0]), llist.list))
+    vals = [np.asarray(np.ma.filled(data[key][rows], np.nan)).reshape(names.shape)
+            for key in ['wrest', 'f', 'gamma']]
+    wrest = vals[0] * data['wrest'].unit
+    fosc = vals[1]
+    gamma = vals[2] * data['gamma'].unit
+    if names.ndim == 0:
+        return wrest[()], float(fosc), gamma[()]
+    return wrest, fosc, gamma
+
+
 # Perform AODM on the line
 def aodm(spec, idata):
     """ AODM calculation on an absorption line
@@ -82,6 +143,193 @@ def aodm(spec, idata):
     return ntot, np.sqrt(tvar), flg_sat
 
 
+
+def _nearest_pix(wave, wv):
+    """ Index of the pixel nearest each wavelength, taking the lower
+    in a tie (as np.argmin);  wave must be increasing
+    """
+    idx = np.clip(np.searchsorted(wave, wv, side='left'), 1, max(wave.size-1, 1))
+    lower = np.abs(wv - wave[idx-1]) <= np.abs(wave[idx] - wv)
+    return np.where(lower, idx-1, idx)
+
+
+def aodm_arrays(wave, flux, sig, wrest, fval, z, wvlim):
+    """ AODM calculation on many absorption lines of a spectrum at once
+
+    Equivalent to aodm() on the pixels of each line, as cut by
+    AbsLine.cut_spec(), but with unitless arrays and without
+    building a velocity array for each line.
+
+    Parameters
+    ----------
+    wave : ndarray
+      Wavelengths (AA), increasing
+    flux, sig : ndarray
+      Normalized flux and its error
+    wrest : ndarray
+      Rest wavelengths (AA)
+    fval : ndarray
+      Oscillator strengths
+    z : ndarray
+      Redshifts;  velocities are relative to wrest*(1+z)
+    wvlim : ndarray
+      (nline, 2) observed wavelength limits (AA);  the nearest pixels
+      to these are included
+
+    Returns
+    -------
+    N, sig_N : ndarray, ndarray
+      Column and error in linear space (cm^-2)
+    flg_sat : bool ndarray
+      True if saturated pixels exist
+    npix : int ndarray
+      Number of pixels of each line
+    """
+    wave = np.asarray(wave, dtype=float)
+    wrest, fval, z = [np.atleast_1d(np.asarray(item, dtype=float)) for item in [wrest, fval, z]]
+    wvlim = np.atleast_2d(np.asarray(wvlim, dtype=float))
+    nline = wvlim.shape[0]
+    # Pixels of each line
+    p0 = _nearest_pix(wave, wvlim[:, 0])
+    p1 = _nearest_pix(wave, wvlim[:, 1])
+    npix = np.maximum(p1 - p0 + 1, 0)
+    iline = np.repeat(np.arange(nline), npix)
+    kpix = np.arange(np.sum(npix)) - np.repeat(np.cumsum(npix) - npix, npix)
+    ipix = p0[iline] + kpix
+    # dv;  the end pixels take those of their neighbours
+    kk = np.clip(kpix, 1, np.maximum(npix[iline] - 2, 1))
+    jpix = np.minimum(p0[iline] + kk, wave.size-1)
+    delv = np.abs(wave[jpix] - wave[jpix-1]) * const.c.to('km/s').value / \
+        (wrest * (1 + z))[iline]
+    # Atomic data
+    cst = (atom_cst.value / (fval * wrest))[iline]
+    fx, sg = flux[ipix], sig[ipix]
+    nndt = np.zeros(ipix.size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Saturated?
+        satp = (fx <= sg/5.) | (fx < 0.05)
+        lim = satp & (sg > 0.)
+        nndt[lim] = np.log(1. / np.maximum(0.05, sg[lim]/5.)) * cst[lim]
+        # AODM
+        good = (fx == fx) & ~satp
+        nndt[good] = np.log(1. / fx[good]) * cst[good]
+        var = (delv * cst * sg / fx)**2
+    # Sum it
+    N = np.bincount(iline, weights=nndt*delv, minlength=nline)
+    sig_N = np.sqrt(np.bincount(iline, weights=var, minlength=nline))
+    flg_sat = np.bincount(iline, weights=lim, minlength=nline) > 0
+    return N, sig_N, flg_sat, npix
+
+
+def measure_aodm_lines(spec, wrest, fval, z, vlim=None, wvlim=None, nsig=3.,
+                       normalize=True):
+    """ AODM columns of many absorption lines in a spectrum
+
+    Parameters
+    ----------
+    spec : XSpectrum1D
+    wrest : Quantity array
+      Rest wavelengths
+    fval : ndarray
+      Oscillator strengths
+    z : ndarray
+      Redshifts
+    vlim : Quantity array, optional
+      (nline, 2), or (2,) for all lines, velocity limits about
+      wrest*(1+z).  One of vlim and wvlim is required
+    wvlim : Quantity array, optional
+      (nline, 2) observed wavelength limits
+    nsig : float, optional
+      Number of sigma significance required for a "detection"
+    normalize : bool, optional
+      Normalize first?
+
+    Returns
+    -------
+    N, sig_N : Quantity array, Quantity array
+      Column and error (cm^-2)
+    flag_N : int ndarray
+      1 -- detection;  2 -- saturated;  3 -- upper limit;
+      0 -- the spectrum does not cover the line
+    """
+    from linetools import utils as ltu
+    wrest = np.atleast_1d(u.Quantity(wrest).to('AA').value)
+    z = np.atleast_1d(np.asarray(z, dtype=float)) * np.ones(wrest.size)
+    fval = np.atleast_1d(fval) * np.ones(wrest.size)
+    if wvlim is None:
+        if vlim is None:
+            raise IOError("Input one of vlim and wvlim")
+        vlim = np.atleast_2d(u.Quantity(vlim).to('km/s').value) * np.ones((wrest.size, 1))
+        zlim = ltu.z_from_dv(vlim*u.km/u.s, np.outer(z, np.ones(2)))
+        wvlim = wrest[:, np.newaxis] * (1 + zlim)
+    else:
+        wvlim = np.atleast_2d(u.Quantity(wvlim).to('AA').value)
+    # Spectrum
+    if normalize:
+        sv_normed = spec.normed
+        spec.normed = True
+    wave = spec.wavelength.to('AA').value
+    flux, sig = spec.flux.value, spec.sig.value
+    if normalize:
+        spec.normed = sv_normed
+    # Calculate
+    N, sig_N, flg_sat, npix = aodm_arrays(wave, flux, sig, wrest, fval, z, wvlim)
+    # Flag
+    flag_N = np.where(N > nsig*sig_N, 1, 3)
+    flag_N[flg_sat] = 2
+    flag_N[npix <= 1] = 0
+    return N / u.cm**2, sig_N / u.cm**2, flag_N
+
+
+def measure_aodm_abslines(lines, nsig=3., normalize=True):
+    """ AODM calculation on a list of AbsLines, batched by spectrum
+
+    Sets the same attributes as AbsLine.measure_aodm():
+    flag_N, N, sig_N, logN and sig_logN.
+
+    Parameters
+    ----------
+    lines : list of AbsLine
+      Each must have its spectrum (analy['spec']) and limits set
+    nsig : float, optional
+      Number of sigma significance required for a "detection"
+    normalize : bool, optional
+      Normalize first?
+    """
+    # Group by spectrum
+    groups = []
+    for aline in lines:
+        spec = aline.analy['spec']
+        if spec is None:
+            raise ValueError('spectralline.cut_spec: Need to set spectrum!')
+        if spec.wavelength.unit == 1.:
+            raise ValueError('Expecting a unit!')
+        if not aline.limits.is_set():
+            raise ValueError('spectralline.cut_spec: Need to set limits!')
+        for group in groups:
+            if group[0] is spec:
+                group[1].append(aline)
+                break
+        else:
+            groups.append((spec, [aline]))
+    for spec, glines in groups:
+        wrest = u.Quantity([aline.wrest for aline in glines])
+        fval = np.array([aline.data['f'] for aline in glines])
+        z = np.array([aline.z for aline in glines])
+        wvlim = u.Quantity([aline.limits.wvlim.to('AA') for aline in glines])
+        N, sig_N, flag_N = measure_aodm_lines(spec, wrest, fval, z, wvlim=wvlim,
+                                              nsig=nsig, normalize=normalize)
+        for ii, aline in enumerate(glines):
+            if flag_N[ii] == 0:
+                warnings.warn("Spectrum does not cover {:g}".format(aline.wrest))
+                aline.attrib['flag_N'] = 0
+                continue
+            aline.attrib['flag_N'] = int(flag_N[ii])
+            aline.attrib['N'] = N[ii]
+            aline.attrib['sig_N'] = sig_N[ii]
+            log_clm(aline.attrib)
+
+
 def log_clm(obj):
     """Return logN and sig_logN given linear N, sig_N
     Also fills the attributes
@@ -318,19 +566,20 @@ def get_tau0(wrest, fosc, N, b):
         Oscillator strength of the transition
     N : Quantity or Quantity array
         Column density
-    b : Quantity or Quantity array of same shape as N
-        Doppler parameter
+    b : Quantity or Quantity array
+        Doppler parameter;  broadcast with N
 
     Returns
     -------
     tau0: float or array
-        Optical depth at the line center. If N and b are
-        arrays they must be of same shape.
+        Optical depth at the line center, of the broadcast
+        shape of N and b.
     """
     # check format for N and b
-    if isiterable(N):
-        if np.shape(N) != np.shape(b):
-            raise IOError('If N is array, b must be array of same shape.')
+    try:
+        np.broadcast(np.empty(np.shape(N)), np.empty(np.shape(b)))
+    except ValueError:
+        raise IOError('N and b must be of the same (or broadcastable) shapes.')
 
     # convert to CGS
     b_cgs = b.to('cm/s')
@@ -346,7 +595,7 @@ def get_tau0(wrest, fosc, N, b):
     return tau0.value
 
 
-def Wr_from_N_b(N, b, wrest, fosc, gamma):
+def Wr_from_N_b(N, b, wrest, fosc, gamma, method='draine'):
     """For a given transition with wrest, fosc and gamma, it
     returns the rest-frame equivalent width for a given
     N and b. It uses the approximation given by Draine 2011 book
@@ -358,14 +607,18 @@ def Wr_from_N_b(N, b, wrest, fosc, gamma):
     ----------
     N : Quantity or Quantity array
         Column density
-    b : Quantity or Quantity array of same shape as N
-        Doppler parameter
+    b : Quantity or Quantity array
+        Doppler parameter;  broadcast with N
     wrest : Quantity
         Rest-frame wavelength of the transition
     fosc:  float
         Oscillator strength of the transition
     gamma: Quantity
         Gamma parameter of the transition (usually in s^-1).
+    method : str, optional
+        'draine' -- The approximation above
+        'cog' -- Interpolate the tabulated Voigt-profile curve
+        of growth (see linetools.analysis.cog.Ftau0_a)
 
     Returns
     -------
@@ -387,6 +640,14 @@ def Wr_from_N_b(N, b, wrest, fosc, gamma):
     c_cgs = const.c.to('cm/s')
     gamma_cgs = gamma.to('1/s')
 
+    if method == 'cog':
+        from linetools.analysis.cog import Ftau0_a
+        avoigt = (gamma_cgs * wrest_cgs / (4 * np.pi * b_cgs)).decompose().value
+        W = 2 * (b_cgs / c_cgs).decompose().value * Ftau0_a(tau0, avoigt)
+        return W * wrest
+    elif method != 'draine':
+        raise IOError("Bad method {}.  Use 'draine' or 'cog'".format(method))
+
     # two main regimes (eq. 9.27 of Draine 2011)
     # optically thin:
     W_thin = np.sqrt(np.pi) * (b_cgs/c_cgs) * tau0 / (1 + tau0 / (2 * np.sqrt(2))) # dimensionless
@@ -489,7 +750,7 @@ def N_from_Wr(Wr, wrest, fosc):
     N = N.to((1/u.cm**2))
     return N
 
-def Wr_from_N_b_transition(N, b, transition, linelist=None):
+def Wr_from_N_b_transition(N, b, transition, linelist=None, method='draine'):
     """ For a given transition this function looks
     for the atomic parameters (wa0, fosc, gamma) and returns the
     rest-frame equivalent width for a given N and b. It uses the approximation given by
@@ -503,12 +764,15 @@ def Wr_from_N_b_transition(N, b, transition, linelist=None):
         Column density
     b : Quantity or Quantity array of same shape as N
         Doppler parameter
-    transition : str
-        Name of the transition using linetools' naming
-        convention, e.g. 'HI 1215'.
+    transition : str or array of str
+        Name(s) of the transition using linetools' naming
+        convention, e.g. 'HI 1215'.  Broadcast with N and b,
+        e.g. transitions[:, np.newaxis] for a (transition, N) grid
     linelist : LineList, optional
         Default is 'ISM', which means the function looks
-        within `list = LineList('ISM')`.
+        within a LineList('ISM') shared by all calls.
+    method : str, optional
+        See Wr_from_N_b()
 
     Returns
     -------
@@ -520,19 +784,11 @@ def Wr_from_N_b_transition(N, b, transition, linelist=None):
     See also Wr_from_N_b()
 
     """
-    if linelist is None:
-        linelist = LineList('ISM')
-    transition_dict = linelist[transition]
-    if transition_dict is None:
-        raise ValueError('Transition {:s} not found within LineList {:s}'.format(transition, linelist.list))
-    else:
-        # get atomic parameters
-        wrest = transition_dict['wrest']
-        fosc = transition_dict['f']
-        gamma = transition_dict['gamma']
+    # get atomic parameters
+    wrest, fosc, gamma = transition_data(transition, linelist=linelist)
 
     # return
-    return Wr_from_N_b(N, b, wrest, fosc, gamma)
+    return Wr_from_N_b(N, b, wrest, fosc, gamma, method=method)
 
 
 def Wr_from_N_transition(N, transition, linelist=None):
@@ -547,12 +803,13 @@ def Wr_from_N_transition(N, transition, linelist=None):
     ----------
     N : Quantity or Quantity array
         Column density
-    transition : str
-        Name of the transition using linetools' naming
-        convention, e.g. 'HI 1215', 'CIV 1550', etc.
+    transition : str or array of str
+        Name(s) of the transition using linetools' naming
+        convention, e.g. 'HI 1215', 'CIV 1550', etc.  Broadcast
+        with N
     linelist : LineList, optional
         Default is 'ISM', which means the function looks
-        within `list = LineList('ISM')`.
+        within a LineList('ISM') shared by all calls.
 
     Returns
     -------
@@ -564,15 +821,8 @@ def Wr_from_N_transition(N, transition, linelist=None):
     See also Wr_from_N(), Wr_from_N_b_transition(), Wr_from_N_b()
 
     """
-    if linelist is None:
-        linelist = LineList('ISM')
-    transition_dict = linelist[transition]
-    if transition_dict is None:
-        raise ValueError('Transition {:s} not found within LineList {:s}'.format(transition, linelist.list))
-    else:
-        # get atomic parameters
-        wrest = transition_dict['wrest']
-        fosc = transition_dict['f']
+    # get atomic parameters
+    wrest, fosc, _ = transition_data(transition, linelist=linelist)
 
     # return
     return Wr_from_N(N, wrest, fosc)
@@ -590,12 +840,13 @@ def N_from_Wr_transition(Wr, transition, linelist=None):
     ----------
     Wr : Quantity or Quantity array
         Rest-frame wavelength
-    transition : str
-        Name of the transition using linetools' naming
-        convention, e.g. 'HI 1215', 'CIV 1550', etc.
+    transition : str or array of str
+        Name(s) of the transition using linetools' naming
+        convention, e.g. 'HI 1215', 'CIV 1550', etc.  Broadcast
+        with Wr
     linelist : LineList, optional
         Default is 'ISM', which means the function looks
-        within `list = LineList('ISM')`.
+        within a LineList('ISM') shared by all calls.
 
     Returns
     -------
@@ -607,15 +858,8 @@ def N_from_Wr_transition(Wr, transition, linelist=None):
     See also Wr_from_N(), Wr_from_N_b_transition(), Wr_from_N_b()
 
     """
-    if linelist is None:
-        linelist = LineList('ISM')
-    transition_dict = linelist[transition]
-    if transition_dict is None:
-        raise ValueError('Transition {:s} not found within LineList {:s}'.format(transition, linelist.list))
-    else:
-        # get atomic parameters
-        wrest = transition_dict['wrest']
-        fosc = transition_dict['f']
+    # get atomic parameters
+    wrest, fosc, _ = transition_data(transition, linelist=linelist)
 
     # return
     return N_from_Wr(Wr, wrest, fosc)
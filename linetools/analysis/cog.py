@@ -8,9 +8,6 @@ import os
 import warnings
 import pdb
 
-from scipy import integrate
-from scipy.interpolate import interp1d
-
 from astropy import units as u
 from astropy.modeling import FittableModel, Parameter
 from astropy.modeling import fitting
@@ -21,17 +18,175 @@ from astropy.modeling import fitting
 def _ftau_intgrnd(x,tau0=0.1):
     return 1 - np.exp(-tau0 * np.exp(-x**2))
 
-# Generate Ftau (could archive, but this is reasonably fast)
-neval = 10000
-lgt = np.linspace(-3, 9, neval)
-all_tau0 = 10.**lgt
-#
-xFtau0 = np.zeros(neval)
-for jj,tau0 in enumerate(all_tau0):
-    xFtau0[jj], ferr = integrate.quad(_ftau_intgrnd, 0, np.inf, args=(tau0,))
-
-# Now interpolate
-intFtau0 = interp1d(all_tau0, xFtau0, bounds_error=False,fill_value=0.)
+
+# Grid of the COG table;  F(tau0, a) is integrated over x on a grid
+# uniform in ln x between 10**log_xmin and 10**log_xmax
+cog_table_grid = dict(log_tau0_min=-3., log_tau0_max=10., dlog_tau0=0.01,
+                      log_a_min=-10., log_a_max=0., dlog_a=0.02,
+                      log_xmin=-3., log_xmax=7., nx=1500)
+_cog_table = {}
+
+
+def build_cog_table(grid=None):
+    """ Tabulate the curve of growth
+
+    F(tau0, a) = int_0^inf [1 - exp(-tau0 H(a,x))] dx, where H is the
+    Voigt function, so that W/lambda = 2 b F / c.  The integral is a
+    trapezoid rule in ln x, with the analytic damping-wing tail beyond
+    the grid.  The tabulated F are accurate to ~1e-7 (relative).
+
+    Parameters
+    ----------
+    grid : dict, optional
+      Defaults to cog_table_grid
+
+    Returns
+    -------
+    table : dict
+      log_tau0 and log_a grids, logF (ntau0, na) of ln F and
+      logF0 (ntau0,) of ln F for a=0
+    """
+    from scipy.special import wofz
+    if grid is None:
+        grid = cog_table_grid
+    log_tau0 = np.arange(grid['log_tau0_min'], grid['log_tau0_max'] + grid['dlog_tau0']/2.,
+                         grid['dlog_tau0'])
+    log_a = np.arange(grid['log_a_min'], grid['log_a_max'] + grid['dlog_a']/2., grid['dlog_a'])
+    lnx = np.linspace(grid['log_xmin'], grid['log_xmax'], grid['nx']) * np.log(10.)
+    xval = np.exp(lnx)
+    wgt = np.full(lnx.size, lnx[1] - lnx[0]) * xval
+    wgt[[0, -1]] /= 2.
+    tau0 = 10.**log_tau0
+    Ftau = np.zeros((log_tau0.size, log_a.size + 1))
+    for jj, aval in enumerate(np.concatenate([[0.], 10.**log_a])):
+        hval = wofz(xval + 1j*aval).real
+        hcore = wofz(1j*aval).real
+        # [0, xmin], grid, and the tail where H = a/(sqrt(pi) x^2)
+        Ftau[:, jj] = xval[0] * -np.expm1(-tau0*hcore) + \
+            np.dot(-np.expm1(-np.outer(tau0, hval)), wgt) + \
+            tau0 * aval / (np.sqrt(np.pi) * xval[-1])
+    return dict(log_tau0=log_tau0, log_a=log_a, logF=np.log(Ftau[:, 1:]),
+                logF0=np.log(Ftau[:, 0]), grid=grid)
+
+
+def cog_table_file():
+    """ Default file of the COG table, in the astropy cache directory
+    """
+    from astropy.config import get_cache_dir
+    return os.path.join(get_cache_dir(), 'linetools', 'cog_table_v1.npz')
+
+
+def get_cog_table(cache_file=None, rebuild=False):
+    """ The COG table, built on first use and cached on disk
+
+    Parameters
+    ----------
+    cache_file : str, optional
+      Defaults to cog_table_file().  If it cannot be written, the
+      table is only held in memory
+    rebuild : bool, optional
+      Rebuild the table, e.g. after editing cog_table_grid
+
+    Returns
+    -------
+    table : dict
+      See build_cog_table()
+    """
+    if ('table' in _cog_table) and not rebuild:
+        return _cog_table['table']
+    if cache_file is None:
+        try:
+            cache_file = cog_table_file()
+        except Exception:  # No cache directory
+            cache_file = None
+    table = None
+    if (cache_file is not None) and os.path.isfile(cache_file) and not rebuild:
+        with np.load(cache_file) as data:
+            grid = dict(zip(data['grid_keys'], data['grid_vals']))
+            if all([np.isclose(grid.get(key, np.nan), item)
+                    for key, item in cog_table_grid.items()]):
+                table = dict(log_tau0=data['log_tau0'], log_a=data['log_a'],
+                             logF=data['logF'], logF0=data['logF0'], grid=cog_table_grid)
+    if table is None:
+        table = build_cog_table()
+        if cache_file is not None:
+            try:
+                if not os.path.isdir(os.path.dirname(cache_file)):
+                    os.makedirs(os.path.dirname(cache_file))
+                keys = sorted(cog_table_grid.keys())
+                np.savez(cache_file, log_tau0=table['log_tau0'], log_a=table['log_a'],
+                         logF=table['logF'], logF0=table['logF0'],
+                         grid_keys=np.array(keys), grid_vals=np.array([cog_table_grid[key]
+                                                                      for key in keys]))
+            except (IOError, OSError):
+                warnings.warn("Could not write the COG table to {:s}".format(cache_file))
+    _cog_table['table'] = table
+    return table
+
+
+def Ftau0_a(tau0, a=0.):
+    """ F(tau0, a) of the curve of growth, W/lambda = 2 b F / c,
+    from the COG table
+
+    Below the tau0 of the table F is the optically thin limit
+    sqrt(pi)/2 tau0 (1 - tau0/2^1.5).  Above it F is the larger of the
+    Doppler limit, scaled as sqrt(ln tau0), and the damping limit
+    sqrt(sqrt(pi) tau0 a).  Below the a of the table F is interpolated
+    linearly from a=0.  Within the table, the bilinear interpolation
+    of ln F is good to 5e-5 (relative) at worst, and typically 1e-6.
+
+    Parameters
+    ----------
+    tau0 : float or ndarray
+      Central optical depth (of the Doppler profile)
+    a : float or ndarray, optional
+      Damping parameter, Gamma lambda / (4 pi b).  Broadcast with tau0
+
+    Returns
+    -------
+    F : float or ndarray
+    """
+    table = get_cog_table()
+    tau0, a = np.broadcast_arrays(np.asarray(tau0, dtype=float), np.asarray(a, dtype=float))
+    shape = tau0.shape
+    tau0, a = tau0.ravel(), a.ravel()
+    log_tau0, log_a = table['log_tau0'], table['log_a']
+    with np.errstate(divide='ignore'):
+        lt = np.log10(tau0)
+        la = np.log10(a)
+    # Bilinear interpolation of ln F
+    ft = (np.clip(lt, log_tau0[0], log_tau0[-1]) - log_tau0[0]) / (log_tau0[1] - log_tau0[0])
+    it = np.minimum(ft.astype(int), log_tau0.size - 2)
+    ft -= it
+    fa = (np.clip(la, log_a[0], log_a[-1]) - log_a[0]) / (log_a[1] - log_a[0])
+    ia = np.minimum(fa.astype(int), log_a.size - 2)
+    fa -= ia
+    logF = table['logF']
+    Ftau = np.exp((1-ft)*(1-fa)*logF[it, ia] + ft*(1-fa)*logF[it+1, ia] +
+                  (1-ft)*fa*logF[it, ia+1] + ft*fa*logF[it+1, ia+1])
+    # Small a
+    small = la < log_a[0]
+    if np.any(small):
+        F0 = np.exp((1-ft[small])*table['logF0'][it[small]] +
+                    ft[small]*table['logF0'][it[small]+1])
+        Ftau[small] = F0 + (Ftau[small] - F0) * a[small] / 10.**log_a[0]
+    # Beyond tau0 of the table
+    thin = lt < log_tau0[0]
+    Ftau[thin] = np.sqrt(np.pi) / 2. * tau0[thin] * (1 - tau0[thin] / 2**1.5)
+    thick = lt > log_tau0[-1]
+    if np.any(thick):
+        Fdopp = Ftau[thick] * np.sqrt(lt[thick] / log_tau0[-1])
+        Ftau[thick] = np.maximum(Fdopp, np.sqrt(np.sqrt(np.pi) * tau0[thick] * a[thick]))
+    if len(shape) == 0:
+        return Ftau[0]
+    return Ftau.reshape(shape)
+
+
+def intFtau0(tau0):
+    """ F(tau0) of a Doppler (a=0) curve of growth;  see Ftau0_a()
+    """
+    return Ftau0_a(tau0, 0.)
+
 
 ##############################
 def cog_plot(COG_dict):
@@ -153,3 +153,70 @@ def interp_Akima(x_new, x, y):
     """
     interpolator = AkimaSpline(x, y)
     return interpolator(x_new)
+
+
+def interp_Akima_rows(x_new, x, y, fill_value=np.nan):
+    """Akima interpolation of many curves sampled at the same points
+
+    The same as calling interp_Akima() on each row of `y`, but with
+    array operations over all of the rows at once.  Unlike
+    interp_Akima(), points outside `x` are given `fill_value`
+    rather than being linearly extrapolated.
+
+    Parameters
+    ----------
+    x_new : array_like, shape (M,) or (K, M)
+        Values at which to interpolate;  one row per curve, or
+        the same values for all of them.
+    x : array_like, shape (N,)
+        Increasing reference values, shared by the curves.
+    y : array_like, shape (N,) or (K, N)
+        Reference values of the curves.
+    fill_value : float, optional
+        Value outside [x[0], x[-1]].
+
+    Returns
+    -------
+    vals : ndarray, shape (K, M)
+       Interpolated values.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    if x.ndim != 1:
+        raise ValueError("x array must be one dimensional")
+    n = len(x)
+    if n < 3:
+        raise ValueError("Array too small")
+    if n != y.shape[1]:
+        raise ValueError("Size of x-array must match data shape")
+    dx = np.diff(x)
+    if (dx <= 0.0).any():
+        raise ValueError("x array must be increasing, without duplicates")
+
+    # Slopes, as in AkimaSpline, for all of the rows
+    m = np.diff(y, axis=1) / dx
+    mm = 2. * m[:, 0] - m[:, 1]
+    mmm = 2. * mm - m[:, 0]
+    mp = 2. * m[:, n - 2] - m[:, n - 3]
+    mpp = 2. * mp - m[:, n - 2]
+    m1 = np.concatenate((mmm[:, None], mm[:, None], m, mp[:, None], mpp[:, None]), axis=1)
+
+    dm = np.abs(np.diff(m1, axis=1))
+    f1 = dm[:, 2:n + 2]
+    f2 = dm[:, 0:n]
+    f12 = f1 + f2
+    ids = f12 > 1e-9 * np.max(f12, axis=1)[:, None]
+    b = np.where(ids, (f1 * m1[:, 1:n + 1] + f2 * m1[:, 2:n + 2]) / np.where(ids, f12, 1.),
+                 m1[:, 1:n + 1])
+    c = (3. * m - 2. * b[:, 0:n - 1] - b[:, 1:n]) / dx
+    d = (b[:, 0:n - 1] + b[:, 1:n] - 2. * m) / dx ** 2
+
+    # Evaluate
+    x_new = np.asarray(x_new, dtype=np.float64)
+    x_new = np.broadcast_to(x_new, (y.shape[0], x_new.shape[-1]))
+    bins = np.clip(np.searchsorted(x, x_new, side='right') - 1, 0, n - 2)
+    wj = x_new - x[bins]
+    out = ((wj * np.take_along_axis(d, bins, axis=1) + np.take_along_axis(c, bins, axis=1))
+           * wj + np.take_along_axis(b, bins, axis=1)) * wj + np.take_along_axis(y, bins, axis=1)
+    out[(x_new < x[0]) | (x_new > x[-1])] = fill_value
+    return out
@@ -147,3 +147,63 @@ def test_Wr_from_N_transition_and_viceversa():
     with pytest.raises(ValueError):
         Wr = N_from_Wr_transition(Wr[0], transition='Wrong name jojo')
 
+
+
+def test_transition_arrays():
+    from linetools.analysis.absline import transition_data
+    trans = np.array(['HI 1215', 'CIV 1548', 'SiII 1260', 'HI 1215'])
+    wrest, fosc, gamma = transition_data(trans)
+    assert wrest.shape == (4,)
+    np.testing.assert_allclose(wrest[0].value, 1215.67, rtol=1e-6)
+    assert np.isclose(fosc[3], fosc[0])
+    wrest, fosc, gamma = transition_data('CIV 1548')
+    assert np.isclose(fosc, 0.1899, rtol=1e-3)
+    # (transition, N) grids
+    N = 10**np.linspace(12.0, 16.0, 50) / (u.cm*u.cm)
+    b = 10 * u.km/u.s
+    Wr = Wr_from_N_b_transition(N, b, trans[:, np.newaxis])
+    assert Wr.shape == (4, 50)
+    Wr2 = Wr_from_N_transition(N, trans[:, np.newaxis])
+    N2 = N_from_Wr_transition(Wr2, trans[:, np.newaxis])
+    for ii, itrans in enumerate(trans):
+        np.testing.assert_allclose(Wr[ii], Wr_from_N_b_transition(N, b*np.ones(50), itrans))
+        np.testing.assert_allclose(Wr2[ii], Wr_from_N_transition(N, itrans))
+        np.testing.assert_allclose(N2[ii], N, rtol=1e-5)
+    # Unknown transition
+    with pytest.raises(ValueError):
+        Wr_from_N_transition(N[0], np.array(['HI 1215', 'Wrong name jojo']))
+
+
+def test_aodm_batch():
+    import os
+    from linetools.spectra import io as lsio
+    from linetools.spectralline import AbsLine
+    from linetools.analysis.absline import measure_aodm_abslines, measure_aodm_lines
+    spec_fil = os.path.join(os.path.dirname(__file__), '../../spectra/tests/files/UM184_nF.fits')
+    spec = lsio.readspec(spec_fil)
+    lines, lines2 = [], []
+    for trans in ['CIV 1548', 'CIV 1550', 'HI 1215', 'SiII 1808', 'HI 972']:
+        for llist in [lines, lines2]:
+            aline = AbsLine(trans, z=2.92929)
+            aline.analy['spec'] = spec
+            aline.limits.set((-150., 150.)*u.km/u.s)
+            llist.append(aline)
+    for aline in lines:
+        aline.measure_aodm()
+    measure_aodm_abslines(lines2)
+    for aline, aline2 in zip(lines, lines2):
+        assert aline.attrib['flag_N'] == aline2.attrib['flag_N']
+        np.testing.assert_allclose(aline2.attrib['N'].value, aline.attrib['N'].value, rtol=1e-6)
+        np.testing.assert_allclose(aline2.attrib['sig_N'].value, aline.attrib['sig_N'].value,
+                                   rtol=1e-6)
+        assert aline2.attrib['N'].unit == 1/u.cm**2
+    # Velocity limits
+    N, sig_N, flag_N = measure_aodm_lines(spec, [iline.wrest for iline in lines],
+                                          [iline.data['f'] for iline in lines], 2.92929,
+                                          vlim=[-150., 150.]*u.km/u.s)
+    np.testing.assert_allclose(N.value, [iline.attrib['N'].value for iline in lines2])
+    np.testing.assert_allclose(flag_N, [iline.attrib['flag_N'] for iline in lines2])
+    # Not covered
+    N, sig_N, flag_N = measure_aodm_lines(spec, [1215.67]*u.AA, 0.4164, 0.1,
+                                          vlim=[-150., 150.]*u.km/u.s)
+    assert flag_N[0] == 0
@@ -0,0 +1,95 @@
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import os
+import numpy as np
+import pytest
+
+from astropy import units as u
+
+from linetools.analysis import cog as ltcog
+from linetools.analysis.absline import Wr_from_N_b, Wr_from_N_b_transition
+from linetools.lists.linelist import LineList
+
+
+def data_path(filename):
+    data_dir = os.path.join(os.path.dirname(__file__), 'files')
+    return os.path.join(data_dir, filename)
+
+
+def test_cog_table():
+    from scipy import integrate
+    from scipy.special import wofz
+    # Against quadrature
+    for tau0, aval in [(0.01, 0.), (3., 1e-3), (1e4, 1e-5), (1e6, 0.01), (5e8, 1e-3)]:
+        intgrnd = lambda x: -np.expm1(-tau0 * wofz(x + 1j*aval).real)
+        quad = np.sum([integrate.quad(intgrnd, x0, x1, limit=200)[0]
+                       for x0, x1 in [(0., 5.), (5., 1e3), (1e3, 1e6)]])
+        quad += tau0 * aval / np.sqrt(np.pi) / 1e6
+        np.testing.assert_allclose(ltcog.Ftau0_a(tau0, aval), quad, rtol=1e-3)
+    # Large a, between the nodes of the table
+    for tau0, aval in [(30., 0.3), (1., 0.3)]:
+        intgrnd = lambda x: -np.expm1(-tau0 * wofz(x + 1j*aval).real)
+        quad = np.sum([integrate.quad(intgrnd, x0, x1, limit=200)[0]
+                       for x0, x1 in [(0., 5.), (5., 1e3), (1e3, 1e6), (1e6, 1e8)]])
+        np.testing.assert_allclose(ltcog.Ftau0_a(tau0, aval), quad, rtol=5e-5)
+    # Thin limit and continuity at the edges of the table
+    np.testing.assert_allclose(ltcog.Ftau0_a(1e-5), np.sqrt(np.pi)/2*1e-5, rtol=1e-5)
+    for aval in [0., 1e-3]:
+        edges = 10.**np.array([-3 - 1e-9, -3 + 1e-9, 10 - 1e-9, 10 + 1e-9])
+        Fval = ltcog.Ftau0_a(edges, aval)
+        np.testing.assert_allclose(Fval[0], Fval[1], rtol=1e-4)
+        np.testing.assert_allclose(Fval[2], Fval[3], rtol=1e-4)
+    # Broadcasting
+    Fval = ltcog.Ftau0_a(np.logspace(-4, 11, 1000)[:, None], np.array([0., 1e-12, 1e-4]))
+    assert Fval.shape == (1000, 3)
+    assert np.all(np.diff(Fval, axis=0) > 0.)
+    # Disk cache
+    cfile = data_path('tmp_cog_table.npz')
+    if os.path.isfile(cfile):
+        os.remove(cfile)
+    table = ltcog.get_cog_table(cache_file=cfile, rebuild=True)
+    assert os.path.isfile(cfile)
+    table2 = ltcog.get_cog_table(cache_file=cfile, rebuild=False)
+    assert table2 is table
+    ltcog._cog_table.clear()
+    table3 = ltcog.get_cog_table(cache_file=cfile)
+    np.testing.assert_allclose(table3['logF'], table['logF'])
+    os.remove(cfile)
+
+
+def test_Wr_cog():
+    lya = LineList('HI')['HI 1215']
+    N = 10**np.linspace(12.0, 22.0, 4) / (u.cm*u.cm)
+    b = 10 * u.km/u.s
+    Wr = Wr_from_N_b(N, b, lya['wrest'], lya['f'], lya['gamma'], method='cog')
+    Wr_draine = Wr_from_N_b(N, b*np.ones(4), lya['wrest'], lya['f'], lya['gamma'])
+    np.testing.assert_allclose(Wr.value, Wr_draine.value, rtol=0.05)
+    # Against a Voigt profile
+    from linetools.analysis import voigt as lav
+    wave = np.linspace(1205., 1226., 200000)
+    for logN in [13., 15., 18.]:
+        par = np.array([[logN, 0., 1e6, lya['wrest'].to('cm').value, lya['f'],
+                         lya['gamma'].value]]).T
+        tau = lav.voigt_tau_multi(wave*1e-8, par, tau_min=None)
+        EW = np.sum(-np.expm1(-tau)) * (wave[1] - wave[0])
+        # Damping wings beyond the grid
+        dwv = lya['wrest'].value * 10. / 3e5
+        tau0 = 1.497e-15 * 10**logN * lya['f'] * lya['wrest'].value / 10.
+        avoigt = lya['gamma'].value * lya['wrest'].value * 1e-8 / (4 * np.pi * 1e6)
+        EW += 2 * tau0 * avoigt * dwv**2 / np.sqrt(np.pi) / 10.5
+        Wr = Wr_from_N_b(10**logN/u.cm**2, b, lya['wrest'], lya['f'], lya['gamma'],
+                         method='cog')
+        np.testing.assert_allclose(Wr.to('AA').value, EW, rtol=1e-3)
+    # Large grids
+    logN, bval = np.meshgrid(np.linspace(12., 20., 1000), np.linspace(5., 50., 1000))
+    Wr = Wr_from_N_b_transition(10**logN/u.cm**2, bval*u.km/u.s, 'HI 1215', method='cog')
+    assert Wr.shape == (1000, 1000)
+    with pytest.raises(IOError):
+        Wr_from_N_b(N, b, lya['wrest'], lya['f'], lya['gamma'], method='bad')
+
+
+def test_cog_model():
+    wrestf = np.logspace(1, 4, 10)
+    redEW = ltcog.single_cog_model.evaluate(wrestf, 14., 10.)
+    tau0 = 1.497e-15 * wrestf * 1e14 / 10.
+    np.testing.assert_allclose(redEW, 2 * 10. * ltcog.intFtau0(tau0) / 3e5)
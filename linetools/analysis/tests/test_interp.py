@@ -7,3 +7,20 @@ def test_interp_Akima():
     x = np.sort(np.random.random(10) * 10)
     y = np.random.normal(0.0, 0.1, size=len(x))
     assert np.allclose(y, interp_Akima(x, x, y))
+
+
+def test_interp_Akima_rows():
+    from ..interp import interp_Akima_rows
+    rstate = np.random.RandomState(1)
+    x = np.sort(rstate.random_sample(20) * 10)
+    y = rstate.normal(0.0, 0.1, size=(5, len(x)))
+    y[2] = np.exp(-(x - 5.)**2)  # Flat stretches
+    x_new = np.sort(rstate.random_sample((5, 50)) * 12 - 1, axis=1)
+    vals = interp_Akima_rows(x_new, x, y, fill_value=0.)
+    assert vals.shape == (5, 50)
+    for ii in range(5):
+        inside = (x_new[ii] >= x[0]) & (x_new[ii] <= x[-1])
+        np.testing.assert_allclose(vals[ii][inside], interp_Akima(x_new[ii][inside], x, y[ii]))
+        assert np.all(vals[ii][~inside] == 0.)
+    # A shared x_new
+    np.testing.assert_allclose(interp_Akima_rows(x, x, y), y)
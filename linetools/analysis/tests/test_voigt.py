@@ -111,3 +111,174 @@ def test_voigt_from_components():
     comp1, HIlines = mk_comp('HI', zcomp=0.01, vlim=[-10,10]*u.km/u.s)
     comp2, HIlines = mk_comp('HI', zcomp=0.05, vlim=[-10,10]*u.km/u.s)
     model = lav.voigt_from_components(wv_array, [comp1,comp2])
+
+
+def test_voigt_tau_multi():
+    # Mock forest
+    rstate = np.random.RandomState(1234)
+    nline = 300
+    wave = np.linspace(3600., 3700., 20000) * 1e-8  # cm
+    par = np.zeros((6, nline))
+    par[0] = rstate.uniform(12., 16., nline)
+    par[1] = rstate.uniform(1.96, 2.04, nline)
+    par[2] = rstate.uniform(15., 40., nline) * 1e5
+    par[3] = 1215.67e-8
+    par[4] = 0.4164
+    par[5] = 6.265e8
+    # Loop
+    tau = np.zeros(wave.size)
+    for ii in range(nline):
+        tau += lav.voigt_tau(wave, par[:, ii])
+    # All pixels, in small batches
+    tau_all = lav.voigt_tau_multi(wave, par, tau_min=None, max_eval=100000)
+    np.testing.assert_allclose(tau_all, tau, rtol=1e-10)
+    # Windows;  each line errs by < tau_min
+    tau_win = lav.voigt_tau_multi(wave, par, tau_min=1e-6)
+    assert np.max(np.abs(tau_win - tau)) < 1e-6 * nline
+    for ii in range(3):
+        tau1 = lav.voigt_tau_multi(wave, par[:, ii], tau_min=1e-6)
+        assert np.max(np.abs(tau1 - lav.voigt_tau(wave, par[:, ii]))) < 1e-6
+    # Single line input
+    np.testing.assert_allclose(lav.voigt_tau_multi(wave, par[:, 0], tau_min=None),
+                               lav.voigt_tau(wave, par[:, 0]), rtol=1e-10)
+    # Unsorted wavelengths
+    pytest.raises(ValueError, lav.voigt_tau_multi, wave[::-1], par)
+
+
+def test_voigt_adaptive():
+    # Coarse pixels (~40 km/s)
+    wave = np.arange(3600., 3700., 0.5) * u.AA
+    lines = []
+    for z, logN, b in [(2.0, 14., 10.), (2.01, 13., 5.), (2.02, 20.3, 20.)]:
+        abslin = AbsLine(1215.670*u.AA, z=z)
+        abslin.attrib['N'] = 10**logN / u.cm**2
+        abslin.attrib['b'] = b * u.km/u.s
+        lines.append(abslin)
+    vmodel = lav.voigt_from_abslines(wave, lines, adaptive=True)
+    # Brute force pixel average
+    par = lav.par_from_abslines(lines)
+    fine = (np.arange(2000) + 0.5) / 2000.
+    sub = ((wave.value[:, np.newaxis] - 0.25) + 0.5 * fine[np.newaxis, :]).ravel()
+    tau = lav.voigt_tau_multi(sub * 1e-8, par, tau_min=None)
+    flux = np.exp(-tau).reshape(wave.size, -1).mean(axis=1)
+    np.testing.assert_allclose(vmodel.flux.value, flux, atol=2e-4)
+    # Tau
+    tau = lav.voigt_from_abslines(wave, lines, adaptive=True, ret='tau')
+    assert tau.size == wave.size
+    assert np.all(tau >= 0.)
+
+
+def test_voigt_kernels():
+    uval = np.linspace(0., 50., 5001)
+    for name, kernel in lav.voigt_kernels.items():
+        for a in [1e-5, 1e-3, 1e-2]:
+            exact = lav.voigt_wofz(uval, a)
+            voigt = lav.get_voigt_kernel(name)(uval, a)
+            assert np.max(np.abs(voigt - exact) / exact) <= kernel['max_rel_err'] * 1.01
+    # Optical depth
+    wave = np.linspace(3644, 3650, 100) * 1e-8
+    par = [14., 2., 25e5, 1215.67e-8, 0.4164, 6.265e8]
+    tau = lav.voigt_tau(wave, par)
+    np.testing.assert_allclose(lav.voigt_tau(wave, par, kernel='humlicek'), tau, rtol=1e-4)
+    np.testing.assert_allclose(lav.voigt_tau_multi(wave, par, kernel='table'), tau,
+                               rtol=3e-4, atol=1e-6)
+    pytest.raises(IOError, lav.voigt_tau, wave, par, kernel='bad')
+    # Benchmark
+    tbl = lav.benchmark_voigt_kernels(npts=1000, seed=1)
+    assert len(tbl) == len(lav.voigt_kernels)
+
+
+def test_voigt_fit_deriv():
+    from astropy.modeling import fitting
+    wave = np.linspace(3640, 3652, 300)
+    model = lav.multi_voigt_model(2, logN_0=14., b_0=25., z_0=2., wrest_0=1215.67,
+                                  f_0=0.4164, gamma_0=6.265e8, logN_1=13.5, b_1=15.,
+                                  z_1=2.0008, wrest_1=1215.67, f_1=0.4164,
+                                  gamma_1=6.265e8, fwhm=3.)
+    # Against finite differences
+    deriv = model.fit_deriv(wave, *model.parameters)
+    for ii, step in zip([0, 1, 2, 6, 7, 8], [1e-5, 1e-4, 1e-8]*2):
+        par = model.parameters.copy()
+        par[ii] += step
+        fplus = model.evaluate(wave, *par)
+        par[ii] -= 2*step
+        fminus = model.evaluate(wave, *par)
+        np.testing.assert_allclose(deriv[ii], (fplus-fminus)/2/step,
+                                   atol=1e-5*np.max(np.abs(deriv[ii])))
+    # Single model matches the first component
+    sngl = lav.single_voigt_model(logN=14., b=25., z=2., wrest=1215.67, f=0.4164,
+                                  gamma=6.265e8, fwhm=3.)
+    sderiv = sngl.fit_deriv(wave, *sngl.parameters)
+    model.logN_1 = 0.
+    np.testing.assert_allclose(model(wave), sngl(wave), rtol=1e-10)
+    np.testing.assert_allclose(model.fit_deriv(wave, *model.parameters)[1], sderiv[1],
+                               rtol=1e-8, atol=1e-14)
+    # Fit
+    model.logN_1 = 13.5
+    rstate = np.random.RandomState(1)
+    flux = model(wave) + rstate.normal(0., 0.02, wave.size)
+    init = model.copy()
+    init.logN_0, init.b_0, init.logN_1, init.b_1 = 13.7, 30., 13.2, 20.
+    fitter = fitting.LevMarLSQFitter()
+    parm = fitter(init, wave, flux)
+    assert np.abs(parm.logN_0.value - 14.) < 0.05
+    assert np.abs(parm.logN_1.value - 13.5) < 0.05
+
+
+def test_tau_cache():
+    wave = np.linspace(3640., 3652., 2000)
+    lines = []
+    for z, logN in zip([2., 2.0003, 2.0006], [14., 13., 13.5]):
+        abslin = AbsLine(1215.670*u.AA, z=z)
+        abslin.attrib['N'] = 10**logN / u.cm**2
+        abslin.attrib['b'] = 25.*u.km/u.s
+        lines.append(abslin)
+    par = lav.par_from_abslines(lines)
+    cache = lav.TauCache()
+    tau = cache.tau(wave*1e-8, par)
+    np.testing.assert_allclose(tau, lav.voigt_tau_multi(wave*1e-8, par, tau_min=None),
+                               atol=3*1e-6)
+    assert cache.stats['misses'] == 3
+    # Change one line;  only it is recomputed
+    par[0, 1] = 13.2
+    tau2 = cache.tau(wave*1e-8, par)
+    assert (cache.hits, cache.misses) == (2, 4)
+    np.testing.assert_allclose(tau2, lav.voigt_tau_multi(wave*1e-8, par, tau_min=None),
+                               atol=3*1e-6)
+    # Grid edited in place
+    wv = wave*1e-8
+    cache.tau(wv, par)
+    tt = np.linspace(0., 1., wv.size)
+    wv[:] = wv[0] + (wv[-1] - wv[0]) * tt**1.2
+    np.testing.assert_allclose(cache.tau(wv, par),
+                               lav.voigt_tau_multi(wv, par, tau_min=None), atol=3*1e-6)
+    # Lines are kept apart by kernel
+    nkey = len(cache)
+    cache.kernel = 'tepper'
+    cache.tau(wave*1e-8, par)
+    assert len(cache) == nkey + 3
+    cache.kernel = 'wofz'
+    # Convolved models
+    lines[1].attrib['N'] = 10**13.2 / u.cm**2
+    flux = lav.voigt_from_abslines(wave*u.AA, lines, fwhm=3., ret=['flux'], cache=cache)
+    hits = cache.hits
+    flux2 = lav.voigt_from_abslines(wave*u.AA, lines, fwhm=3., ret=['flux'], cache=cache)
+    assert cache.hits == hits + 1
+    np.testing.assert_allclose(flux2, flux)
+    np.testing.assert_allclose(flux, lav.voigt_from_abslines(wave*u.AA, lines, fwhm=3.,
+                                                             ret=['flux']), atol=1e-5)
+    # Models on a sub-grid, or not, are kept apart
+    coarse = np.linspace(3640., 3652., 200)
+    flux_sub = lav.voigt_from_abslines(coarse*u.AA, lines, fwhm=3., ret=['flux'], cache=cache)
+    flux_skip = lav.voigt_from_abslines(coarse*u.AA, lines, fwhm=3., ret=['flux'], cache=cache,
+                                        skip_wveval=True)
+    np.testing.assert_allclose(flux_skip, lav.voigt_from_abslines(
+        coarse*u.AA, lines, fwhm=3., ret=['flux'], skip_wveval=True), atol=1e-5)
+    assert np.max(np.abs(flux_skip - flux_sub)) > 1e-3
+    # Eviction
+    small = lav.TauCache(max_bytes=wave.nbytes)
+    small.tau(wave*1e-8, par)
+    assert small.nbytes <= wave.nbytes
+    assert small.evictions > 0
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,127 @@
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+import pytest
+
+from astropy import units as u
+
+from linetools.spectralline import AbsLine
+from linetools.lists.linelist import LineList
+from linetools.isgm.abscomponent import AbsComponent
+from linetools.spectra.xspectrum1d import XSpectrum1D
+from linetools.analysis import voigt as lav
+from linetools.analysis.voigtfit import JointVoigtFitter
+
+ism = LineList('ISM')
+
+
+def mk_comp(trans, z, logN, b, vlim=[-150., 150.]*u.km/u.s):
+    lines = []
+    for wrest in trans:
+        iline = AbsLine(wrest, z=z, linelist=ism)
+        iline.limits.set(vlim)
+        iline.attrib['N'] = 10**logN / u.cm**2
+        iline.attrib['b'] = b * u.km/u.s
+        lines.append(iline)
+    comp = AbsComponent.from_abslines(lines)
+    return comp
+
+
+def test_joint_fit():
+    z = 2.
+    HI = mk_comp(['HI 1215', 'HI 1025'], z, 14.2, 25.)
+    CIV = mk_comp(['CIV 1548', 'CIV 1550'], z + 20.*(1+z)/3e5, 13.5, 12.)
+    # Spectrum
+    wave = np.arange(3050., 4680., 0.04)
+    lines = HI._abslines + CIV._abslines
+    vmodel = lav.voigt_from_abslines(wave*u.AA, lines, fwhm=3., skip_wveval=True)
+    rstate = np.random.RandomState(2)
+    sig = 0.02
+    spec = XSpectrum1D.from_tuple((wave, vmodel.flux.value + rstate.normal(0., sig, wave.size),
+                                   np.full(wave.size, sig)))
+    # Starting values
+    for comp, logN, b in zip([HI, CIV], [13.8, 13.9], [35., 8.]):
+        comp.attrib['logN'] = logN
+        comp.attrib['b'] = b * u.km/u.s
+        comp.attrib['vel'] = 0. * u.km/u.s
+    CIV.attrib['vel'] = -5. * u.km/u.s
+    fitter = JointVoigtFitter([HI, CIV], spec=spec, lsf=3.)
+    # Only the pixels about the 4 lines
+    assert len(fitter.chunks) == 4
+    assert np.sum([len(chunk['flux']) for chunk in fitter.chunks]) < wave.size // 10
+    # Jacobian against finite differences
+    x = fitter.params[fitter.free]
+    _, jac = fitter._evaluate(x, deriv=True)
+    jac = jac.toarray()
+    for ii, step in enumerate([1e-5, 1e-4, 1e-4]*2):
+        xp, xm = x.copy(), x.copy()
+        xp[ii] += step
+        xm[ii] -= step
+        fd = (fitter.residuals(xp) - fitter.residuals(xm)) / 2 / step
+        np.testing.assert_allclose(jac[:, ii], fd, atol=1e-4*np.max(np.abs(fd)))
+    # Fit
+    fitter.fit()
+    assert np.abs(HI.attrib['logN'] - 14.2) < 3*HI.attrib['sig_logN'][0] + 0.01
+    assert np.abs(HI.attrib['b'].value - 25.) < 1.
+    assert np.abs(CIV.attrib['logN'] - 13.5) < 0.05
+    assert np.abs(CIV.attrib['vel'].value) < 0.5
+    assert HI.attrib['sig_b'].value > 0.
+    assert np.isclose(HI._abslines[1].attrib['N'].value, 10**HI.attrib['logN'])
+    # Fixed parameter
+    fitter = JointVoigtFitter([HI, CIV], spec=spec, lsf=3., fixed=[(1, 'b')])
+    assert np.sum(fitter.free) == 5
+    fitter.fit(update=False)
+    assert fitter.params[1, 1] == CIV.attrib['b'].value
+    # Model
+    models = fitter.model()
+    assert len(models) == 4
+    # Nothing to fit
+    fixed = [(ii, name) for ii in range(2) for name in fitter.param_names]
+    fitter = JointVoigtFitter([HI, CIV], spec=spec, lsf=3., fixed=fixed)
+    with pytest.raises(IOError):
+        fitter.fit()
+
+
+def test_likelihood():
+    from linetools.analysis.voigtfit import VoigtLikelihood
+    z = 2.
+    HI = mk_comp(['HI 1215', 'HI 1025'], z, 14.2, 25.)
+    civ = AbsLine('CIV 1548', z=z, linelist=ism)
+    civ.attrib['N'] = 10**13.5 / u.cm**2
+    civ.attrib['b'] = 12. * u.km/u.s
+    wave = np.arange(3050., 4680., 0.04)
+    vmodel = lav.voigt_from_abslines(wave*u.AA, HI._abslines + [civ], fwhm=3.,
+                                     skip_wveval=True)
+    rstate = np.random.RandomState(3)
+    sig = 0.02
+    flux = vmodel.flux.value + rstate.normal(0., sig, wave.size)
+    spec = XSpectrum1D.from_tuple((wave, flux, np.full(wave.size, sig)))
+    HI.attrib['logN'] = 14.2
+    HI.attrib['b'] = 25. * u.km/u.s
+    # Fit only about the lines
+    mask = np.zeros(wave.size, dtype=bool)
+    for wv in [1215.67, 1025.72, 1548.2]:
+        mask[np.abs(wave - wv*(1+z)) < 3.] = True
+    like = VoigtLikelihood(spec, [HI, civ], mask=mask, lsf=3.,
+                           bounds=dict(logN=(10., 16.), b=(1., 80.), v=(-50., 50.)))
+    assert like.p0.size == 6
+    np.testing.assert_allclose(like.p0, [14.2, 25., 0., 13.5, 12., 0.])
+    # Model against voigt_from_abslines
+    np.testing.assert_allclose(like.model(like.p0)[0], vmodel.flux.value[mask], atol=1e-4)
+    chi2 = np.sum(((flux - vmodel.flux.value) / sig)[mask]**2)
+    lnL = like.log_likelihood(like.p0)
+    np.testing.assert_allclose(lnL, like.lnorm - 0.5*chi2, rtol=1e-3)
+    # Batch of walkers
+    thetas = like.p0 + rstate.normal(0., 0.1, (10, 6))
+    lnLs = like.log_likelihood(thetas)
+    assert lnLs.shape == (10,)
+    np.testing.assert_allclose(lnLs, [like.log_likelihood(theta) for theta in thetas])
+    assert np.all(lnLs <= lnL + 10.)
+    # Bounds
+    thetas[0, 1] = -5.
+    lnp = like(thetas)
+    assert lnp[0] == -np.inf
+    np.testing.assert_allclose(lnp[1:], lnLs[1:])
+    # Update
+    like.update_lines(thetas[1], [HI, civ])
+    assert np.isclose(civ.attrib['logN'], thetas[1, 3])
@@ -7,6 +7,9 @@ from __future__ import print_function, absolute_import, division, unicode_litera
 import numpy as np
 import warnings
 import pdb
+import time
+import hashlib
+from collections import OrderedDict
 
 from scipy.special import wofz
 
@@ -81,7 +84,221 @@ def voigtking(vin, a):
     return voigt_prof
 
 
-def voigt_tau(wave, par):
+def voigt_humlicek(vin, a):
+    """ Humlicek (1982, JQSRT 27, 437) W4 rational approximation
+
+    Maximum relative error ~1e-4.
+
+    Parameters
+    ----------
+    vin : ndarray
+      u parameter
+    a : float or ndarray
+      a parameter
+
+    Returns
+    -------
+    voigt : ndarray
+    """
+    x = np.asarray(vin, dtype=float)
+    y = np.broadcast_to(np.asarray(a, dtype=float), x.shape)
+    t = y - 1j * x
+    s = np.abs(x) + y
+    w = np.zeros(x.shape, dtype=complex)
+    # Region I
+    reg = s >= 15.
+    tt = t[reg]
+    w[reg] = tt * 0.5641896 / (0.5 + tt*tt)
+    # Region II
+    reg = (s < 15.) & (s >= 5.5)
+    tt = t[reg]
+    uu = tt*tt
+    w[reg] = tt * (1.410474 + uu*0.5641896) / (0.75 + uu*(3. + uu))
+    # Region III
+    reg3 = (s < 5.5) & (y >= 0.195*np.abs(x) - 0.176)
+    tt = t[reg3]
+    w[reg3] = ((16.4955 + tt*(20.20933 + tt*(11.96482 + tt*(3.778987 + tt*0.5642236)))) /
+               (16.4955 + tt*(38.82363 + tt*(39.27121 + tt*(21.69274 + tt*(6.699398 + tt))))))
+    # Region IV
+    reg = (s < 5.5) & ~reg3
+    tt = t[reg]
+    uu = tt*tt
+    w[reg] = np.exp(uu) - tt*(36183.31 - uu*(3321.9905 - uu*(1540.787 - uu*(219.0313 - uu*(
+        35.76683 - uu*(1.320522 - uu*0.56419)))))) / (32066.6 - uu*(24322.84 - uu*(
+        9022.228 - uu*(2186.181 - uu*(364.2191 - uu*(61.57037 - uu*(1.841439 - uu)))))))
+    return w.real
+
+
+def voigt_tepper(vin, a):
+    """ Tepper-Garcia (2006, MNRAS 369, 2025) approximation
+
+    First order in a, so only for a << 1.  The maximum relative
+    error, ~1e-2 for a = 1e-6 rising to ~7e-2 for a = 1e-2, occurs where the
+    Gaussian core meets the Lorentzian wings (u ~ 3-4, where H ~ 1e-7)
+    and is far smaller in the core and the far wings.
+
+    Parameters
+    ----------
+    vin : ndarray
+      u parameter
+    a : float or ndarray
+      a parameter
+
+    Returns
+    -------
+    voigt : ndarray
+    """
+    y = np.asarray(vin, dtype=float)**2
+    h0 = np.exp(-y)
+    # Series for small u, where the bracket cancels
+    small = y < 1e-4
+    ys = np.where(small, 1., y)
+    q = 1.5 / ys
+    brk = (h0*h0*(4.*ys*ys + 7.*ys + 4. + q) - q - 1.) / ys
+    brk = np.where(small, 2. - 4.*y + 5./3.*y*y, brk)
+    return h0 - a / np.sqrt(np.pi) * brk
+
+
+# Lookup table of ln H(a,u) for voigt_table();  built on first use
+_voigt_table = {}
+voigt_table_grid = dict(du=0.01, umax=15., log_amin=-7., log_amax=1., dlog_a=0.02)
+
+
+def voigt_table(vin, a):
+    """ Bilinear interpolation in a table of ln H(a,u)
+
+    The table (see voigt_table_grid) covers 0 <= u < 15 and
+    1e-7 <= a <= 10, and is computed with wofz on first use.  Beyond u=15
+    Humlicek's region I is used and outside the a range wofz.
+    Maximum relative error ~3e-4.
+
+    Parameters
+    ----------
+    vin : ndarray
+      u parameter
+    a : float or ndarray
+      a parameter
+
+    Returns
+    -------
+    voigt : ndarray
+    """
+    grid = voigt_table_grid
+    if 'lnH' not in _voigt_table:
+        ugrid = np.arange(0., grid['umax'] + grid['du']/2., grid['du'])
+        lagrid = np.arange(grid['log_amin'], grid['log_amax'] + grid['dlog_a']/2.,
+                           grid['dlog_a'])
+        _voigt_table['lnH'] = np.log(voigt_wofz(ugrid[np.newaxis, :],
+                                                10.**lagrid[:, np.newaxis]))
+    lnH = _voigt_table['lnH']
+    uu = np.abs(np.asarray(vin, dtype=float))
+    aa = np.broadcast_to(np.asarray(a, dtype=float), uu.shape)
+    la = np.log10(aa)
+    voigt = np.zeros(uu.shape)
+    # Table
+    intab = (uu < grid['umax']) & (la >= grid['log_amin']) & (la <= grid['log_amax'])
+    fu = uu[intab] / grid['du']
+    iu = np.minimum(fu.astype(int), lnH.shape[1] - 2)
+    fu -= iu
+    fa = (la[intab] - grid['log_amin']) / grid['dlog_a']
+    ia = np.minimum(fa.astype(int), lnH.shape[0] - 2)
+    fa -= ia
+    voigt[intab] = np.exp((lnH[ia, iu]*(1.-fu) + lnH[ia, iu+1]*fu)*(1.-fa) +
+                          (lnH[ia+1, iu]*(1.-fu) + lnH[ia+1, iu+1]*fu)*fa)
+    # Far wings
+    wing = (uu >= grid['umax']) & (la <= grid['log_amax'])
+    voigt[wing] = voigt_humlicek(uu[wing], aa[wing])
+    # Other a values
+    other = ~(intab | wing)
+    voigt[other] = voigt_wofz(uu[other], aa[other])
+    return voigt
+
+
+# Voigt kernels H(a,u) for voigt_tau(), by name, with the maximum
+# relative error over 0 <= u <= 100, 1e-6 <= a <= 1 (a <= 1e-2 for 'tepper')
+voigt_kernels = OrderedDict()
+
+
+def register_voigt_kernel(name, func, max_rel_err):
+    """ Add a Voigt kernel
+
+    Parameters
+    ----------
+    name : str
+    func : function
+      func(u, a) returning H(a,u);  a may be a float or an ndarray
+      matching u
+    max_rel_err : float
+      Maximum relative error of H
+    """
+    voigt_kernels[name] = dict(func=func, max_rel_err=max_rel_err)
+
+
+register_voigt_kernel('wofz', voigt_wofz, 0.)
+register_voigt_kernel('humlicek', voigt_humlicek, 1e-4)
+register_voigt_kernel('table', voigt_table, 3e-4)
+register_voigt_kernel('tepper', voigt_tepper, 7e-2)
+
+
+def get_voigt_kernel(kernel):
+    """ Kernel function from its name
+
+    Parameters
+    ----------
+    kernel : str or function
+      Name in voigt_kernels, or a function func(u, a)
+
+    Returns
+    -------
+    func : function
+    """
+    if callable(kernel):
+        return kernel
+    try:
+        return voigt_kernels[kernel]['func']
+    except KeyError:
+        raise IOError("Unknown Voigt kernel {}.  Options are {}".format(
+            kernel, list(voigt_kernels.keys())))
+
+
+def benchmark_voigt_kernels(npts=1000000, avals=(1e-4, 1e-3, 1e-2), umax=20., seed=None):
+    """ Time the Voigt kernels and measure their errors against wofz
+
+    Parameters
+    ----------
+    npts : int, optional
+      Number of u values per evaluation
+    avals : tuple, optional
+      a values to evaluate
+    umax : float, optional
+      u values are drawn uniformly from [0, umax]
+    seed : int, optional
+
+    Returns
+    -------
+    tbl : Table
+      name, time (s per evaluation of npts), speedup relative to wofz
+      and the maximum relative error found
+    """
+    from astropy.table import Table
+    rstate = np.random.RandomState(seed)
+    uval = rstate.uniform(0., umax, npts)
+    exact = [voigt_wofz(uval, aa) for aa in avals]
+    rows = []
+    for name in voigt_kernels.keys():
+        func = get_voigt_kernel(name)
+        func(uval[:10], avals[0])  # Builds tables, if any
+        tstart = time.time()
+        errs = []
+        for aa, ex in zip(avals, exact):
+            errs.append(np.max(np.abs(func(uval, aa) - ex) / ex))
+        rows.append((name, (time.time() - tstart) / len(avals), np.max(errs)))
+    tbl = Table(rows=rows, names=('name', 'time', 'max_rel_err'))
+    tbl['speedup'] = tbl['time'][list(tbl['name']).index('wofz')] / tbl['time']
+    return tbl
+
+
+def voigt_tau(wave, par, kernel='wofz'):
     """ Find the optical depth at input wavelengths
 
     This is a stripped down routine for calculating a tau array for an
@@ -101,6 +318,8 @@ def voigt_tau(wave, par):
         par[3] = wrest in cm
         par[4] = f value
         par[5] = gamma (s^-1)
+    kernel : str or function, optional
+      Voigt kernel;  see voigt_kernels
 
     Returns
     -------
@@ -116,14 +335,414 @@ def voigt_tau(wave, par):
     uvoigt = ((c_cgs / (wave/zp1)) - nujk) / dnu
     # Voigt
     cne = 0.014971475 * cold * par[4] #line.data['f'] * u.cm * u.cm * u.Hz
-    tau = cne * voigt_wofz(uvoigt,avoigt) / dnu
+    tau = cne * get_voigt_kernel(kernel)(uvoigt,avoigt) / dnu
     #
     return tau
 
 
+def _line_constants(par):
+    """ zp1, line frequency, Doppler width (Hz), damping parameter a
+    and tau/H(a,u) of each line of a (6, nline) parameter array
+    """
+    logN, z, b, wrest, f, gamma = par
+    dnu = b / wrest
+    cne = 0.014971475 * 10.**logN * f / dnu
+    return z + 1., c_cgs / wrest, dnu, gamma / (4 * np.pi * dnu), cne
+
+
+def _line_umax(cne, avoigt, tau_min):
+    """ Half-width of each line, in Doppler widths, beyond which tau < tau_min
+    """
+    # H(a,u) < exp(-u^2) + a/(sqrt(pi) u^2);  a factor of sqrt(2) in u
+    # puts each term below tau_min/2
+    u_gauss = np.sqrt(np.log(np.maximum(cne / tau_min, 1.)))
+    u_lorentz = np.sqrt(cne * avoigt / (np.sqrt(np.pi) * tau_min))
+    umax = np.sqrt(2.) * np.maximum(u_gauss, u_lorentz)
+    umax[cne < tau_min] = 0.
+    return umax
+
+
+def _line_wvlim(zp1, nujk, dnu, umax):
+    """ Observed wavelengths (cm) at u = +/- umax of each line
+    """
+    wv_lo = zp1 * c_cgs / (nujk + umax * dnu)
+    nu_hi = nujk - umax * dnu
+    wv_hi = np.full(len(wv_lo), np.inf)
+    pos = nu_hi > 0.
+    wv_hi[pos] = zp1[pos] * c_cgs / nu_hi[pos]
+    return wv_lo, wv_hi
+
+
+def voigt_tau_deriv(wave, par):
+    """ Find the optical depth and its derivatives in logN, z and b
+
+    Derivatives of H(a,u) come from that of the Faddeeva function,
+    w'(z) = -2 z w(z) + 2i/sqrt(pi).
+
+    Parameters
+    ----------
+    wave : ndarray
+      Assumed to be in cm
+    par : list
+      Line parameters, as for voigt_tau()
+
+    Returns
+    -------
+    tau : ndarray
+      Optical depth at input wavelengths
+    dtau : ndarray
+      shape (3, nwave);  derivatives of tau in logN, z and b (per cm/s)
+    """
+    zp1 = par[1] + 1.0
+    nujk = c_cgs / par[3]
+    dnu = par[2] / par[3]
+    avoigt = par[5] / (4 * np.pi * dnu)
+    uvoigt = ((c_cgs / (wave/zp1)) - nujk) / dnu
+    cne = 0.014971475 * 10.0**par[0] * par[4] / dnu
+    zvoigt = uvoigt + 1j * avoigt
+    wz = wofz(zvoigt)
+    dwz = -2. * zvoigt * wz + 2j / np.sqrt(np.pi)
+    # H, dH/du and dH/da
+    hval, hu, ha = wz.real, dwz.real, -1 * dwz.imag
+    tau = cne * hval
+    dtau = np.array([np.log(10.) * tau,
+                     cne * hu * c_cgs / (wave * dnu),
+                     -1 * cne / par[2] * (hval + avoigt * ha + uvoigt * hu)])
+    return tau, dtau
+
+
+def voigt_tau_multi(wave, par, tau_min=1e-6, max_eval=2**22, kernel='wofz'):
+    """ Find the optical depth of many lines at once
+
+    Same inputs as voigt_tau() except that each entry of par is an
+    array with one value per line.  Each line is evaluated only over the
+    pixels where its optical depth may exceed tau_min (estimated from
+    the Gaussian core and the Lorentzian wings of the profile) and the
+    results are summed into the tau array.
+
+    Parameters
+    ----------
+    wave : ndarray
+      Assumed to be in cm.  Must be increasing unless tau_min is None
+    par : ndarray or list
+      Line parameters, shape (6, nline), in cgs
+        par[0] = logN (cm^-2)
+        par[1] = z
+        par[2] = b in cm/s
+        par[3] = wrest in cm
+        par[4] = f value
+        par[5] = gamma (s^-1)
+    tau_min : float or None, optional
+      Optical depth below which a line is neglected.
+      If None, every line is evaluated at every pixel.
+    max_eval : int, optional
+      Maximum number of (line, pixel) evaluations held in memory at once
+    kernel : str or function, optional
+      Voigt kernel;  see voigt_kernels
+
+    Returns
+    -------
+    tau : ndarray
+      Optical depth at input wavelengths
+    """
+    wave = np.asarray(wave, dtype=float)
+    par = np.asarray(par, dtype=float).reshape(6, -1)
+    nline = par.shape[1]
+    tau = np.zeros(wave.size)
+    if nline == 0:
+        return tau
+    zp1, nujk, dnu, avoigt, cne = _line_constants(par)
+    voigt = get_voigt_kernel(kernel)
+
+    # Pixel window of each line
+    if tau_min is None:
+        i0 = np.zeros(nline, dtype=int)
+        i1 = np.full(nline, wave.size, dtype=int)
+    else:
+        if np.any(np.diff(wave) < 0.):
+            raise ValueError("wave must be increasing to use tau_min")
+        umax = _line_umax(cne, avoigt, tau_min)
+        wv_lo, wv_hi = _line_wvlim(zp1, nujk, dnu, umax)
+        i0 = np.searchsorted(wave, wv_lo, side='left')
+        i1 = np.searchsorted(wave, wv_hi, side='right')
+        i1[umax == 0.] = i0[umax == 0.]  # Peak is below tau_min
+    npix = i1 - i0
+
+    # Evaluate the lines in batches of at most max_eval pixels
+    ends = np.cumsum(npix)
+    start = 0
+    while start < nline:
+        stop = np.searchsorted(ends, ends[start] - npix[start] + max_eval, side='right')
+        stop = max(stop, start + 1)
+        nsub = npix[start:stop]
+        neval = np.sum(nsub)
+        if neval > 0:
+            iline = np.repeat(np.arange(start, stop), nsub)
+            ipix = i0[iline] + np.arange(neval) - np.repeat(np.cumsum(nsub) - nsub, nsub)
+            uvoigt = ((c_cgs / (wave[ipix] / zp1[iline])) - nujk[iline]) / dnu[iline]
+            vals = cne[iline] * voigt(uvoigt, avoigt[iline])
+            tau += np.bincount(ipix, weights=vals, minlength=wave.size)
+        start = stop
+    return tau
+
+
+def voigt_pixel_average(wave, par, du_max=0.1, tau_core=1e-3, tau_min=1e-6,
+                        kernel='wofz'):
+    """ Absorbed flux and optical depth averaged over each pixel
+
+    Pixels about the line cores that are coarse compared to the
+    Doppler width are oversampled, with sub-pixels of at most du_max
+    Doppler widths, and the flux is averaged within each pixel.  Other
+    pixels are evaluated at their centers.  Work and memory thus scale
+    with the number of lines rather than the wavelength span.
+
+    Parameters
+    ----------
+    wave : ndarray
+      Pixel centers, in cm.  Must be increasing
+    par : ndarray or list
+      Line parameters, shape (6, nline), as for voigt_tau_multi
+    du_max : float, optional
+      Maximum sub-pixel size in Doppler widths (b)
+    tau_core : float, optional
+      Pixels where a line's optical depth may exceed tau_core are oversampled
+    tau_min : float or None, optional
+      Passed to voigt_tau_multi
+    kernel : str or function, optional
+      Voigt kernel;  see voigt_kernels
+
+    Returns
+    -------
+    flux : ndarray
+      Pixel average of exp(-tau)
+    tau : ndarray
+      Pixel average of the optical depth
+    """
+    wave = np.asarray(wave, dtype=float)
+    par = np.asarray(par, dtype=float).reshape(6, -1)
+    if np.any(np.diff(wave) <= 0.):
+        raise ValueError("wave must be increasing")
+    tau = voigt_tau_multi(wave, par, tau_min=tau_min, kernel=kernel)
+    nline = par.shape[1]
+    if (nline == 0) or (wave.size < 2):
+        return np.exp(-1.*tau), tau
+    zp1, nujk, dnu, avoigt, cne = _line_constants(par)
+    # Pixel edges
+    mid = (wave[1:] + wave[:-1]) / 2.
+    edges = np.concatenate([[2*wave[0] - mid[0]], mid, [2*wave[-1] - mid[-1]]])
+
+    # Pixels overlapping the core of each line
+    umax = _line_umax(cne, avoigt, tau_core)
+    wv_lo, wv_hi = _line_wvlim(zp1, nujk, dnu, umax)
+    i0 = np.maximum(np.searchsorted(edges, wv_lo, side='right') - 1, 0)
+    i1 = np.maximum(np.minimum(np.searchsorted(edges, wv_hi, side='left'), wave.size), i0)
+    i1[umax == 0.] = i0[umax == 0.]
+    ncore = i1 - i0
+    iline = np.repeat(np.arange(nline), ncore)
+    ipix = i0[iline] + np.arange(np.sum(ncore)) - np.repeat(np.cumsum(ncore) - ncore, ncore)
+    # Sub-pixels required by each line;  take the most
+    du = zp1[iline] * c_cgs * (1./edges[ipix] - 1./edges[ipix+1]) / dnu[iline]
+    nsub = np.ones(wave.size, dtype=int)
+    np.maximum.at(nsub, ipix, np.ceil(du / du_max).astype(int))
+    osamp = np.where(nsub > 1)[0]
+    if len(osamp) == 0:
+        return np.exp(-1.*tau), tau
+
+    # Oversample
+    ns = nsub[osamp]
+    pix = np.repeat(osamp, ns)
+    isub = np.arange(np.sum(ns)) - np.repeat(np.cumsum(ns) - ns, ns)
+    subwave = edges[pix] + (isub + 0.5) / nsub[pix] * (edges[pix+1] - edges[pix])
+    tau_sub = voigt_tau_multi(subwave, par, tau_min=tau_min, kernel=kernel)
+    flux = np.exp(-1.*tau)
+    flux[osamp] = np.bincount(pix, weights=np.exp(-1.*tau_sub), minlength=wave.size)[osamp] / ns
+    tau[osamp] = np.bincount(pix, weights=tau_sub, minlength=wave.size)[osamp] / ns
+    return flux, tau
+
+
+class TauCache(object):
+    """ LRU cache of the optical depth of single lines, and of
+    convolved models, on wavelength grids
+
+    Each line is stored over its own pixel window (see voigt_tau_multi)
+    keyed on its parameters and the grid, so that when one line of a
+    set changes only it is recomputed before the total is re-summed.
+    The least recently used entries are evicted once max_bytes is
+    exceeded.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+      Memory held by the cached arrays
+    tau_min : float, optional
+      Lines are stored only where their optical depth may exceed tau_min
+    kernel : str or function, optional
+      Voigt kernel;  see voigt_kernels
+
+    Attributes
+    ----------
+    hits : int
+    misses : int
+    evictions : int
+    nbytes : int
+      Memory held by the cached arrays
+    """
+    def __init__(self, max_bytes=2**28, tau_min=1e-6, kernel='wofz'):
+        self.max_bytes = max_bytes
+        self.tau_min = tau_min
+        self.kernel = kernel
+        self._store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._store)
+
+    def __repr__(self):
+        return '<TauCache: nentries={:d}, nbytes={:d}, hits={:d}, misses={:d}>'.format(
+            len(self), self.nbytes, self.hits, self.misses)
+
+    @property
+    def stats(self):
+        """ dict of hits, misses, hit_rate, evictions, nentries and nbytes
+        """
+        ncall = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses,
+                    hit_rate=self.hits / ncall if ncall > 0 else 0.,
+                    evictions=self.evictions, nentries=len(self), nbytes=self.nbytes)
+
+    def clear(self):
+        """ Empty the cache and reset the statistics
+        """
+        self._store.clear()
+        self.hits = self.misses = self.evictions = self.nbytes = 0
+
+    def grid_id(self, wave):
+        """ Hash of a wavelength array
+
+        It is computed on each call, so that arrays edited in place
+        get a new one
+        """
+        wave = np.ascontiguousarray(wave, dtype=float)
+        return hashlib.sha1(wave.tobytes()).hexdigest()
+
+    def get(self, key):
+        """ Cached item or None;  counts a hit or miss
+        """
+        try:
+            item = self._store.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._store[key] = item
+        self.hits += 1
+        return item
+
+    def put(self, key, item):
+        """ Add an item, a tuple of (int, ndarray), evicting the least
+        recently used entries if needed
+        """
+        if key in self._store:
+            self.nbytes -= self._store.pop(key)[1].nbytes
+        self._store[key] = item
+        self.nbytes += item[1].nbytes
+        while (self.nbytes > self.max_bytes) and (len(self._store) > 1):
+            _, old = self._store.popitem(last=False)
+            self.nbytes -= old[1].nbytes
+            self.evictions += 1
+
+    def tau(self, wave, par):
+        """ Optical depth of a set of lines, using the cached lines
+
+        Parameters
+        ----------
+        wave : ndarray
+          Assumed to be in cm, and increasing
+        par : ndarray
+          Line parameters (6, nline);  see voigt_tau()
+
+        Returns
+        -------
+        tau : ndarray
+        """
+        par = np.atleast_2d(np.asarray(par, dtype=float).T).T
+        gid = self.grid_id(wave)
+        tau = np.zeros(wave.size)
+        keys = [(gid, self.tau_min, self.kernel, tuple(ipar)) for ipar in par.T]
+        items = [self.get(key) for key in keys]
+        new = np.array([item is None for item in items])
+        if np.any(new):
+            if np.any(np.diff(wave) < 0.):
+                raise ValueError("wave must be increasing")
+            zp1, nujk, dnu, avoigt, cne = _line_constants(par[:, new])
+            umax = _line_umax(cne, avoigt, self.tau_min)
+            wv_lo, wv_hi = _line_wvlim(zp1, nujk, dnu, umax)
+            i0 = np.searchsorted(wave, wv_lo, side='left')
+            i1 = np.searchsorted(wave, wv_hi, side='right')
+            i1[umax == 0.] = i0[umax == 0.]
+            for jj, ii in enumerate(np.where(new)[0]):
+                vals = voigt_tau_multi(wave[i0[jj]:i1[jj]], par[:, ii:ii+1], tau_min=None,
+                                       kernel=self.kernel)
+                items[ii] = (i0[jj], vals)
+                self.put(keys[ii], items[ii])
+        for i0, vals in items:
+            tau[i0:i0+vals.size] += vals
+        return tau
+
+    def model_key(self, wave, par, fwhm, flg_rebin=0):
+        """ Key of a convolved model
+
+        Parameters
+        ----------
+        wave : ndarray
+          Wavelengths of the returned model, in cm
+        par : ndarray
+          Line parameters (6, nline);  see voigt_tau()
+        fwhm : float
+        flg_rebin : int, optional
+          1 if the model was evaluated on a sub-grid of wave and rebinned
+          (see voigt_from_abslines), else 0.  The sub-grid depends on wave only
+        """
+        par = np.asarray(par, dtype=float)
+        return ('model', self.grid_id(wave), flg_rebin, self.tau_min, self.kernel, fwhm,
+                hashlib.sha1(np.ascontiguousarray(par).tobytes()).hexdigest())
+
+
+tau_cache = TauCache()
+
+
+def par_from_abslines(lines):
+    """ Pack the parameters of a set of AbsLines for voigt_tau_multi()
+
+    Parameters
+    ----------
+    lines : list of AbsLine
+      attrib['N'], attrib['b'] and z should all have been set
+
+    Returns
+    -------
+    par : ndarray
+      shape (6, nline);  logN, z, b (cm/s), wrest (cm), f, gamma (s^-1)
+    """
+    par = np.zeros((6, len(lines)))
+    for ii, iline in enumerate(lines):
+        if not isinstance(iline.attrib['N'], u.Quantity):
+            raise RuntimeError("line attribute 'N' must have units!")
+        if iline.attrib['b'].value <= 0.:
+            raise RuntimeError("line attribute 'b' must have units and be positive!")
+        par[:, ii] = [np.log10(iline.attrib['N'].value),
+                      iline.z, iline.attrib['b'].to('cm/s').value,
+                      iline.wrest.to('cm').value, iline.data['f'],
+                      iline.data['gamma'].value]
+    return par
+
+
 # The primary call
 def voigt_from_abslines(iwave, line, fwhm=None, ret=['vmodel'],
-                        skip_wveval=False, debug=False):
+                        skip_wveval=False, tau_min=None, adaptive=False,
+                        kernel='wofz', cache=None, debug=False):
     """ Generates a Voigt model from a line or list of AbsLines
 
     This may run *slowly* for many many lines.
@@ -150,6 +769,20 @@ def voigt_from_abslines(iwave, line, fwhm=None, ret=['vmodel'],
       1/10 of the b-value of the input line(s).  
       If necessary, the wavelenght array is rebinned for the calculation
       and the final array is rebinned to the original.
+    tau_min : float, optional
+      If set, each line is only evaluated where its optical depth may
+      exceed tau_min (see voigt_tau_multi).  Much faster for many lines
+    adaptive : bool, optional
+      If the input array is too coarse, oversample only the pixels about
+      the line cores and average within each input pixel (see
+      voigt_pixel_average), instead of evaluating on a sub-grid over the
+      full wavelength range and rebinning.  The input array must be increasing
+    kernel : str or function, optional
+      Voigt kernel;  see voigt_kernels
+    cache : TauCache, optional
+      Take the optical depth of each line, and the convolved model, from
+      this cache (e.g. tau_cache), adding them if needed.  Its own
+      tau_min and kernel are used.  Not used with adaptive
     debug : bool, optional
 
     Returns
@@ -177,7 +810,10 @@ def voigt_from_abslines(iwave, line, fwhm=None, ret=['vmodel'],
         dwave = np.median(np.abs(iwave-np.roll(iwave,1)))
         medwave = np.median(iwave)
 
-        if const.c.to('km/s')*dwave/medwave > minb/10.:
+        if (const.c.to('km/s')*dwave/medwave > minb/10.) and adaptive:
+            wave = iwave
+            flg_rebin = 2
+        elif const.c.to('km/s')*dwave/medwave > minb/10.:
             wmin = np.min(iwave.to('AA').value)
             wmax = np.max(iwave.to('AA').value)
             # Npixels -- Need to cover all the wavelengths (hence +2)
@@ -202,25 +838,31 @@ def voigt_from_abslines(iwave, line, fwhm=None, ret=['vmodel'],
         raise IOError('voigt_from_abslines: Unknown input')
 
     # Generate tau 
-    tau = np.zeros(wave.size)
-    wavecm = wave.to('cm').value
-    for iline in lines:
-        if not isinstance(iline.attrib['N'], u.Quantity):
-            # assume km/s
-            raise RuntimeError("line attribute 'N' must have units!")
-        if debug:
+    if debug:
+        for iline in lines:
             print(iline, iline.attrib['N'])
-        if iline.attrib['b'].value <= 0.:
-            raise RuntimeError("line attribute 'b' must have units and be positive!")
-        par = [np.log10(iline.attrib['N'].value),
-               iline.z, iline.attrib['b'].to('cm/s').value,
-               iline.wrest.to('cm').value, iline.data['f'],
-               iline.data['gamma'].value]
-        tau += voigt_tau(wavecm, par)
+    par = par_from_abslines(lines)
+    if (cache is not None) and (flg_rebin != 2) and (fwhm is not None) and \
+            (ret != 'tau') and ('tau' not in ret):
+        # Convolved model
+        mkey = cache.model_key(iwave.to('cm').value, par, fwhm, flg_rebin=flg_rebin)
+        item = cache.get(mkey)
+        if item is not None:
+            vmodel = XSpectrum1D.from_tuple((iwave, item[1].copy()))
+            return _voigt_ret(vmodel, None, ret)
+    else:
+        mkey = None
+    if flg_rebin == 2:
+        flux, tau = voigt_pixel_average(wave.to('cm').value, par, tau_min=tau_min,
+                                        kernel=kernel)
+    elif cache is not None:
+        tau = cache.tau(wave.to('cm').value, par)
+    else:
+        tau = voigt_tau_multi(wave.to('cm').value, par, tau_min=tau_min, kernel=kernel)
 
     # Only tau?
     if ret == 'tau':
-        if flg_rebin: # Can only occur for single line input
+        if flg_rebin == 1: # Can only occur for single line input
             # Might be better to do in flux space, but small flux values cause trouble
             tmodel = XSpectrum1D.from_tuple((wave,tau))
             tmodel = tmodel.rebin(iwave, fill_value='extrapolate')
@@ -231,11 +873,12 @@ def voigt_from_abslines(iwave, line, fwhm=None, ret=['vmodel'],
         return tau
 
     # Flux
-    flux = np.exp(-1.0*tau)
+    if flg_rebin != 2:
+        flux = np.exp(-1.0*tau)
     vmodel = XSpectrum1D.from_tuple((wave, flux))
 
     # Rebin?
-    if flg_rebin:
+    if flg_rebin == 1:
         vmodel = vmodel.rebin(iwave)
     # Convolve
     if fwhm is not None:
@@ -243,8 +886,14 @@ def voigt_from_abslines(iwave, line, fwhm=None, ret=['vmodel'],
     else:
         warnings.warn('Assuming infinite spectral resolution, i.e. no smoothing.')
         warnings.warn('Set fwhm to smooth.')
-    
-    # Return list
+    if mkey is not None:
+        cache.put(mkey, (0, vmodel.flux.value.copy()))
+    return _voigt_ret(vmodel, tau, ret)
+
+
+def _voigt_ret(vmodel, tau, ret):
+    """ Items requested by ret of voigt_from_abslines()
+    """
     ret_val = []
     for option in ret:
         if option == 'vmodel':
@@ -325,3 +974,96 @@ class single_voigt_model(FittableModel):
         if fwhm > 0.:
             fx = lsc.convolve_psf(fx, fwhm)
         return fx 
+
+    @staticmethod
+    def fit_deriv(wave,logN,b,z,wrest,f,gamma,fwhm):
+        """ Analytic derivatives in logN, b and z;  zero for the others
+        """
+        tau, dtau = voigt_tau_deriv(wave/1e8, [logN,z,b*1e5,wrest/1e8,f,gamma])
+        dfx = -1 * np.exp(-1*tau) * dtau
+        if fwhm > 0.:
+            dfx = lsc.convolve_psf(dfx, fwhm)
+        zero = np.zeros_like(tau)
+        return [dfx[0], dfx[2]*1e5, dfx[1], zero, zero, zero, zero]
+
+
+# Model classes of multi_voigt_model(), by number of components
+_multi_voigt_classes = {}
+
+
+def multi_voigt_model(ncomp, **kwargs):
+    """ Generate a model of several Voigt components in the astropy
+    framework for fitting
+
+    The optical depths of the components are summed before the
+    absorbed flux is convolved, and derivatives are analytic.
+
+    input: wave array  :: Assumed in Angstroms; needs to be unitless
+    output: absorbed, normalized flux
+    Parameters: logN_i, b_i, z_i, wrest_i, f_i, gamma_i for i < ncomp,
+    and fwhm.  wrest, f, gamma and fwhm are fixed.
+
+    Parameters
+    ----------
+    ncomp : int
+      Number of components
+    **kwargs :
+      Parameter values, e.g. logN_0=13.5, and other Model keywords
+
+    Returns
+    -------
+    model : FittableModel
+    """
+    if ncomp not in _multi_voigt_classes:
+        members = dict(inputs=('wave',), outputs=('flux',), ncomp=ncomp,
+                       evaluate=_multi_voigt_evaluate,
+                       fit_deriv=_multi_voigt_fit_deriv)
+        for ii in range(ncomp):
+            members['logN_{:d}'.format(ii)] = Parameter()
+            members['b_{:d}'.format(ii)] = Parameter()  # Assumes km/s
+            members['z_{:d}'.format(ii)] = Parameter()
+            members['wrest_{:d}'.format(ii)] = Parameter(fixed=True)
+            members['f_{:d}'.format(ii)] = Parameter(fixed=True)
+            members['gamma_{:d}'.format(ii)] = Parameter(fixed=True)
+        members['fwhm'] = Parameter(fixed=True)
+        _multi_voigt_classes[ncomp] = type(str('multi_voigt_model_{:d}'.format(ncomp)),
+                                           (FittableModel,), members)
+    return _multi_voigt_classes[ncomp](**kwargs)
+
+
+def _multi_voigt_par(params):
+    """ voigt_tau parameters (6, ncomp) from the flat model parameters
+    """
+    comp = np.array([np.ravel(param)[0] for param in params[:-1]]).reshape(-1, 6)
+    # logN, b, z, wrest, f, gamma -> logN, z, b, wrest, f, gamma (cgs)
+    return np.array([comp[:, 0], comp[:, 2], comp[:, 1]*1e5, comp[:, 3]/1e8,
+                     comp[:, 4], comp[:, 5]])
+
+
+def _multi_voigt_evaluate(self, wave, *params):
+    tau = voigt_tau_multi(wave/1e8, _multi_voigt_par(params), tau_min=None)
+    fx = np.exp(-1*tau)
+    fwhm = np.ravel(params[-1])[0]
+    if fwhm > 0.:
+        fx = lsc.convolve_psf(fx, fwhm)
+    return fx
+
+
+def _multi_voigt_fit_deriv(self, wave, *params):
+    par = _multi_voigt_par(params)
+    ncomp = par.shape[1]
+    tau = np.zeros(np.size(wave))
+    dtau = []
+    for ii in range(ncomp):
+        itau, idtau = voigt_tau_deriv(wave/1e8, par[:, ii])
+        tau += itau
+        dtau.append(idtau)
+    dfx = -1 * np.exp(-1*tau) * np.concatenate(dtau)
+    fwhm = np.ravel(params[-1])[0]
+    if fwhm > 0.:
+        dfx = lsc.convolve_psf(dfx, fwhm)
+    zero = np.zeros_like(tau)
+    derivs = []
+    for ii in range(ncomp):
+        derivs += [dfx[3*ii], dfx[3*ii+2]*1e5, dfx[3*ii+1], zero, zero, zero]
+    return derivs + [zero]
@@ -0,0 +1,635 @@
+""" Joint Voigt-profile fitting of AbsComponents over many transitions
+and spectra, and fast Voigt-model likelihoods for sampling
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+import warnings
+
+from scipy.special import wofz
+
+from astropy import units as u
+from astropy.convolution import Gaussian1DKernel
+
+from linetools.analysis import voigt as lav
+from linetools.analysis import absline as ltaa
+from linetools.isgm.utils import get_wvobs_chunks
+from linetools.spectra.lsf import LSF
+
+c_kms = 299792.458  # km/s
+
+
+def lsf_kernel(lsf, wave):
+    """ Convolution kernel of a chunk of pixels
+
+    Parameters
+    ----------
+    lsf : float, LSF or None
+      A float is the FWHM of a Gaussian in pixels
+    wave : ndarray
+      Wavelengths (AA) of the chunk
+
+    Returns
+    -------
+    kernel : ndarray
+      Of odd length;  [1.] if lsf is None
+    """
+    if lsf is None:
+        return np.ones(1)
+    if isinstance(lsf, LSF):
+        dwv = np.median(np.diff(wave))
+        pix_scale = lsf.pixel_scale
+        if isinstance(pix_scale, u.Quantity):
+            nhalf = int(np.ceil(np.max(np.abs(lsf._data['rel_pix'])) *
+                                pix_scale.to('AA').value / dwv))
+        else:
+            nhalf = len(wave) // 2
+        nhalf = max(min(nhalf, 200), 5)
+        wv0 = np.mean(wave)
+        return lsf.get_lsf((wv0 + dwv * np.arange(-nhalf, nhalf+1)) * u.AA)
+    # Gaussian FWHM in pixels (as in convolve_psf)
+    sigma = float(lsf) / 2.354820046
+    nhalf = int(np.ceil(3.034854259 * sigma))
+    return Gaussian1DKernel(sigma, x_size=2*nhalf+1).array
+
+
+class JointVoigtFitter(object):
+    """ Fit the column density, Doppler parameter and velocity of a set
+    of AbsComponents to all of their transitions at once
+
+    Each component contributes three parameters, logN, b (km/s) and a
+    velocity offset v (km/s) from its zcomp, shared by all of its
+    transitions.  The model is evaluated only over the pixel chunks of
+    get_wvobs_chunks() (merged where they overlap), each convolved with
+    its own line-spread function, and the fit uses a sparse Jacobian.
+
+    Parameters
+    ----------
+    components : list of AbsComponent
+      The limits of all of their AbsLines must be set
+    spec : XSpectrum1D or list of XSpectrum1D, optional
+      Normalized spectra.  If None, those of the AbsLines
+      (analy['spec']) are used
+    lsf : float, LSF or list, optional
+      Line-spread function(s);  a float is the FWHM of a Gaussian in
+      pixels.  If a list, one per spectrum.  If None, no convolution
+    fixed : list of (int, str), optional
+      Parameters held fixed, e.g. [(0, 'b')] for the b of the first
+      component
+    tau_min : float, optional
+      Lines are only evaluated in chunks where their optical depth may
+      exceed tau_min
+
+    Attributes
+    ----------
+    params : ndarray
+      (ncomp, 3) of logN, b, v
+    sig_params : ndarray
+      (ncomp, 3) errors, set by fit()
+    """
+    param_names = ('logN', 'b', 'v')
+
+    def __init__(self, components, spec=None, lsf=None, fixed=None, tau_min=1e-6):
+        if len(components) == 0:
+            raise IOError("No components to fit")
+        self.components = components
+        self.tau_min = tau_min
+        # Spectra
+        if spec is None:
+            specs = []
+            for comp in components:
+                for aline in comp._abslines:
+                    if aline.analy['spec'] is None:
+                        raise IOError("{} has no spectrum;  input spec".format(aline))
+                    if not any([aline.analy['spec'] is ispec for ispec in specs]):
+                        specs.append(aline.analy['spec'])
+        elif isinstance(spec, (list, tuple)):
+            specs = list(spec)
+        else:
+            specs = [spec]
+        self.specs = specs
+        if isinstance(lsf, (list, tuple)):
+            if len(lsf) != len(specs):
+                raise IOError("Need one LSF per spectrum")
+            self.lsfs = list(lsf)
+        else:
+            self.lsfs = [lsf] * len(specs)
+
+        # Lines;  (6, nline) voigt_tau parameters at the initial z and the component of each
+        self.z0 = np.array([comp.zcomp for comp in components])
+        lines, icomp = [], []
+        for ii, comp in enumerate(components):
+            for aline in comp._abslines:
+                lines.append(aline)
+                icomp.append(ii)
+        self.lines = lines
+        self.icomp = np.array(icomp, dtype=int)
+        self._par = np.array([[0., self.z0[ii], 0., aline.wrest.to('cm').value,
+                               aline.data['f'], aline.data['gamma'].value]
+                              for aline, ii in zip(lines, icomp)]).T
+
+        # Initial parameters
+        self.params = np.zeros((len(components), 3))
+        for ii, comp in enumerate(components):
+            logN = comp.attrib['logN']
+            bval = u.Quantity(comp.attrib['b']).to('km/s').value
+            vel = u.Quantity(comp.attrib['vel']).to('km/s').value
+            self.params[ii] = [logN if logN > 0. else 13., bval if bval > 0. else 10., vel]
+        self.sig_params = np.zeros_like(self.params)
+        self.free = np.ones(self.params.shape, dtype=bool)
+        if fixed is not None:
+            for ii, name in fixed:
+                self.free[ii, self.param_names.index(name)] = False
+
+        # Chunks
+        self._setup_chunks()
+
+    def _setup_chunks(self):
+        """ Merge the wavelength chunks of the lines in each spectrum and
+        prepare their data, padding and convolution kernel
+        """
+        wvlims = []
+        for comp in self.components:
+            wvlims += [wvlim.to('AA').value for wvlim in get_wvobs_chunks(comp)]
+        wvlims = np.array(wvlims)
+        # Window of each line at its initial parameters (AA), for
+        # those which spill into the chunks of other lines
+        zp1, nujk, dnu, avoigt, cne = lav._line_constants(self._line_par(self.params))
+        umax = lav._line_umax(cne, avoigt, self.tau_min)
+        wv_lo, wv_hi = lav._line_wvlim(zp1, nujk, dnu, umax)
+        wv_lo = np.minimum(wv_lo * 1e8, wvlims[:, 0])
+        wv_hi = np.maximum(wv_hi * 1e8, wvlims[:, 1])
+        self.chunks = []
+        for ispec, (spec, lsf) in enumerate(zip(self.specs, self.lsfs)):
+            wave = spec.wavelength.to('AA').value
+            ranges = []
+            for wvlim in wvlims:
+                i0 = np.searchsorted(wave, wvlim[0], side='left')
+                i1 = np.searchsorted(wave, wvlim[1], side='right')
+                if i1 > i0:
+                    ranges.append([i0, i1])
+            # Merge
+            ranges.sort()
+            merged = []
+            for i0, i1 in ranges:
+                if (len(merged) > 0) and (i0 <= merged[-1][1]):
+                    merged[-1][1] = max(merged[-1][1], i1)
+                else:
+                    merged.append([i0, i1])
+            for i0, i1 in merged:
+                kernel = lsf_kernel(lsf, wave[i0:i1])
+                npad = len(kernel) // 2
+                p0, p1 = max(i0 - npad, 0), min(i1 + npad, wave.size)
+                sig = spec.sig.value[i0:i1]
+                gdp = sig > 0.
+                wgt = np.zeros_like(sig)
+                wgt[gdp] = 1. / sig[gdp]
+                active = np.where((wv_hi >= wave[p0]) & (wv_lo <= wave[p1-1]))[0]
+                self.chunks.append(dict(ispec=ispec, wave=wave[p0:p1] * 1e-8,
+                                        flux=spec.flux.value[i0:i1],
+                                        wgt=wgt, core=slice(i0-p0, i1-p0),
+                                        kernel=kernel, lines=active))
+
+    def _line_par(self, params):
+        """ voigt_tau parameters (6, nline) of the lines for params
+        """
+        par = self._par.copy()
+        comp = params[self.icomp]
+        par[0] = comp[:, 0]
+        par[1] = self.z0[self.icomp] + comp[:, 2] * (1 + self.z0[self.icomp]) / c_kms
+        par[2] = comp[:, 1] * 1e5
+        return par
+
+    def _evaluate(self, x, deriv=False):
+        """ Weighted residuals and, optionally, their sparse Jacobian
+        """
+        from scipy.sparse import coo_matrix
+        params = self.params.copy()
+        params[self.free] = x
+        par = self._line_par(params)
+        ifree = -np.ones(params.shape, dtype=int)
+        ifree[self.free] = np.arange(np.sum(self.free))
+        resid, rows, cols, vals = [], [], [], []
+        npix = 0
+        for chunk in self.chunks:
+            wave, kernel, core = chunk['wave'], chunk['kernel'], chunk['core']
+            dtau = {}
+            if deriv:
+                tau = np.zeros(wave.size)
+                for iline in chunk['lines']:
+                    itau, idtau = lav.voigt_tau_deriv(wave, par[:, iline])
+                    jj = self.icomp[iline]
+                    # logN, b (km/s), v (km/s)
+                    idtau = np.array([idtau[0], idtau[2]*1e5,
+                                      idtau[1]*(1 + self.z0[jj])/c_kms])
+                    dtau[jj] = dtau.get(jj, 0.) + idtau
+                    tau += itau
+            else:
+                tau = lav.voigt_tau_multi(wave, par[:, chunk['lines']], tau_min=None)
+            flux = np.exp(-1*tau)
+            model = np.convolve(flux, kernel, mode='same')[core]
+            resid.append((model - chunk['flux']) * chunk['wgt'])
+            if deriv:
+                ncore = len(resid[-1])
+                for jj, idtau in dtau.items():
+                    for kk in range(3):
+                        if ifree[jj, kk] < 0:
+                            continue
+                        dmod = np.convolve(-1*flux*idtau[kk], kernel, mode='same')[core]
+                        rows.append(npix + np.arange(ncore))
+                        cols.append(np.full(ncore, ifree[jj, kk]))
+                        vals.append(dmod * chunk['wgt'])
+            npix += len(resid[-1])
+        resid = np.concatenate(resid)
+        if not deriv:
+            return resid
+        if len(rows) == 0:
+            jac = coo_matrix((npix, len(x)))
+        else:
+            jac = coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(npix, len(x)))
+        return resid, jac.tocsr()
+
+    def residuals(self, x=None):
+        """ Weighted residuals (model-flux)/sig over all of the chunks
+
+        Parameters
+        ----------
+        x : ndarray, optional
+          Free parameters;  defaults to the current ones
+        """
+        if x is None:
+            x = self.params[self.free]
+        return self._evaluate(x)
+
+    def model(self):
+        """ Model of each chunk for the current parameters
+
+        Returns
+        -------
+        models : list of (ispec, wave, flux)
+          wave is a Quantity array for the core pixels of the chunk
+        """
+        par = self._line_par(self.params)
+        models = []
+        for chunk in self.chunks:
+            tau = lav.voigt_tau_multi(chunk['wave'], par[:, chunk['lines']], tau_min=None)
+            flux = np.convolve(np.exp(-1*tau), chunk['kernel'], mode='same')
+            models.append((chunk['ispec'], chunk['wave'][chunk['core']] * 1e8 * u.AA,
+                           flux[chunk['core']]))
+        return models
+
+    def fit(self, update=True, **kwargs):
+        """ Run the fit
+
+        Parameters
+        ----------
+        update : bool, optional
+          Write the results into the components and their AbsLines
+        **kwargs :
+          Passed to scipy.optimize.least_squares
+
+        Returns
+        -------
+        result : OptimizeResult
+        """
+        from scipy.optimize import least_squares
+        if not np.any(self.free):
+            raise IOError("No free parameters to fit;  all of them are fixed")
+        x0 = self.params[self.free]
+        lower = np.tile([-np.inf, 0.1, -np.inf], (len(self.components), 1))[self.free]
+        x0 = np.maximum(x0, lower)
+        cache = {}
+
+        def fun(x):
+            cache['x'] = x.copy()
+            cache['resid'], cache['jac'] = self._evaluate(x, deriv=True)
+            return cache['resid']
+
+        def jac(x):
+            if ('x' not in cache) or np.any(cache['x'] != x):
+                fun(x)
+            return cache['jac']
+
+        kwargs.setdefault('tr_solver', 'lsmr')
+        result = least_squares(fun, x0, jac=jac, bounds=(lower, np.inf), method='trf',
+                               **kwargs)
+        if not result.success:
+            warnings.warn("Fit did not converge: {}".format(result.message))
+        self.params[self.free] = result.x
+        # Errors
+        jmat = result.jac.toarray() if hasattr(result.jac, 'toarray') else result.jac
+        try:
+            cov = np.linalg.inv(np.dot(jmat.T, jmat))
+        except np.linalg.LinAlgError:
+            warnings.warn("Singular Jacobian;  errors are not set")
+        else:
+            self.sig_params[self.free] = np.sqrt(np.diag(cov))
+        if update:
+            self.update_components()
+        return result
+
+    def update_components(self):
+        """ Write the parameters into the components and their AbsLines
+
+        Sets attrib logN, sig_logN, N, sig_N, b, sig_b, vel and sig_vel
+        (velocity offset from zcomp), and flag_N=1.
+        """
+        for ii, comp in enumerate(self.components):
+            logN, bval, vel = self.params[ii]
+            sig_logN, sig_b, sig_vel = self.sig_params[ii]
+            comp.attrib['flag_N'] = 1
+            comp.attrib['logN'] = logN
+            comp.attrib['sig_logN'] = np.array([sig_logN]*2)
+            _, _ = ltaa.linear_clm(comp.attrib)
+            comp.attrib['b'] = bval * u.km/u.s
+            comp.attrib['sig_b'] = sig_b * u.km/u.s
+            comp.attrib['vel'] = vel * u.km/u.s
+            comp.attrib['sig_vel'] = sig_vel * u.km/u.s
+            for aline in comp._abslines:
+                for key in ['flag_N', 'logN', 'sig_logN', 'N', 'sig_N', 'b', 'sig_b',
+                            'vel', 'sig_vel']:
+                    aline.attrib[key] = comp.attrib[key]
+
+
+class VoigtLikelihood(object):
+    """ Log-likelihood of a Voigt-profile model, compiled once for fast
+    repeated calls, e.g. by an MCMC sampler
+
+    Everything but the line parameters (the pixels, their line windows,
+    the LSF convolution as a sparse matrix and the work buffers) is set
+    up on instantiation.  Calls take a flat parameter vector, or an
+    (nwalker, nparam) array of them, and use no Quantity or spectrum
+    objects.
+
+    Each AbsLine, or each AbsComponent with all of its AbsLines, has
+    three parameters, logN, b (km/s) and a velocity offset v (km/s)
+    from its redshift.
+
+    Parameters
+    ----------
+    spec : XSpectrum1D
+      Normalized spectrum
+    lines : list of AbsLine or AbsComponent
+    mask : bool ndarray, optional
+      Pixels to fit (True).  Defaults to all of those with sig > 0
+    lsf : float, LSF or list, optional
+      Line-spread function;  a float is the FWHM of a Gaussian in
+      pixels.  If a list, one per contiguous segment of mask
+    bounds : dict, optional
+      (min, max) of 'logN', 'b' and 'v';  the log-probability is -inf
+      outside of these.  The line windows are set for these limits
+    tau_min : float, optional
+      Each line is evaluated only where its optical depth may exceed
+      tau_min for any parameters within bounds
+    nwalkers : int, optional
+      Batch size for which to allocate the buffers
+
+    Attributes
+    ----------
+    p0 : ndarray
+      Parameters of the input lines
+    param_names : list
+    """
+    default_bounds = dict(logN=(8., 22.), b=(0.5, 300.), v=(-500., 500.))
+
+    def __init__(self, spec, lines, mask=None, lsf=None, bounds=None, tau_min=1e-6,
+                 nwalkers=1):
+        from scipy.sparse import csr_matrix
+        from linetools.isgm.abscomponent import AbsComponent
+        if len(lines) == 0:
+            raise IOError("No lines to fit")
+        # Lines and their parameter set
+        alines, icomp, names, p0 = [], [], [], []
+        for ii, obj in enumerate(lines):
+            if isinstance(obj, AbsComponent):
+                ilines = obj._abslines
+                logN, bval = obj.attrib['logN'], obj.attrib['b']
+                name = obj.name
+            else:
+                ilines = [obj]
+                logN = np.log10(obj.attrib['N'].to('cm**-2').value) \
+                    if obj.attrib['N'].value > 0. else 0.
+                bval = obj.attrib['b']
+                name = obj.name
+            alines += ilines
+            icomp += [ii] * len(ilines)
+            names += ['{:s}_{:s}'.format(key, name) for key in ['logN', 'b', 'v']]
+            p0.append([logN if logN > 0. else 13., u.Quantity(bval).to('km/s').value, 0.])
+        self.param_names = names
+        self.ncomp = len(lines)
+        self.p0 = np.array(p0).flatten()
+        self.p0[1::3] = np.maximum(self.p0[1::3], 1.)
+        self.icomp = np.array(icomp, dtype=int)
+        self.nline = len(alines)
+        self.z0 = np.array([aline.z for aline in alines])
+        self.wrest = np.array([aline.wrest.to('cm').value for aline in alines])
+        self.fval = np.array([aline.data['f'] for aline in alines])
+        self.gamma = np.array([aline.data['gamma'].value for aline in alines])
+        self.nujk = lav.c_cgs / self.wrest
+        self.bounds = self.default_bounds.copy()
+        if bounds is not None:
+            self.bounds.update(bounds)
+        self.lower = np.tile([self.bounds[key][0] for key in ['logN', 'b', 'v']], self.ncomp)
+        self.upper = np.tile([self.bounds[key][1] for key in ['logN', 'b', 'v']], self.ncomp)
+
+        # Pixels
+        wave = spec.wavelength.to('AA').value
+        flux = spec.flux.value
+        sig = spec.sig.value
+        gdp = sig > 0.
+        if mask is not None:
+            gdp &= np.asarray(mask, dtype=bool)
+        if not np.any(gdp):
+            raise IOError("No pixels to fit")
+        # Contiguous segments
+        edges = np.diff(np.concatenate([[0], gdp.astype(int), [0]]))
+        starts, ends = np.where(edges == 1)[0], np.where(edges == -1)[0]
+        if isinstance(lsf, (list, tuple)):
+            if len(lsf) != len(starts):
+                raise IOError("Need one LSF per segment of the mask ({:d})".format(len(starts)))
+            lsfs = list(lsf)
+        else:
+            lsfs = [lsf] * len(starts)
+        eval_pix, rows, cols, vals = [], [], [], []
+        ncore = 0
+        for i0, i1, ilsf in zip(starts, ends, lsfs):
+            kernel = lsf_kernel(ilsf, wave[i0:i1])
+            nk = len(kernel)
+            npad = nk // 2
+            p0, p1 = max(i0 - npad, 0), min(i1 + npad, wave.size)
+            ioff = np.sum([len(pix) for pix in eval_pix])
+            eval_pix.append(np.arange(p0, p1))
+            # model[i] = sum_k kernel[k] * flux[i + npad - k]  (np.convolve 'same')
+            icore = np.arange(i0, i1)
+            kk = np.arange(nk)
+            jpix = icore[:, np.newaxis] + npad - kk[np.newaxis, :]
+            inside = (jpix >= p0) & (jpix < p1)
+            rows.append(np.broadcast_to(ncore + np.arange(i1-i0)[:, np.newaxis], jpix.shape)[inside])
+            cols.append(ioff + jpix[inside] - p0)
+            vals.append(np.broadcast_to(kernel[np.newaxis, :], jpix.shape)[inside])
+            ncore += i1 - i0
+        eval_pix = np.concatenate(eval_pix)
+        self.neval = len(eval_pix)
+        self.conv = csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                               shape=(ncore, self.neval))
+        self.core = gdp
+        self.wave = wave[gdp]
+        self.flux = flux[gdp]
+        self.ivar_sqrt = 1. / sig[gdp]
+        self.lnorm = -1 * np.sum(np.log(sig[gdp])) - 0.5 * ncore * np.log(2 * np.pi)
+        wave_eval = wave[eval_pix] * 1e-8
+
+        # Line windows for any parameters within bounds;  (line, pixel) pairs
+        logN_max, (b_min, b_max), (v_min, v_max) = \
+            self.bounds['logN'][1], self.bounds['b'], self.bounds['v']
+        zp1_lo = 1 + self.z0 + v_min * (1 + self.z0) / c_kms
+        zp1_hi = 1 + self.z0 + v_max * (1 + self.z0) / c_kms
+        wv_lo, wv_hi = np.full(self.nline, np.inf), np.full(self.nline, -np.inf)
+        for bval in [b_min, b_max]:
+            dnu = bval * 1e5 / self.wrest
+            avoigt = self.gamma / (4 * np.pi * dnu)
+            cne = 0.014971475 * 10.**logN_max * self.fval / dnu
+            umax = lav._line_umax(cne, avoigt, tau_min)
+            ilo, _ = lav._line_wvlim(zp1_lo, self.nujk, dnu, umax)
+            _, ihi = lav._line_wvlim(zp1_hi, self.nujk, dnu, umax)
+            wv_lo, wv_hi = np.minimum(wv_lo, ilo), np.maximum(wv_hi, ihi)
+        i0 = np.searchsorted(wave_eval, wv_lo, side='left')
+        i1 = np.searchsorted(wave_eval, wv_hi, side='right')
+        npair = i1 - i0
+        self.iline = np.repeat(np.arange(self.nline), npair)
+        self.ipix = i0[self.iline] + np.arange(np.sum(npair)) - \
+            np.repeat(np.cumsum(npair) - npair, npair)
+        self.npair = len(self.ipix)
+        # c/wave of each pair, in the frame of its line
+        self._c_wave = lav.c_cgs / wave_eval[self.ipix]
+        self._nujk = self.nujk[self.iline]
+        self._pcomp = self.icomp[self.iline]
+        self._alloc(nwalkers)
+
+    def _alloc(self, nwalkers):
+        """ Allocate the work buffers for nwalkers
+        """
+        self.nwalkers = nwalkers
+        self._uvoigt = np.empty((nwalkers, self.npair))
+        self._dnu = np.empty((nwalkers, self.npair))
+        self._zvoigt = np.empty((nwalkers, self.npair), dtype=complex)
+        self._wz = np.empty((nwalkers, self.npair), dtype=complex)
+        self._flat = (np.arange(nwalkers)[:, np.newaxis] * self.neval + self.ipix).ravel()
+
+    def tau(self, theta):
+        """ Optical depth on the evaluation pixels
+
+        Parameters
+        ----------
+        theta : ndarray
+          (nparam,) or (nwalker, nparam)
+
+        Returns
+        -------
+        tau : ndarray
+          (nwalker, neval)
+        """
+        theta = np.atleast_2d(theta)
+        nwalk = theta.shape[0]
+        if nwalk != self.nwalkers:
+            self._alloc(nwalk)
+        # Line quantities (nwalker, nline)
+        comp = theta.reshape(nwalk, self.ncomp, 3)[:, self.icomp, :]
+        zp1 = 1. + self.z0 + comp[..., 2] * (1. + self.z0) / c_kms
+        dnu = comp[..., 1] * 1e5 / self.wrest
+        avoigt = self.gamma / (4 * np.pi * dnu)
+        cne = 0.014971475 * 10.**comp[..., 0] * self.fval / dnu
+        # u and a of each (line, pixel) pair
+        uvoigt, wz, zvoigt = self._uvoigt, self._wz, self._zvoigt
+        np.take(zp1, self.iline, axis=1, out=uvoigt)
+        uvoigt *= self._c_wave
+        uvoigt -= self._nujk
+        np.take(dnu, self.iline, axis=1, out=self._dnu)
+        uvoigt /= self._dnu
+        zvoigt.real = uvoigt
+        zvoigt.imag = np.take(avoigt, self.iline, axis=1)
+        wofz(zvoigt, out=wz)
+        np.multiply(wz.real, np.take(cne, self.iline, axis=1), out=uvoigt)
+        return np.bincount(self._flat, weights=uvoigt.ravel(),
+                           minlength=nwalk*self.neval).reshape(nwalk, self.neval)
+
+    def model(self, theta):
+        """ Convolved model flux of the fitted pixels
+
+        Parameters
+        ----------
+        theta : ndarray
+          (nparam,) or (nwalker, nparam)
+
+        Returns
+        -------
+        model : ndarray
+          (nwalker, npix)
+        """
+        flux = self.tau(theta)
+        np.exp(-1*flux, out=flux)
+        return (self.conv.dot(flux.T)).T
+
+    def log_likelihood(self, theta):
+        """ Gaussian log-likelihood
+
+        Parameters
+        ----------
+        theta : ndarray
+          (nparam,) or (nwalker, nparam)
+
+        Returns
+        -------
+        lnL : float or ndarray
+          ndarray (nwalker,) for 2D theta
+        """
+        model = self.model(theta)
+        model -= self.flux
+        model *= self.ivar_sqrt
+        lnL = self.lnorm - 0.5 * np.einsum('ij,ij->i', model, model)
+        if np.ndim(theta) == 1:
+            return lnL[0]
+        return lnL
+
+    def log_prob(self, theta):
+        """ Log-likelihood with a uniform prior within bounds;  for
+        emcee (with vectorize=True for an (nwalker, nparam) input)
+        """
+        theta = np.asarray(theta, dtype=float)
+        inb = np.all((theta >= self.lower) & (theta <= self.upper), axis=-1)
+        lnp = np.full(np.shape(inb), -np.inf)
+        if np.any(inb):
+            if np.ndim(theta) == 1:
+                lnp = self.log_likelihood(theta)
+            else:
+                lnp[inb] = self.log_likelihood(theta[inb])
+        return lnp
+
+    __call__ = log_prob
+
+    def update_lines(self, theta, lines):
+        """ Write a parameter vector into the input lines
+
+        Parameters
+        ----------
+        theta : ndarray
+        lines : list of AbsLine or AbsComponent
+          As input on instantiation
+        """
+        from linetools.isgm.abscomponent import AbsComponent
+        for ii, obj in enumerate(lines):
+            logN, bval, vel = theta[3*ii:3*ii+3]
+            if isinstance(obj, AbsComponent):
+                alines = obj._abslines
+                obj.attrib['logN'] = logN
+                obj.attrib['N'] = 10**logN / u.cm**2
+                obj.attrib['b'] = bval * u.km/u.s
+                obj.attrib['vel'] = vel * u.km/u.s
+            else:
+                alines = [obj]
+            for aline in alines:
+                aline.attrib['N'] = 10**logN / u.cm**2
+                aline.attrib['logN'] = logN
+                aline.attrib['b'] = bval * u.km/u.s
+                aline.attrib['vel'] = vel * u.km/u.s
@@ -44,3 +44,15 @@ from astropy.tests.helper import enable_deprecations_as_exceptions
 #     TESTED_VERSIONS[packagename] = version.version
 # except NameError:   # Needed to support Astropy <= 1.0.0
 #     pass
+
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def temp_astropy_cache(tmp_path_factory):
+    """ Keep the tables cached by the tests (COG, LSF) out of the
+    astropy cache directory of the user
+    """
+    from astropy.config import set_temp_cache
+    with set_temp_cache(str(tmp_path_factory.mktemp('astropy_cache'))):
+        yield
@@ -324,7 +324,8 @@ class ExamineSpecWidget(QWidget):
             lya_line = AbsLine(1215.6701*u.AA, z=zlya)
             lya_line.attrib['N'] = NHI
             lya_line.attrib['b'] = 30. * u.km/u.s
-            lya_spec = ltv.voigt_from_abslines(self.spec.wavelength, lya_line, fwhm=3.)
+            lya_spec = ltv.voigt_from_abslines(self.spec.wavelength, lya_line, fwhm=3.,
+                                               cache=ltv.tau_cache)
             lconti = event.ydata
             self.lya_line = XSpectrum1D.from_tuple((lya_spec.wavelength, lya_spec.flux*lconti))
             self.adict['flg'] = 4
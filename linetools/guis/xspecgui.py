@@ -107,7 +107,8 @@ class XSpecGui(QMainWindow):
                 lines = iabs_sys.list_of_abslines()
                 alllines = alllines + lines
             if len(alllines) > 0:
-                voigtsfit = lav.voigt_from_abslines(spec.wavelength, alllines, fwhm=3.).flux.value
+                voigtsfit = lav.voigt_from_abslines(spec.wavelength, alllines, fwhm=3.,
+                                                    cache=lav.tau_cache).flux.value
 
             if not norm:
                 voigtsfit = voigtsfit * spec.co
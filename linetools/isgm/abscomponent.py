@@ -727,8 +727,7 @@ class AbsComponent(object):
             raise IOError("Column densities already set.  Use overwrite=True to redo.")
         # Redo?
         if redo_aodm:
-            for aline in self._abslines:
-                aline.measure_aodm(**kwargs)
+            ltaa.measure_aodm_abslines(self._abslines, **kwargs)
         # Collate
         self.attrib['flag_N'] = 0
         if debug:
@@ -21,6 +21,7 @@ from astropy.coordinates import SkyCoord
 
 from linetools.isgm.abscomponent import AbsComponent
 from linetools.isgm import utils as ltiu
+from linetools.analysis import absline as ltaa
 from linetools import utils as ltu
 from linetools import line_utils as ltlu
 from linetools.spectralline import AbsLine
@@ -545,13 +546,12 @@ class AbsSystem(object):
         """
         # Grab Lines
         abs_lines = self.list_of_abslines()
-        # Loop
-        for iline in abs_lines:
-            # Fill in spec?
-            if spec is not None:
+        # Fill in spec?
+        if spec is not None:
+            for iline in abs_lines:
                 iline.analy['spec'] = spec
-            # Measure
-            iline.measure_aodm(**kwargs)
+        # Measure all at once
+        ltaa.measure_aodm_abslines(abs_lines, **kwargs)
         #
         print("You may now wish to update the component column densities with update_component_colm()")
 
@@ -0,0 +1,399 @@
+""" Column-oriented storage for the data of XSpectrum1D
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+import warnings
+
+try: # Python 2 & 3 compatibility
+    basestring
+except NameError:
+    basestring = str
+
+
+class ColumnarData(object):
+    """ Stand-in for the masked, structured data array of XSpectrum1D
+
+    Each of wave, flux, sig and co is held in its own contiguous
+    (nspec, npix) array and a single boolean array holds the mask
+    shared by all of them.  Indexing by a column name returns a
+    np.ma.MaskedArray *view* on the column and the mask, so code
+    written against the structured array (e.g. spec.data['flux'][0])
+    continues to work and writes through to the storage.
+
+    Parameters
+    ----------
+    nspec : int
+      Number of spectra
+    totpix : int
+      Number of pixels in each spectrum
+    """
+    names = ('wave', 'flux', 'sig', 'co')
+    dtypes = dict(wave='float64', flux='float32', sig='float32', co='float32')
+
+    def __init__(self, nspec, totpix):
+        self.nspec = nspec
+        self.totpix = totpix
+        self._columns = {}
+        for key in self.names:
+            self._columns[key] = np.zeros((nspec, totpix), dtype=self.dtypes[key])
+        self._mask = np.zeros((nspec, totpix), dtype=bool)
+
+    @property
+    def dtype(self):
+        """ Structured dtype equivalent to the masked storage
+        """
+        return np.dtype([(str(key), self.dtypes[key], (self.totpix,)) for key in self.names])
+
+    @property
+    def shape(self):
+        return (self.nspec,)
+
+    @property
+    def mask(self):
+        """ Boolean mask, shape (nspec, npix), shared by all columns
+        """
+        return self._mask
+
+    @mask.setter
+    def mask(self, value):
+        self._mask[...] = value
+
+    def __len__(self):
+        return self.nspec
+
+    def __getitem__(self, item):
+        """ Column views, a structured array of several columns, or a
+        new ColumnarData holding a subset of the spectra
+
+        Parameters
+        ----------
+        item : str, list of str, int, slice or ndarray
+
+        Returns
+        -------
+        np.ma.MaskedArray or ColumnarData
+        """
+        if isinstance(item, basestring):
+            return np.ma.MaskedArray(self._columns[item], mask=self._mask, copy=False)
+        if isinstance(item, list) and all([isinstance(key, basestring) for key in item]):
+            return self.to_masked()[item]
+        # Rows
+        if isinstance(item, (int, np.integer)):
+            item = np.array([item])
+        mask = self._mask[item]
+        new = ColumnarData(mask.shape[0], self.totpix)
+        for key in self.names:
+            new._columns[key][:] = self._columns[key][item]
+        new._mask[:] = mask
+        return new
+
+    def __setitem__(self, key, value):
+        """ Fill a column.  A masked input adds its mask to the shared one
+
+        Parameters
+        ----------
+        key : str
+        value : float or ndarray
+          Broadcast to (nspec, npix)
+        """
+        if not isinstance(key, basestring):
+            raise IOError("ColumnarData only supports setting full columns")
+        self._columns[key][...] = np.ma.getdata(value)
+        if np.ma.isMaskedArray(value):
+            self._mask |= np.ma.getmaskarray(value)
+
+    def compressed(self, key, row):
+        """ Unmasked pixels of one column for a single spectrum
+
+        Unlike np.ma.MaskedArray.compressed() this returns a view
+        whenever the unmasked pixels form a contiguous block, which
+        is always true for masking='none' or 'edges'.
+
+        Parameters
+        ----------
+        key : str
+        row : int
+
+        Returns
+        -------
+        values : ndarray
+        """
+        return compress_view(self._columns[key][row], self._mask[row])
+
+    def filled(self, fill_value=0.):
+        """ Structured ndarray with masked pixels set to fill_value
+        """
+        out = np.empty((self.nspec,), dtype=self.dtype)
+        for key in self.names:
+            out[key] = np.where(self._mask, fill_value, self._columns[key])
+        return out
+
+    def to_masked(self):
+        """ Masked, structured array as used by the default storage
+        """
+        out = np.ma.empty((self.nspec,), dtype=self.dtype)
+        for key in self.names:
+            out[key] = np.ma.MaskedArray(self._columns[key], mask=self._mask)
+        return out
+
+    def copy(self):
+        return self[np.arange(self.nspec)]
+
+
+class LazyData(object):
+    """ Data of XSpectrum1D read from disk only when it is needed
+
+    The spectra are pulled from a memory-mapped FITS file or an h5py
+    dataset through `reader`, one row at a time.  Rows used by the
+    selected spectrum are kept (so edits to them persist) and memory
+    thus scales with the spectra actually looked at.  Slicing with
+    rows returns a ColumnarData holding only those spectra.  Accessing
+    a full column (e.g. spec.data['flux']) reads every spectrum once
+    and the object then behaves as ColumnarData.
+
+    Parameters
+    ----------
+    nspec : int
+      Number of spectra
+    totpix : int
+      Number of pixels in each spectrum
+    reader : callable
+      reader(rows) takes a sorted int ndarray of row indices and returns
+      a dict of the 'wave', 'flux' and optionally 'sig', 'co' arrays
+      for those rows, each with shape (len(rows), totpix)
+    masking : str, optional
+      Masking of the data using the sig array, as in XSpectrum1D
+    """
+    names = ColumnarData.names
+    dtypes = ColumnarData.dtypes
+
+    def __init__(self, nspec, totpix, reader, masking='none'):
+        self.nspec = nspec
+        self.totpix = totpix
+        self.reader = reader
+        self.masking = masking
+        self._rows = {}
+        self._full = None
+
+    @property
+    def dtype(self):
+        """ Structured dtype equivalent to the masked storage
+        """
+        return np.dtype([(str(key), self.dtypes[key], (self.totpix,)) for key in self.names])
+
+    @property
+    def shape(self):
+        return (self.nspec,)
+
+    @property
+    def loaded(self):
+        """ Indices of the spectra held in memory
+        """
+        if self._full is not None:
+            return np.arange(self.nspec)
+        return np.array(sorted(self._rows.keys()), dtype=int)
+
+    def __len__(self):
+        return self.nspec
+
+    def _read(self, rows):
+        """ Read a set of spectra from disk
+
+        Parameters
+        ----------
+        rows : int ndarray
+          Any order; repetition is allowed
+
+        Returns
+        -------
+        data : ColumnarData
+        """
+        rows = np.atleast_1d(np.asarray(rows, dtype=int))
+        uni, inv = np.unique(rows, return_inverse=True)
+        values = self.reader(uni)
+        data = ColumnarData(len(rows), self.totpix)
+        for key in self.names:
+            if key in values and values[key] is not None:
+                data[key] = np.asarray(values[key])[inv]
+            else:
+                data[key] = np.nan
+        if (self.masking != 'none') and ('sig' in values) and (values['sig'] is not None):
+            badsig = mask_from_sig(np.asarray(values['sig'])[inv], self.masking)
+            if self.masking == 'edges':
+                data.mask |= badsig
+            else:
+                data.mask = badsig
+        # Edits to rows already in memory take precedence
+        for ii, row in enumerate(rows):
+            if row in self._rows:
+                for key in self.names:
+                    data._columns[key][ii] = self._rows[row]._columns[key][0]
+                data._mask[ii] = self._rows[row]._mask[0]
+        return data
+
+    def _load(self, row):
+        """ Return the ColumnarData of a single spectrum, reading it
+        from disk the first time
+        """
+        if row not in self._rows:
+            self._rows[row] = self._read([row])
+        return self._rows[row]
+
+    def materialize(self):
+        """ Read all of the spectra into memory
+
+        Returns
+        -------
+        data : ColumnarData
+        """
+        if self._full is None:
+            self._full = self._read(np.arange(self.nspec))
+            self._rows = {}
+        return self._full
+
+    def row(self, key, row):
+        """ MaskedArray view of one column for a single spectrum
+        Writes to it are kept
+
+        Parameters
+        ----------
+        key : str
+        row : int
+
+        Returns
+        -------
+        np.ma.MaskedArray
+        """
+        if self._full is not None:
+            return self._full[key][row]
+        data = self._load(row)
+        return np.ma.MaskedArray(data._columns[key][0], mask=data._mask[0], copy=False)
+
+    def compressed(self, key, row):
+        """ Unmasked pixels of one column for a single spectrum
+        See ColumnarData.compressed
+
+        Parameters
+        ----------
+        key : str
+        row : int
+
+        Returns
+        -------
+        values : ndarray
+        """
+        if self._full is not None:
+            return self._full.compressed(key, row)
+        return self._load(row).compressed(key, 0)
+
+    def __getitem__(self, item):
+        """ Full columns (read in all of the spectra), or a
+        ColumnarData holding a subset of the spectra
+
+        Parameters
+        ----------
+        item : str, list of str, int, slice or ndarray
+
+        Returns
+        -------
+        np.ma.MaskedArray or ColumnarData
+        """
+        if isinstance(item, basestring) or isinstance(item, list) and \
+                all([isinstance(key, basestring) for key in item]):
+            return self.materialize()[item]
+        if self._full is not None:
+            return self._full[item]
+        return self._read(np.arange(self.nspec)[item])
+
+    def __setitem__(self, key, value):
+        self.materialize()[key] = value
+
+    @property
+    def mask(self):
+        """ Boolean mask, shape (nspec, npix).  Reads all of the spectra
+        """
+        return self.materialize().mask
+
+    @mask.setter
+    def mask(self, value):
+        if (self._full is None) and np.all(np.asarray(value) == False):
+            # Unmask without touching the disk
+            self.masking = 'none'
+            for data in self._rows.values():
+                data.mask = False
+        else:
+            self.materialize().mask = value
+
+    def filled(self, fill_value=0.):
+        return self.materialize().filled(fill_value)
+
+    def to_masked(self):
+        return self.materialize().to_masked()
+
+    def copy(self):
+        """ New LazyData on the same reader.  Rows in memory are copied
+        """
+        new = LazyData(self.nspec, self.totpix, self.reader, masking=self.masking)
+        if self._full is not None:
+            new._full = self._full.copy()
+        for row, data in self._rows.items():
+            new._rows[row] = data.copy()
+        return new
+
+
+def compress_view(values, mask):
+    """ values[~mask], but as a view when the unmasked values
+    form a contiguous block
+
+    Parameters
+    ----------
+    values : ndarray
+    mask : bool ndarray
+
+    Returns
+    -------
+    ndarray
+    """
+    nbad = np.count_nonzero(mask)
+    if nbad == 0:
+        return values
+    if nbad == mask.size:
+        return values[0:0]
+    # Is the good data a single contiguous block?
+    i0 = np.argmin(mask)
+    i1 = mask.size - np.argmin(mask[::-1])
+    if (i1 - i0) == (mask.size - nbad):
+        return values[i0:i1]
+    return values[~mask]
+
+
+def mask_from_sig(sig, masking):
+    """ Bad pixels of a set of spectra given their error arrays
+
+    Parameters
+    ----------
+    sig : ndarray, shape (nspec, npix)
+    masking : str
+      'edges' -- Pixels with sig <=0 on the 'edge' of each spectrum
+      'all' -- All pixels with sig <= 0
+
+    Returns
+    -------
+    badsig : bool ndarray, shape (nspec, npix)
+    """
+    sig = np.ma.getdata(sig)
+    if masking == 'all':
+        return sig <= 0.
+    # Mask outside the first and last pixels with sig > 0
+    gdsig = sig > 0.
+    npix = sig.shape[1]
+    first = np.argmax(gdsig, axis=1)[:, np.newaxis]
+    last = (npix - 1 - np.argmax(gdsig[:, ::-1], axis=1))[:, np.newaxis]
+    pix = np.arange(npix)
+    badsig = (pix < first) | (pix > last)
+    allbad = ~np.any(gdsig, axis=1)
+    if np.any(allbad):
+        warnings.warn("All pixels masked.  Likely a bad spectrum")
+        badsig[allbad] = True
+    return badsig
@@ -6,10 +6,17 @@ from __future__ import print_function, absolute_import, division, unicode_litera
 
 import numpy as np
 from astropy.convolution import convolve, Gaussian1DKernel, CustomKernel
+from astropy.units import Quantity
+
+# Kernels of more pixels than this are convolved by FFT (method='auto')
+fft_kernel_threshold = 64
+
+const2   = 2.354820046             # 2*sqrt(2*ln(2))
+const100 = 3.034854259             # sqrt(2*ln(100))
 
 #Updated functions using astropy.convolution
 def convolve_psf(array, fwhm, boundary='fill', fill_value=0.,
-                 normalize_kernel=True):
+                 normalize_kernel=True, method='auto', var=False):
     """ Convolve an array with a gaussian kernel.
 
     Given an array of values `a` and a gaussian full width at half
@@ -18,8 +25,9 @@ def convolve_psf(array, fwhm, boundary='fill', fill_value=0.,
 
     Parameters
     ----------
-    array : array, shape(N,)
-        Array to convolve
+    array : array, shape(N,) or (nspec, N)
+        Array to convolve.  A 2D array is convolved along its last
+        axis, i.e. each spectrum separately.
     fwhm : float
         Gaussian full width at half maximum in pixels.
     boundary : str, optional
@@ -38,25 +46,416 @@ def convolve_psf(array, fwhm, boundary='fill', fill_value=0.,
         The value to use outside the array when using boundary='fill'
     normalize_kernel : bool, optional
         Whether to normalize the kernel prior to convolving
+    method : str, optional
+        'direct', 'fft' or 'auto' (see convolve_rows()), or
+        'recursive' for the O(N) approximation of gauss_smooth_rows()
+    var : bool, optional
+        `array` is a variance to propagate through the convolution,
+        i.e. it is convolved with the square of the normalized kernel
+        (and is 0 outside the array for boundary='fill').  NaNs are
+        left out, renormalising the kernel, as in gauss_smooth_rows()
 
     Returns
     -------
-    convolved_array : array, shape (N,)
+    convolved_array : array, shape (N,) or (nspec, N)
     
     Notes
     -----
     This function uses astropy.convolution 
     """
 
-    const2   = 2.354820046             # 2*sqrt(2*ln(2))
-    const100 = 3.034854259             # sqrt(2*ln(100))
+    if method == 'recursive':
+        return gauss_smooth_rows(array, fwhm, boundary=boundary, fill_value=fill_value, var=var)
     sigma = fwhm / const2
     # gaussian drops to 1/100 of maximum value at x =
     # sqrt(2*ln(100))*sigma, so number of pixels to include from
     # centre of gaussian is:
     n = np.ceil(const100 * sigma)
     x_size = int(2*n) + 1 # we want this to be odd integer
-    return convolve(array, Gaussian1DKernel(sigma, x_size=x_size),
-                    boundary=boundary, fill_value=fill_value,
-                    normalize_kernel=normalize_kernel)
+    kernel = Gaussian1DKernel(sigma, x_size=x_size)
+    if var:
+        kernel = kernel.array / np.sum(kernel.array)
+        isnan = np.isnan(array)
+        if np.any(isnan):
+            result = convolve_rows(np.where(isnan, 0., array), kernel**2, boundary=boundary,
+                                   fill_value=0., normalize_kernel=False, method=method)
+            # Sum of the kernel over the good pixels;  those outside the array count
+            norm = convolve_rows((~isnan).astype(float), kernel,
+                                 boundary='fill' if boundary is None else boundary,
+                                 fill_value=1., normalize_kernel=False, method=method)
+            bad = norm < 1e-8
+            result = result / np.where(bad, 1., norm)**2
+            result[bad] = np.nan
+            return result
+        kernel = kernel**2
+        fill_value, normalize_kernel = 0., False
+    return convolve_rows(array, kernel,
+                         boundary=boundary, fill_value=fill_value,
+                         normalize_kernel=normalize_kernel, method=method)
+
+
+def convolve_rows(array, kernel, method='auto', **kwargs):
+    """ Convolve a 1D array, or each row of a 2D array, with a 1D kernel
+
+    Parameters
+    ----------
+    array : array, shape(N,) or (nspec, N)
+        Array to convolve
+    kernel : Kernel1D or array, shape(K,)
+    method : str, optional
+        'direct' uses astropy.convolution.convolve, 'fft' uses
+        convolve_fft_rows().  'auto' uses the FFT for kernels of more
+        than fft_kernel_threshold pixels, unless kwargs holds options
+        only astropy.convolution.convolve takes.
+    **kwargs :
+        Passed to astropy.convolution.convolve or convolve_fft_rows()
+
+    Returns
+    -------
+    convolved_array : array, same shape as array
+    """
+    if method not in ['auto', 'direct', 'fft']:
+        raise ValueError("method must be one of 'auto', 'direct' or 'fft'")
+    if method == 'auto':
+        ksize = np.size(kernel.array if hasattr(kernel, 'array') else kernel)
+        fft_ok = set(kwargs.keys()) <= set(['boundary', 'fill_value', 'normalize_kernel',
+                                             'nan_treatment', 'preserve_nan'])
+        method = 'fft' if (fft_ok and ksize > fft_kernel_threshold) else 'direct'
+    if method == 'fft':
+        return convolve_fft_rows(array, kernel, **kwargs)
+    if np.ndim(array) == 2:
+        if hasattr(kernel, 'array'):
+            kernel = kernel.array
+        # A (1, K) kernel keeps the rows independent
+        kernel = np.asarray(kernel)[np.newaxis, :]
+    return convolve(array, kernel, **kwargs)
+
+
+def convolve_fft_rows(array, kernel, boundary='fill', fill_value=0.,
+                      normalize_kernel=True, nan_treatment='interpolate',
+                      preserve_nan=False):
+    """ Convolve a 1D array, or each row of a 2D array, by FFT
+
+    A drop-in for astropy.convolution.convolve on long arrays and
+    wide kernels:  the rows are cut into blocks that are convolved
+    with FFTs and overlap-added, so the cost is O(N log K) per row
+    instead of O(N K).  The boundary and NaN options are those of
+    astropy.convolution.convolve.  With nan_treatment='interpolate',
+    NaN pixels are left out and each pixel is normalised by the sum
+    of the kernel over the others, i.e. the kernel is renormalised
+    about NaNs.
+
+    Parameters
+    ----------
+    array : array, shape(N,) or (nspec, N)
+        Array to convolve
+    kernel : Kernel1D or array, shape(K,)
+        K must be odd
+    boundary : str, optional
+        None, 'fill', 'wrap' or 'extend' (see convolve_psf)
+    fill_value : float, optional
+        The value to use outside the array when using boundary='fill'
+    normalize_kernel : bool, optional
+        Whether to normalize the kernel prior to convolving
+    nan_treatment : str, optional
+        'interpolate' or 'fill' (NaNs are replaced by fill_value)
+    preserve_nan : bool, optional
+        Set the NaN pixels of `array` back to NaN
+
+    Returns
+    -------
+    convolved_array : array, same shape as array
+    """
+    if hasattr(kernel, 'array'):
+        kernel = kernel.array
+    kernel = np.asarray(kernel, dtype=float)
+    if (kernel.ndim != 1) or (kernel.size % 2 == 0):
+        raise ValueError('Kernel size must be odd in all axes.')
+    if boundary not in [None, 'fill', 'wrap', 'extend']:
+        raise ValueError("Invalid boundary option: must be one of None, 'fill', 'wrap' or 'extend'")
+    if nan_treatment not in ['interpolate', 'fill']:
+        raise ValueError("nan_treatment must be one of 'interpolate' or 'fill'")
+    unit = array.unit if isinstance(array, Quantity) else None
+    values = np.array(array.value if unit is not None else array, dtype=float, ndmin=2)
+    nspec, npix = values.shape
+    ksum = np.sum(kernel)
+    if normalize_kernel:
+        kernel = kernel / ksum
+        ksum = 1.
+    nhalf = kernel.size // 2
+    if (boundary is None) and (kernel.size > npix):
+        raise ValueError("for boundary=None the kernel must be smaller than the array;"
+                         " use boundary in ['fill', 'extend', 'wrap'] instead.")
+
+    padded = _pad_rows(values, nhalf, boundary, fill_value)
+    isnan = np.isnan(padded)
+    if nan_treatment == 'fill':
+        padded[isnan] = fill_value
+    elif np.any(isnan):
+        padded[isnan] = 0.
+    result = _overlap_add(padded, kernel)
+    if (nan_treatment == 'interpolate') and np.any(isnan):
+        # Sum of the (normalized) kernel over the good pixels
+        weight = _overlap_add((~isnan).astype(float), kernel / ksum)
+        bad = weight < 1e-8
+        result /= np.where(bad, 1., weight)
+        result[bad] = np.nan
+    if boundary is None:
+        result[:, :nhalf] = 0.
+        result[:, npix - nhalf:] = 0.
+    if preserve_nan:
+        result[np.isnan(values)] = np.nan
+
+    if np.ndim(array) == 1:
+        result = result[0]
+    if unit is not None:
+        result = result * unit
+    return result
+
+
+def _overlap_add(padded, kernel):
+    """ 'valid' convolution of each row of `padded` with `kernel`,
+    by overlap-add of FFT-convolved blocks
+
+    Parameters
+    ----------
+    padded : ndarray, shape (nspec, N+K-1)
+    kernel : ndarray, shape (K,)
+
+    Returns
+    -------
+    convolved : ndarray, shape (nspec, N)
+    """
+    nspec, ntot = padded.shape
+    ksize = kernel.size
+    # FFT length:  a power of 2 of about 8 kernels, or all of the row
+    nfft = 2**int(np.ceil(np.log2(min(8 * ksize, ntot + ksize - 1))))
+    nfft = max(nfft, 2**int(np.ceil(np.log2(2 * ksize))))
+    nblk = nfft - ksize + 1  # Input pixels per block;  > ksize - 1
+    nblock = -(-ntot // nblk)
+    blocks = np.zeros((nspec, nblock * nblk))
+    blocks[:, :ntot] = padded
+    blocks = blocks.reshape(nspec, nblock, nblk)
+    conv = np.fft.irfft(np.fft.rfft(blocks, nfft, axis=-1) * np.fft.rfft(kernel, nfft),
+                        nfft, axis=-1)
+    # Each block adds its first nblk values in place and its
+    #  ksize-1 last ones onto the start of the next block
+    full = np.empty((nspec, (nblock + 1) * nblk))
+    full[:, :nblock * nblk].reshape(nspec, nblock, nblk)[:] = conv[:, :, :nblk]
+    full[:, nblock * nblk:] = 0.
+    full[:, nblk:].reshape(nspec, nblock, nblk)[:, :, :ksize - 1] += conv[:, :, nblk:]
+    return full[:, ksize - 1:ntot]
+
+
+def box_smooth_rows(array, nbox, boundary='fill', fill_value=0., var=False):
+    """ Boxcar smoothing of a 1D array, or each row of a 2D array, in O(N)
+
+    The same as convolving with the normalized
+    astropy.convolution.Box1DKernel(nbox), i.e. for an even nbox
+    nbox+1 pixels with half weights at the ends, but from
+    differences of cumulative sums, so the cost does not depend
+    on nbox.  NaNs are left out, renormalising the box.
+
+    Parameters
+    ----------
+    array : array, shape(N,) or (nspec, N)
+        Array to smooth
+    nbox : int
+        Width of the box in pixels
+    boundary : str, optional
+        None, 'fill', 'wrap' or 'extend' (see convolve_psf)
+    fill_value : float, optional
+        The value to use outside the array when using boundary='fill'
+    var : bool, optional
+        `array` is a variance, to propagate:  it is summed with
+        the square of the box weights (and is 0 outside the array
+        for boundary='fill')
+
+    Returns
+    -------
+    smoothed : array, same shape as array
+    """
+    nbox = int(nbox)
+    if nbox < 1:
+        raise ValueError('nbox must be a positive integer')
+    if nbox % 2 == 1:
+        nwin, edge = nbox, 1.
+    else:
+        nwin, edge = nbox + 1, 0.5
+    nhalf = nwin // 2
+    unit = array.unit if isinstance(array, Quantity) else None
+    values = np.array(array.value if unit is not None else array, dtype=float, ndmin=2)
+    nspec, npix = values.shape
+    if (boundary is None) and (nwin > npix):
+        raise ValueError("for boundary=None the kernel must be smaller than the array;"
+                         " use boundary in ['fill', 'extend', 'wrap'] instead.")
+    if var:
+        fill_value = 0.
+    padded = _pad_rows(values, nhalf, boundary, fill_value)
+
+    def window_sum(arr, end_weight):
+        # Sum over the window of each pixel, with end_weight at its ends
+        csum = np.zeros((nspec, arr.shape[1] + 1))
+        np.cumsum(arr, axis=1, out=csum[:, 1:])
+        total = csum[:, nwin:] - csum[:, :-nwin]
+        if end_weight != 1.:
+            total -= (1. - end_weight) * (arr[:, :npix] + arr[:, nwin - 1:])
+        return total
+
+    isnan = np.isnan(padded)
+    if np.any(isnan):
+        padded[isnan] = 0.
+        # Sum of the weights over the good pixels
+        norm = window_sum((~isnan).astype(float), edge)
+        bad = norm < 1e-8
+        norm[bad] = 1.
+        if var:
+            norm = norm**2
+    else:
+        bad = None
+        norm = float(nbox)**2 if var else float(nbox)
+    result = window_sum(padded, edge**2 if var else edge) / norm
+    if bad is not None:
+        result[bad] = np.nan
+    if boundary is None:
+        result[:, :nhalf] = 0.
+        result[:, npix - nhalf:] = 0.
+
+    if np.ndim(array) == 1:
+        result = result[0]
+    if unit is not None:
+        result = result * unit
+    return result
+
+
+def gauss_smooth_rows(array, fwhm, boundary='fill', fill_value=0., var=False):
+    """ Gaussian smoothing of a 1D array, or each row of a 2D array, in O(N)
+
+    Uses a Young-van Vliet recursive (IIR) filter, run forwards then
+    backwards along the rows with scipy.signal.lfilter, so the cost
+    does not depend on the width.  Its response has the variance of
+    the Gaussian and matches it to ~1% of the peak (a few % for
+    sigma < 1.5 pixels);  use convolve_psf() for an exact Gaussian.
+    It requires sigma = fwhm/2.355 >= 0.5 pixel.  NaNs are left out,
+    renormalising the kernel.
+
+    Parameters
+    ----------
+    array : array, shape(N,) or (nspec, N)
+        Array to smooth
+    fwhm : float
+        Gaussian full width at half maximum in pixels.
+    boundary : str, optional
+        None, 'fill', 'wrap' or 'extend' (see convolve_psf)
+    fill_value : float, optional
+        The value to use outside the array when using boundary='fill'
+    var : bool, optional
+        `array` is a variance, to propagate.  The square of a
+        Gaussian of sigma is a Gaussian of sigma/sqrt(2) scaled by
+        1/(2 sqrt(pi) sigma), with which it is smoothed (and it is 0
+        outside the array for boundary='fill')
+
+    Returns
+    -------
+    smoothed : array, same shape as array
+    """
+    sigma = fwhm / const2
+    fsigma = sigma / np.sqrt(2.) if var else sigma
+    if fsigma < 0.5:
+        raise ValueError('The recursive Gaussian requires sigma >= 0.5 pixel; '
+                         'use convolve_psf() for narrower kernels')
+    unit = array.unit if isinstance(array, Quantity) else None
+    values = np.array(array.value if unit is not None else array, dtype=float, ndmin=2)
+    nspec, npix = values.shape
+    nhalf = int(np.ceil(const100 * sigma))
+    if (boundary is None) and (2*nhalf + 1 > npix):
+        raise ValueError("for boundary=None the kernel must be smaller than the array;"
+                         " use boundary in ['fill', 'extend', 'wrap'] instead.")
+    if var:
+        fill_value = 0.
+    # The recursive filter has long tails;  pad by 6 sigma
+    npad = int(np.ceil(6. * sigma)) + 3
+    padded = _pad_rows(values, npad, boundary, fill_value)
+
+    isnan = np.isnan(padded)
+    if np.any(isnan):
+        padded[isnan] = 0.
+        # Sum of the kernel over the good pixels
+        norm = _recursive_gauss((~isnan).astype(float), sigma)[:, npad:npad + npix]
+        bad = norm < 1e-8
+        norm[bad] = 1.
+        if var:
+            norm = norm**2
+    else:
+        bad, norm = None, 1.
+    result = _recursive_gauss(padded, fsigma)[:, npad:npad + npix] / norm
+    if var:
+        result /= 2. * np.sqrt(np.pi) * sigma
+    if bad is not None:
+        result[bad] = np.nan
+    if boundary is None:
+        result[:, :nhalf] = 0.
+        result[:, npix - nhalf:] = 0.
+
+    if np.ndim(array) == 1:
+        result = result[0]
+    if unit is not None:
+        result = result * unit
+    return result
+
 
+def _recursive_gauss(values, sigma):
+    """ Recursive Gaussian along the rows of `values`
+
+    A third-order filter run forwards then backwards, with the poles
+    of van Vliet, Young & Verbeek (1998, Proc. ICPR, 1, 509) scaled
+    so that the variance of the response is exactly sigma**2.
+
+    Parameters
+    ----------
+    values : ndarray, shape (nspec, N)
+    sigma : float
+      In pixels;  >= 0.5
+
+    Returns
+    -------
+    smoothed : ndarray, shape (nspec, N)
+    """
+    from scipy.signal import lfilter, lfilter_zi
+    from scipy.optimize import brentq
+    poles = np.array([1.41650+1.00829j, 1.41650-1.00829j, 1.86543])  # For sigma=2
+    # Variance of the forward-backward response for poles**(1/q)
+    variance = lambda q: np.real(np.sum(2. * poles**(1./q) / (poles**(1./q) - 1.)**2))
+    q = brentq(lambda q: variance(q) - sigma**2, 0.05, 10. * sigma + 10.)
+    a = np.real(np.poly(1. / poles**(1./q)))
+    B = np.sum(a)  # Unit gain
+    # Start each pass in the steady state of its first value
+    zi = lfilter_zi([B], a)[np.newaxis, :]
+    forward, _ = lfilter([B], a, values, axis=-1, zi=zi * values[:, :1])
+    backward, _ = lfilter([B], a, forward[:, ::-1], axis=-1, zi=zi * forward[:, -1:])
+    return backward[:, ::-1]
+
+
+def _pad_rows(values, npad, boundary, fill_value):
+    """ Pad the rows of `values` by npad pixels on each side
+
+    Parameters
+    ----------
+    values : ndarray, shape (nspec, N)
+    npad : int
+    boundary : str
+      None (0.), 'fill' (fill_value), 'wrap' or 'extend'
+    fill_value : float
+
+    Returns
+    -------
+    padded : ndarray, shape (nspec, N+2*npad)
+    """
+    if boundary == 'wrap':
+        return np.pad(values, ((0, 0), (npad, npad)), mode='wrap')
+    elif boundary == 'extend':
+        return np.pad(values, ((0, 0), (npad, npad)), mode='edge')
+    elif boundary in [None, 'fill']:
+        return np.pad(values, ((0, 0), (npad, npad)), mode='constant',
+                      constant_values=fill_value if boundary == 'fill' else 0.)
+    raise ValueError("Invalid boundary option: must be one of None, 'fill', 'wrap' or 'extend'")
@@ -15,6 +15,7 @@ import numpy as np
 import warnings
 import os, pdb
 import json
+from collections import OrderedDict
 
 from six import itervalues
 
@@ -23,12 +24,15 @@ from astropy import units as u
 from astropy.table import Table, Column
 from astropy.io.fits.hdu.table import BinTableHDU
 
+from linetools import utils as ltu
+
 from .xspectrum1d import XSpectrum1D
+from .columnar import LazyData
 
 
 def readspec(specfil, inflg=None, efil=None, verbose=False, multi_ivar=False,
              format='ascii', exten=None, head_exten=0, debug=False, select=0,
-             **kwargs):
+             lazy=False, registry=None, **kwargs):
     """ Read a FITS file (or astropy Table or ASCII file) into a
     XSpectrum1D class
 
@@ -54,6 +58,14 @@ def readspec(specfil, inflg=None, efil=None, verbose=False, multi_ivar=False,
       Selected spectrum (for sets of 1D spectra, e.g. DESI brick)
     head_exten : int, optional
       Extension for header to ingest
+    lazy : bool, optional
+      Read each spectrum only when it is accessed, from a memory-mapped
+      FITS file or the HDF5 dataset.  Supported for DESI bricks and
+      XSpectrum1D HDF5 files;  other formats are read in full.
+    registry : FormatRegistry, optional
+      Formats already resolved.  A file whose HDU layout is registered
+      skips format detection (and, for binary tables, the column and
+      unit search);  otherwise what is found is registered.
     **kwargs : optional
       Passed to XSpectrum1D object
 
@@ -83,9 +95,11 @@ def readspec(specfil, inflg=None, efil=None, verbose=False, multi_ivar=False,
             datfil, chk = chk_for_gz(specfil.strip())
             if chk == 0:
                 raise IOError('File does not exist {}'.format(specfil))
+            if lazy:
+                kwargs['memmap'] = True
             hdulist = fits.open(os.path.expanduser(datfil), **kwargs)
         elif '.hdf5' in specfil:  # HDF5
-            return parse_hdf5(specfil, **kwargs)
+            return parse_hdf5(specfil, lazy=lazy, **kwargs)
         else: #ASCII
             tbl = Table.read(specfil,format=format)
             # No header?
@@ -106,82 +120,97 @@ def readspec(specfil, inflg=None, efil=None, verbose=False, multi_ivar=False,
 
     head0 = hdulist[0].header
 
-    if is_UVES_popler(head0):
+    # Format
+    if registry is None:
+        entry = dict(format=detect_format(hdulist))
+    else:
+        key, entry = registry.lookup(hdulist)
+        if entry is None:
+            entry = dict(format=detect_format(hdulist))
+            registry.register(key, entry)
+    fmt = entry['format']
+
+    if fmt == 'UVES_popler':
         if debug:
             print('linetools.spectra.io.readspec(): Reading UVES popler format')
         xspec1d = parse_UVES_popler(hdulist, **kwargs)
 
-    elif head0['NAXIS'] == 0:
-        # Binary FITS table
+    elif fmt == 'binary_table':
         if debug:
             print('linetools.spectra.io.readspec(): Assuming binary fits table')
-        xspec1d = parse_FITS_binary_table(hdulist, exten=exten, **kwargs)
-
-    elif head0['NAXIS'] == 1: # Data in the zero extension
-
-        # How many entries?
-        if len(hdulist) == 1:  # Old school (one file per flux, error)
-            if debug:
-                print(
+        tags = dict([(key, kwargs[key]) for key in binary_table_tags
+                     if kwargs.get(key) is not None])
+        if (len(tags) == 0) and ('columns' in entry) and (entry['exten'] == exten):
+            columns = entry['columns']
+        else:
+            columns = binary_table_columns(hdulist, exten=exten, **tags)
+            if (registry is not None) and (len(tags) == 0) and (columns is not None):
+                entry.update(exten=exten, columns=columns)
+        if columns is None:
+            return
+        xspec1d = parse_FITS_binary_table(hdulist, exten=exten, columns=columns, **kwargs)
+
+    elif fmt == 'two_file':  # Old school (one file per flux, error)
+        if debug:
+            print(
   'linetools.spectra.io.readspec(): Assuming flux and err in separate files')
-            xspec1d = parse_two_file_format(specfil, hdulist, efil=efil, **kwargs)
+        xspec1d = parse_two_file_format(specfil, hdulist, efil=efil, **kwargs)
 
-        elif hdulist[0].name == 'FLUX':
-            if debug:
-                print(
+    elif fmt == 'linetools':
+        if debug:
+            print(
   'linetools.spectra.io.readspec(): Assuming separate flux and err files.')
-            xspec1d = parse_linetools_spectrum_format(hdulist, **kwargs)
+        xspec1d = parse_linetools_spectrum_format(hdulist, **kwargs)
 
-        else:  # ASSUMING MULTI-EXTENSION
-            co=None
-            if debug:
-                print(
-              'linetools.spectra.io.readspec(): Assuming multi-extension')
+    elif fmt == 'multi_ext':
+        co=None
+        if debug:
+            print(
+          'linetools.spectra.io.readspec(): Assuming multi-extension')
 
-            if len(hdulist) <= 2:
-                raise RuntimeError('No wavelength info but only 2 extensions!')
-            fx = hdulist[0].data.flatten()
-            try:
-                sig = hdulist[1].data.flatten()
-            except AttributeError:  # Error array is "None"
-                sig = None
-            wave = hdulist[2].data.flatten()
-            # BOSS/SDSS?
-            try:
-                multi_ivar = head0['TELESCOP'][0:4] in ['SDSS']
-            except KeyError:
-                pass
-            #
-            if multi_ivar is True:
-                tmpsig = np.zeros(len(sig))
-                gdp = np.where(sig > 0.)[0]
-                tmpsig[gdp] = np.sqrt(1./sig[gdp])
-                sig = tmpsig
-                wave = 10.**wave
-
-            # Look for co
-            if len(hdulist) == 4:
-                data = hdulist[3].data
-                if 'float' in data.dtype.name:  # This can be an int mask (e.g. BOSS)
-                    co = data
-
-            wave = give_wv_units(wave)
-            xspec1d = XSpectrum1D.from_tuple((wave, fx, sig, co), **kwargs)
+        if len(hdulist) <= 2:
+            raise RuntimeError('No wavelength info but only 2 extensions!')
+        fx = hdulist[0].data.flatten()
+        try:
+            sig = hdulist[1].data.flatten()
+        except AttributeError:  # Error array is "None"
+            sig = None
+        wave = hdulist[2].data.flatten()
+        # BOSS/SDSS?
+        try:
+            multi_ivar = head0['TELESCOP'][0:4] in ['SDSS']
+        except KeyError:
+            pass
+        #
+        if multi_ivar is True:
+            tmpsig = np.zeros(len(sig))
+            gdp = np.where(sig > 0.)[0]
+            tmpsig[gdp] = np.sqrt(1./sig[gdp])
+            sig = tmpsig
+            wave = 10.**wave
+
+        # Look for co
+        if len(hdulist) == 4:
+            data = hdulist[3].data
+            if 'float' in data.dtype.name:  # This can be an int mask (e.g. BOSS)
+                co = data
+
+        wave = give_wv_units(wave)
+        xspec1d = XSpectrum1D.from_tuple((wave, fx, sig, co), **kwargs)
+
+    elif fmt == 'DESI_brick':
+        if debug:
+            print('linetools.spectra.io.readspec(): Assuming DESI brick')
+        xspec1d = parse_DESI_brick(hdulist, select=select, lazy=lazy)
 
-    elif head0['NAXIS'] == 2:
-        if (hdulist[0].name == 'FLUX') and (hdulist[2].name == 'WAVELENGTH'):  # DESI
-            if debug:
-                print('linetools.spectra.io.readspec(): Assuming DESI brick')
-            xspec1d = parse_DESI_brick(hdulist, select=select)
-
-        else:  # SDSS
-            if debug:
-                print('linetools.spectra.io.readspec(): Assuming SDSS format')
-            fx = hdulist[0].data[0, :].flatten()
-            sig = hdulist[0].data[2, :].flatten()
-            wave = setwave(head0)
-            xspec1d = XSpectrum1D.from_tuple(
-                (give_wv_units(wave), fx, sig, None))
+    elif fmt == 'SDSS':
+        if debug:
+            print('linetools.spectra.io.readspec(): Assuming SDSS format')
+        fx = hdulist[0].data[0, :].flatten()
+        sig = hdulist[0].data[2, :].flatten()
+        wave = setwave(head0)
+        xspec1d = XSpectrum1D.from_tuple(
+            (give_wv_units(wave), fx, sig, None))
     else:  # Should not be here
         print('Not sure what has been input.  Send to JXP.')
         return
@@ -208,6 +237,7 @@ def readspec(specfil, inflg=None, efil=None, verbose=False, multi_ivar=False,
                     xspec1d.data['co'][xspec1d.select] = tmpco
                 # Mask
                 xspec1d.data['co'][xspec1d.select].mask = xspec1d.data['flux'][xspec1d.select].mask
+                xspec1d.set_diagnostics()
 
     # Add in the header
     if head_exten == 0:
@@ -222,6 +252,273 @@ def readspec(specfil, inflg=None, efil=None, verbose=False, multi_ivar=False,
     return xspec1d
 
 
+def detect_format(hdulist):
+    """ Identify the format of a spectrum from its HDU list
+
+    Parameters
+    ----------
+    hdulist : FITS HDU list (or list of [PrimaryHDU, Table])
+
+    Returns
+    -------
+    fmt : str or None
+      One of 'UVES_popler', 'binary_table', 'two_file', 'linetools',
+      'multi_ext', 'DESI_brick', 'SDSS';  None if not recognized
+    """
+    head0 = hdulist[0].header
+    if is_UVES_popler(head0):
+        return 'UVES_popler'
+    elif head0['NAXIS'] == 0:
+        return 'binary_table'
+    elif head0['NAXIS'] == 1:  # Data in the zero extension
+        if len(hdulist) == 1:
+            return 'two_file'
+        elif hdulist[0].name == 'FLUX':
+            return 'linetools'
+        else:
+            return 'multi_ext'
+    elif head0['NAXIS'] == 2:
+        if (hdulist[0].name == 'FLUX') and (hdulist[2].name == 'WAVELENGTH'):
+            return 'DESI_brick'
+        else:
+            return 'SDSS'
+    return None
+
+
+def hdu_signature(hdulist):
+    """ Fingerprint of the layout of an HDU list
+
+    Files with the same signature (e.g. from one instrument or survey)
+    are read with the same format and columns, so these need only be
+    found once for them (see FormatRegistry).
+
+    Parameters
+    ----------
+    hdulist : FITS HDU list (or list of [PrimaryHDU, Table])
+
+    Returns
+    -------
+    signature : tuple
+      UVES_popler flag, TELESCOP and INSTRUME of the primary header,
+      then (name, type, NAXIS, column names, column units) of each HDU
+    """
+    head0 = hdulist[0].header
+    layout = []
+    for hdu in hdulist:
+        header = getattr(hdu, 'header', {})
+        if isinstance(hdu, Table):
+            names = tuple(hdu.colnames)
+            units = tuple([None if hdu[name].unit is None else hdu[name].unit.to_string()
+                           for name in names])
+        else:
+            nfield = header.get('TFIELDS', 0)
+            names = tuple([header.get('TTYPE{:d}'.format(ii+1))
+                           for ii in range(nfield)])
+            # The wavelength unit found for the columns is registered too
+            units = tuple([header.get('TUNIT{:d}'.format(ii+1))
+                           for ii in range(nfield)])
+        layout.append((getattr(hdu, 'name', None), type(hdu).__name__,
+                       header.get('NAXIS'), names, units))
+    return (is_UVES_popler(head0), head0.get('TELESCOP'), head0.get('INSTRUME'),
+            tuple(layout))
+
+
+class FormatRegistry(object):
+    """ Formats resolved by readspec, keyed by the HDU layout of the files
+
+    Each entry holds the format found by detect_format() and, for binary
+    FITS tables, the extension plus the columns and wavelength unit
+    found by binary_table_columns().  Files whose hdu_signature() is
+    registered skip all of that probing.
+
+    Parameters
+    ----------
+    filename : str, optional
+      JSON file written by write(), to start from
+    """
+    def __init__(self, filename=None):
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if filename is not None:
+            self.read(filename)
+
+    @staticmethod
+    def key(hdulist):
+        """ Registry key of an HDU list;  the JSON of its hdu_signature()
+        """
+        return json.dumps(hdu_signature(hdulist))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def __repr__(self):
+        return '<FormatRegistry: nentry={:d}, hits={:d}, misses={:d}>'.format(
+            len(self), self.hits, self.misses)
+
+    def lookup(self, hdulist):
+        """ Find the entry for an HDU list
+
+        Parameters
+        ----------
+        hdulist : FITS HDU list (or list of [PrimaryHDU, Table])
+
+        Returns
+        -------
+        key : str
+        entry : dict or None
+          None if not registered
+        """
+        key = self.key(hdulist)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, entry
+
+    def register(self, key, entry):
+        """ Add an entry
+
+        Parameters
+        ----------
+        key : str
+          From key()
+        entry : dict
+          With at least 'format';  binary tables may add 'exten' and 'columns'
+        """
+        if 'format' not in entry:
+            raise ValueError("Entry must include the format")
+        self.entries[key] = entry
+
+    def clear(self):
+        """ Remove all of the entries
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def to_table(self):
+        """ Summarize the entries
+
+        Returns
+        -------
+        tbl : Table
+          One row per entry with the key, format, extension, the columns
+          of wave, flux, sig, ivar, var and co and the wavelength unit
+          ('' where not set)
+        """
+        cols = ['wave', 'flux', 'sig', 'ivar', 'var', 'co', 'wave_unit']
+        rows = []
+        for key, entry in self.entries.items():
+            columns = entry.get('columns', {})
+            exten = entry.get('exten')
+            rows.append([key, entry['format'], '' if exten is None else str(exten)] +
+                        [columns.get(col) or '' for col in cols])
+        names = ['key', 'format', 'exten'] + cols
+        if len(rows) == 0:
+            return Table(names=names, dtype=['U1']*len(names))
+        return Table(rows=rows, names=names)
+
+    def write(self, filename, overwrite=True):
+        """ Write the entries to a JSON file
+
+        Parameters
+        ----------
+        filename : str
+        overwrite : bool, optional
+        """
+        ltu.savejson(filename, dict(self.entries), overwrite=overwrite,
+                     easy_to_read=True)
+
+    def read(self, filename):
+        """ Add the entries of a JSON file written by write()
+
+        Parameters
+        ----------
+        filename : str
+        """
+        entries = ltu.loadjson(filename)
+        for key in sorted(entries.keys()):
+            self.register(key, entries[key])
+
+
+# Formats resolved by readspecs()
+format_registry = FormatRegistry()
+
+
+def _readspecs_one(args):
+    """ Read one file for readspecs()
+    """
+    specfil, registry, kwargs = args
+    if registry is None:
+        registry = format_registry
+    return readspec(specfil, registry=registry, **kwargs)
+
+
+def readspecs(files, workers=1, processes=False, collate=True, registry=None,
+              **kwargs):
+    """ Read a set of spectrum files, several at a time
+
+    The format of each file is looked up in a FormatRegistry, by the
+    signature of its HDU layout, so it is detected only once per
+    instrument/survey.
+
+    Parameters
+    ----------
+    files : list of str
+    workers : int, optional
+      Number of files read concurrently
+    processes : bool, optional
+      Use a pool of processes instead of threads.  Each process keeps
+      its own format_registry
+    collate : bool, optional
+      If True, return the spectra collated into one XSpectrum1D.
+      Otherwise return a generator of XSpectrum1D, in the order of files
+    registry : FormatRegistry, optional
+      Defaults to the module's format_registry.  With processes=True,
+      each task works on a copy so new entries are not kept
+    **kwargs :
+      Passed to readspec()
+
+    Returns
+    -------
+    spec : XSpectrum1D or generator
+    """
+    from multiprocessing import Pool
+    from multiprocessing.pool import ThreadPool
+    from linetools.spectra import utils as ltsu
+
+    if isinstance(files, basestring):
+        files = [files]
+    tasks = [(specfil, registry, kwargs) for specfil in files]
+    if len(tasks) == 0:
+        raise IOError("No files to read")
+
+    def _gen():
+        if workers <= 1:
+            for task in tasks:
+                yield _readspecs_one(task)
+        else:
+            pool = (Pool if processes else ThreadPool)(workers)
+            try:
+                for spec in pool.imap(_readspecs_one, tasks):
+                    yield spec
+            finally:
+                pool.terminate()
+                pool.join()
+
+    if collate:
+        return ltsu.collate(list(_gen()))
+    return _gen()
+
+
 #### ###############################
 #  Grab values from the Binary FITS Table or Table
 def get_table_column(tags, hdulist, idx=None):
@@ -287,7 +584,6 @@ def get_wave_unit(tag, hdulist, idx=None):
         idx = 1
     # Use Table
     if isinstance(hdulist[idx],BinTableHDU):
-        tab = Table(hdulist[idx].data)
         header = hdulist[idx].header
     else:
         # NEED HEADER INFO
@@ -482,10 +778,24 @@ def parse_UVES_popler(hdulist, **kwargs):
     xspec1d = XSpectrum1D.from_tuple((uwave, fx, sig, co), **kwargs)
     return xspec1d
 
-def parse_FITS_binary_table(hdulist, exten=None, wave_tag=None, flux_tag=None,
-                            sig_tag=None, co_tag=None, var_tag=None,
-                            ivar_tag=None, **kwargs):
-    """ Read a spectrum from a FITS binary table
+# Keywords of parse_FITS_binary_table() naming its columns
+binary_table_tags = ('wave_tag', 'flux_tag', 'sig_tag', 'co_tag', 'var_tag', 'ivar_tag')
+
+
+def _find_tag(tags, names):
+    """ First of tags in names, or None
+    """
+    for tag in tags:
+        if tag in names:
+            return tag
+    return None
+
+
+def binary_table_columns(hdulist, exten=None, wave_tag=None, flux_tag=None,
+                         sig_tag=None, co_tag=None, var_tag=None, ivar_tag=None):
+    """ Find the columns of a spectrum in a FITS binary table
+
+    Only the column names and the header are searched;  no data are read.
 
     Parameters
     ----------
@@ -497,12 +807,22 @@ def parse_FITS_binary_table(hdulist, exten=None, wave_tag=None, flux_tag=None,
     sig_tag : str, optional
     co_tag : str, optional
     var_tag : str, optional
+    ivar_tag : str, optional
 
     Returns
     -------
-    xspec1d : XSpectrum1D
-      Parsed spectrum
+    columns : dict or None
+      Column names for wave, flux, sig, ivar, var and co (None if
+      absent;  at most one of sig, ivar and var is set) and the
+      wavelength unit as a string (None if not found).
+      None if there is no flux or wavelength column.
     """
+    idx = 1 if exten is None else exten
+    if isinstance(hdulist[idx], BinTableHDU):
+        names = set(hdulist[idx].columns.names)
+    else:
+        names = set(hdulist[idx].dtype.names)
+    columns = dict(sig=None, ivar=None, var=None)
     # Flux
     if flux_tag is None:
         flux_tags = ['SPEC', 'FLUX', 'FLAM', 'FX', 'FNORM',
@@ -510,8 +830,8 @@ def parse_FITS_binary_table(hdulist, exten=None, wave_tag=None, flux_tag=None,
                      'COUNTS', 'OPT_FLAM']
     else:
         flux_tags = [flux_tag]
-    fx, fx_tag = get_table_column(flux_tags, hdulist, idx=exten)
-    if fx is None:
+    columns['flux'] = _find_tag(flux_tags, names)
+    if columns['flux'] is None:
         print('Binary FITS Table but no Flux tag. Searched fo these tags:\n',
               flux_tags)
         return
@@ -523,27 +843,21 @@ def parse_FITS_binary_table(hdulist, exten=None, wave_tag=None, flux_tag=None,
                     'FLUX_ERROR','flux_error', 'OPT_FLAM_SIG']
     else:
         sig_tags = [sig_tag]
-    sig, sig_tag = get_table_column(sig_tags, hdulist, idx=exten)
-    if sig is None:
+    columns['sig'] = _find_tag(sig_tags, names)
+    if columns['sig'] is None:
         if ivar_tag is None:
             ivar_tags = ['IVAR', 'IVAR_OPT', 'ivar', 'FLUX_IVAR']
         else:
             ivar_tags = [ivar_tag]
-        ivar, ivar_tag = get_table_column(ivar_tags, hdulist, idx=exten)
-        if ivar is None:
+        columns['ivar'] = _find_tag(ivar_tags, names)
+        if columns['ivar'] is None:
             if var_tag is None:
                 var_tags = ['VAR', 'var']
             else:
                 var_tags = [var_tag]
-            var, var_tag = get_table_column(var_tags, hdulist, idx=exten)
-            if var is None:
+            columns['var'] = _find_tag(var_tags, names)
+            if columns['var'] is None:
                 warnings.warn('No error tag found. Searched for these tags:\n'+ str(sig_tags + ivar_tags + var_tags))
-            else:
-                sig = np.sqrt(var)
-        else:
-            sig = np.zeros(ivar.size)
-            gdi = np.where( ivar > 0.)[0]
-            sig[gdi] = np.sqrt(1./ivar[gdi])
     # Wavelength
     if wave_tag is None:
         wave_tags = ['WAVE','WAVELENGTH','LAMBDA','LOGLAM',
@@ -551,22 +865,83 @@ def parse_FITS_binary_table(hdulist, exten=None, wave_tag=None, flux_tag=None,
                      'wavelength', 'OPT_WAVE']
     else:
         wave_tags = [wave_tag]
-    wave, wave_tag = get_table_column(wave_tags, hdulist, idx=exten)
-    if wave_tag in ['LOGLAM','loglam']:
-        wave = 10.**wave
-    # Try for unit
-    wv_unit = get_wave_unit(wave_tag, hdulist, idx=exten)
-    if wv_unit is not None:
-        wave = wave * wv_unit
-    if wave is None:
+    columns['wave'] = _find_tag(wave_tags, names)
+    if columns['wave'] is None:
         print('Binary FITS Table but no wavelength tag. Searched for these tags:\n',
               wave_tags)
         return
+    # Try for unit
+    wv_unit = get_wave_unit(columns['wave'], hdulist, idx=exten)
+    columns['wave_unit'] = None if wv_unit is None else wv_unit.to_string()
+    # Continuum
     if co_tag is None:
         co_tags = ['CONT', 'CO', 'CONTINUUM', 'co', 'cont', 'continuum']
     else:
         co_tags = [co_tag]
-    co, co_tag = get_table_column(co_tags, hdulist, idx=exten)
+    columns['co'] = _find_tag(co_tags, names)
+    return columns
+
+
+def parse_FITS_binary_table(hdulist, exten=None, wave_tag=None, flux_tag=None,
+                            sig_tag=None, co_tag=None, var_tag=None,
+                            ivar_tag=None, columns=None, **kwargs):
+    """ Read a spectrum from a FITS binary table
+
+    Parameters
+    ----------
+    hdulist : FITS HDU list
+    exten : int, optional
+      Extension for the binary table.
+    wave_tag : str, optional
+    flux_tag : str, optional
+    sig_tag : str, optional
+    co_tag : str, optional
+    var_tag : str, optional
+    ivar_tag : str, optional
+    columns : dict, optional
+      Columns and wavelength unit from binary_table_columns().  If
+      given, the tags are ignored and no search is made
+
+    Returns
+    -------
+    xspec1d : XSpectrum1D
+      Parsed spectrum
+    """
+    if columns is None:
+        columns = binary_table_columns(hdulist, exten=exten, wave_tag=wave_tag,
+                                       flux_tag=flux_tag, sig_tag=sig_tag,
+                                       co_tag=co_tag, var_tag=var_tag,
+                                       ivar_tag=ivar_tag)
+        if columns is None:
+            return
+    idx = 1 if exten is None else exten
+    if isinstance(hdulist[idx], BinTableHDU):
+        tab = hdulist[idx].data
+    else:
+        tab = hdulist[idx]
+
+    def _column(key):
+        if columns.get(key) is None:
+            return None
+        return np.array(tab[columns[key]]).flatten()
+
+    fx = _column('flux')
+    # Error
+    sig = _column('sig')
+    if columns.get('ivar') is not None:
+        ivar = _column('ivar')
+        sig = np.zeros(ivar.size)
+        gdi = np.where( ivar > 0.)[0]
+        sig[gdi] = np.sqrt(1./ivar[gdi])
+    elif columns.get('var') is not None:
+        sig = np.sqrt(_column('var'))
+    # Wavelength
+    wave = _column('wave')
+    if columns['wave'] in ['LOGLAM','loglam']:
+        wave = 10.**wave
+    if columns.get('wave_unit') is not None:
+        wave = wave * u.Unit(columns['wave_unit'])
+    co = _column('co')
     # Finish
     xspec1d = XSpectrum1D.from_tuple((give_wv_units(wave), fx, sig, co), **kwargs)
 
@@ -616,13 +991,18 @@ def parse_linetools_spectrum_format(hdulist, **kwargs):
     return xspec1d
 
 
-def parse_hdf5(inp, close=True, **kwargs):
+def parse_hdf5(inp, close=True, lazy=False, **kwargs):
     """ Read a spectrum from HDF5 written in XSpectrum1D format
     Expects:  meta, data, units
 
     Parameters
     ----------
     inp : str or hdf5
+    close : bool, optional
+      Close the file when done.  Ignored if lazy
+    lazy : bool, optional
+      Read the spectra from the data set only when accessed.
+      The file is then kept open
 
     Returns
     -------
@@ -638,7 +1018,16 @@ def parse_hdf5(inp, close=True, **kwargs):
     else:
         hdf5 = inp
     # Data
-    data = hdf5[path+'data'].value
+    if lazy:
+        dset = hdf5[path+'data']
+        nspec, totpix = dset.shape[0], dset.dtype['wave'].shape[0]
+
+        def reader(rows):
+            data = dset[list(rows)]
+            return dict([(key, data[key]) for key in data.dtype.names])
+        data = LazyData(nspec, totpix, reader)
+    else:
+        data = hdf5[path+'data'].value
     # Meta
     if 'meta' in hdf5[path].keys():
         meta = json.loads(hdf5[path+'meta'].value)
@@ -658,6 +1047,8 @@ def parse_hdf5(inp, close=True, **kwargs):
             units[key] = u.dimensionless_unscaled
         else:
             units[key] = getattr(u, item)
+    if lazy:
+        return XSpectrum1D(data, None, meta=meta, units=units, storage='lazy', **kwargs)
     # Other arrays
     try:
         sig = data['sig']
@@ -674,7 +1065,7 @@ def parse_hdf5(inp, close=True, **kwargs):
                           meta=meta, units=units, **kwargs)
 
 
-def parse_DESI_brick(hdulist, select=0, **kwargs):
+def parse_DESI_brick(hdulist, select=0, lazy=False, **kwargs):
     """ Read a spectrum from a DESI brick format HDU list
 
     Parameters
@@ -682,12 +1073,23 @@ def parse_DESI_brick(hdulist, select=0, **kwargs):
     hdulist : FITS HDU list
     select : int, optional
       Spectrum selected. Default is 0
+    lazy : bool, optional
+      Read each spectrum only when it is accessed.  hdulist should
+      be opened with memmap=True and is kept open
 
     Returns
     -------
     xspec1d : XSpectrum1D
       Parsed spectrum
     """
+    if lazy:
+        nspec, totpix = hdulist[0].shape
+
+        def reader(rows):
+            return _DESI_brick_rows(hdulist, rows)
+        return XSpectrum1D(LazyData(nspec, totpix, reader), None, select=select,
+                           units=dict(wave=u.AA, flux=u.dimensionless_unscaled),
+                           storage='lazy', **kwargs)
     fx = hdulist[0].data
     # Sig
     if hdulist[1].name in ['ERROR', 'SIG']:
@@ -707,6 +1109,37 @@ def parse_DESI_brick(hdulist, select=0, **kwargs):
     return xspec1d
 
 
+def _DESI_brick_rows(hdulist, rows):
+    """ Read a set of spectra from a DESI brick
+
+    Parameters
+    ----------
+    hdulist : FITS HDU list
+    rows : int ndarray
+
+    Returns
+    -------
+    dict of wave, flux, sig arrays, shape (len(rows), npix)
+    """
+    # Only these rows are read from a memory-mapped file
+    fx = hdulist[0].data[rows]
+    # Sig
+    data = hdulist[1].data[rows]
+    if hdulist[1].name in ['ERROR', 'SIG']:
+        sig = data
+    else:
+        sig = np.zeros_like(data)
+        gdi = data > 0.
+        sig[gdi] = np.sqrt(1./data[gdi])
+    # Wave
+    wave = hdulist[2].data
+    if wave.shape != fx.shape[1:]:
+        wave = wave[rows]
+    else:
+        wave = np.tile(wave, (len(rows), 1))
+    return dict(wave=wave, flux=fx, sig=sig)
+
+
 def parse_two_file_format(specfil, hdulist, efil=None, **kwargs):
     """ Parse old two file format (one for flux, another for error).
 
@@ -10,12 +10,114 @@ from astropy.io import fits, ascii
 from astropy.units import Quantity
 import astropy.units as u
 from astropy.table import Table, QTable, Column
-import glob, imp
-from linetools.analysis.interp import interp_Akima
+import glob, imp, os
+import hashlib
+from collections import OrderedDict
+from linetools.analysis.interp import interp_Akima, interp_Akima_rows
 import warnings
 
 lt_path = imp.find_module('linetools')[1]
 
+# Number of convolution operators kept by each LSF object
+lsf_operator_cache_size = 8
+
+# Keep the parsed LSF tables on disk (see cached_lsf_table)
+use_lsf_cache = True
+
+# LSF objects of LSF.from_config(), keyed on their instrument configuration
+_lsf_registry = dict()
+
+
+def lsf_cache_dir():
+    """ Default directory of the parsed LSF tables, in the astropy cache directory
+    """
+    from astropy.config import get_cache_dir
+    return os.path.join(get_cache_dir(), 'linetools', 'lsf')
+
+
+def cached_lsf_table(label, files, read, cache_dir=None):
+    """ An LSF table, parsed from its text files once and then read
+    from a binary (.npz) copy
+
+    The copy is remade whenever the name, size or modification time
+    of one of the text files changes.
+
+    Parameters
+    ----------
+    label : str
+      Name of the table, e.g. 'COS_fuv_G130M_lp1_empir'
+    files : list of str
+      Text files the table is parsed from
+    read : callable
+      Parses the files, returning a Table of numerical columns
+    cache_dir : str, optional
+      Defaults to lsf_cache_dir().  If it cannot be written,
+      the table is parsed every time
+
+    Returns
+    -------
+    table : Table
+      With float columns
+    """
+    def to_float(table):
+        return Table([np.asarray(table[name], dtype=float) for name in table.colnames],
+                     names=table.colnames)
+
+    if cache_dir is None:
+        if not use_lsf_cache:
+            return to_float(read())
+        try:
+            cache_dir = lsf_cache_dir()
+        except Exception:  # No cache directory
+            return to_float(read())
+    sha = hashlib.sha1()
+    for fname in files:
+        stat = os.stat(fname)
+        sha.update('{:s}:{:d}:{:d}'.format(os.path.basename(fname), stat.st_size,
+                                           int(stat.st_mtime)).encode('utf-8'))
+    signature = sha.hexdigest()
+    cache_file = os.path.join(cache_dir, label + '.npz')
+    if os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as data:
+                if str(data['signature']) == signature:
+                    return Table(list(data['values']),
+                                 names=[str(name) for name in data['names']])
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+    table = to_float(read())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write then rename, so other processes never read a partial file
+        tmp_file = '{:s}.{:d}.tmp.npz'.format(cache_file[:-4], os.getpid())
+        np.savez(tmp_file, signature=signature, names=np.array(table.colnames),
+                 values=np.array([table[name].data for name in table.colnames]))
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        warnings.warn("Could not write the LSF table to {:s}".format(cache_file))
+    return table
+
+
+def clear_lsf_cache(disk=False, cache_dir=None):
+    """ Empty the registry of LSF.from_config() and, optionally, the
+    binary copies of the LSF tables
+
+    Parameters
+    ----------
+    disk : bool, optional
+      Also remove the .npz files of cached_lsf_table()
+    cache_dir : str, optional
+      Defaults to lsf_cache_dir()
+    """
+    _lsf_registry.clear()
+    if disk:
+        if cache_dir is None:
+            cache_dir = lsf_cache_dir()
+        for cache_file in glob.glob(os.path.join(cache_dir, '*.npz')):
+            os.remove(cache_file)
+
+
 class LSF(object):
     """Class to deal with line-spread-functions (LSFs) from
     various different astronomical spectrographs.
@@ -60,9 +162,44 @@ class LSF(object):
 
         #reformat self._data
         self.check_and_reformat_data()
+
+        # tabulated kernels as a (ncol, npix) array sorted by wavelength, for interpolate_to_wv0
+        if len(self._data.colnames) > 2:
+            col_names = self._data.keys()[1:]
+            col_waves = np.array([float(name.split('A')[0]) for name in col_names])
+            srt = np.argsort(col_waves)
+            self._col_waves = col_waves[srt]
+            self._kernels = np.array([np.asarray(self._data[col_names[ii]], dtype=float) for ii in srt])
+
+        # convolution operators, keyed on the wavelength grid (see convolution_operator)
+        self._operators = OrderedDict()
         
         #other relevant values to initialize?
 
+    @classmethod
+    def from_config(cls, instr_config):
+        """LSF object of `instr_config`, shared through an in-memory registry
+
+        The LSF is made on the first call for a given configuration;
+        later calls return the same object, including its cached
+        convolution operators.  See clear_lsf_cache().
+
+        Parameters
+        ----------
+        instr_config : dict
+            See LSF
+
+        Returns
+        -------
+        lsf : LSF
+        """
+        if not isinstance(instr_config, dict):
+            raise TypeError('`instr_config` must be a dictionary.')
+        key = tuple(sorted((str(ikey), repr(value)) for ikey, value in instr_config.items()))
+        if key not in _lsf_registry:
+            _lsf_registry[key] = cls(dict(instr_config))
+        return _lsf_registry[key]
+
     def get_lsf(self, wv_array, kind='Akima'):
         """ Given a wavelength array `wv_array`, it returns
         the LSF kernel at the central wavelength of the array, 
@@ -220,7 +357,26 @@ class LSF(object):
         
         # point to the right file
         file_name = lt_path + '/data/lsf/{}/{}'.format(self.name, file_name)
-        
+
+        pixel_scale = pixel_scale_dict[grating]  # read from dictionary defined above
+        # read data, or its cached copy
+        label = 'COS_' + os.path.basename(file_name).split('.')[0]
+        data = cached_lsf_table(label, [file_name], lambda: self.read_COS_table(file_name))
+
+        return pixel_scale, data
+
+    def read_COS_table(self, file_name):
+        """Read an HST/COS LSF table file
+
+        Parameters
+        ----------
+        file_name : str
+
+        Returns
+        -------
+        data : Table
+            With columns 'rel_pix' and one kernel per wavelength
+        """
         # get column names
         f = open(file_name,'r')
         line = f.readline()  # first line of file
@@ -230,12 +386,11 @@ class LSF(object):
         # by construction first column should be separated by `,`
         col_names = line.split(',')
         col_names[0] = 'rel_pix'
-        
-        pixel_scale = pixel_scale_dict[grating]  # read from dictionary defined above
+
         # read data
         data = ascii.read(file_name, data_start=1, names=col_names)
-        
-        return pixel_scale, data
+
+        return data
 
     def load_STIS_data(self):
         """Load the right data according to `instr_config` for HST/STIS
@@ -324,6 +479,31 @@ class LSF(object):
         lsf_files = np.array(lsf_files)[sorted_inds]
         wa_names = np.array(wa_names)[sorted_inds]
 
+        pixel_scale = pixel_scale_dict[grating]  # read from dictionary defined above
+        # read the kernels, or their cached copy
+        label = 'STIS_{}_{}'.format(grating, slit)
+        data_table = cached_lsf_table(
+            label, lsf_files, lambda: self.read_STIS_tables(lsf_files, wa_names, pixel_scale, slit))
+        # todo: work out a cleverer approach to this whole issue of having different rel_pix, pixel_scales, etc
+        return pixel_scale, data_table
+
+    def read_STIS_tables(self, lsf_files, wa_names, pixel_scale, slit):
+        """Read the HST/STIS LSF table files of a grating and project
+        the kernels of `slit` onto a common relative pixel grid
+
+        Parameters
+        ----------
+        lsf_files : list of str
+        wa_names : list of str
+            Wavelengths of the files
+        pixel_scale : Quantity or str
+        slit : str
+
+        Returns
+        -------
+        data_table : Table
+            With columns 'rel_pix' and one kernel per wavelength
+        """
         # read the relevant kernels; they may have different rel_pix values depending on wave
         kernels_dict = dict()
         for ii, file_name in enumerate(lsf_files):
@@ -358,12 +538,12 @@ class LSF(object):
             '''
 
             # create column with absolute wavelength based on pixel scales
-            if isinstance(pixel_scale_dict[grating],np.unicode):
+            if not isinstance(pixel_scale, Quantity):
                 # deal with wavelength-dependent pixel scale (i.e., STIS echelle)
-                scalefac = 1./float(pixel_scale_dict[grating].split('/')[-1])
+                scalefac = 1./float(pixel_scale.split('/')[-1])
                 wave_aux = float(wa_names[ii])*u.AA * (1. + data_aux['rel_pix']*scalefac)
             else:
-                wave_aux = float(wa_names[ii])*u.AA + data_aux['rel_pix']*pixel_scale_dict[grating]
+                wave_aux = float(wa_names[ii])*u.AA + data_aux['rel_pix']*pixel_scale
             data_aux['wv'] = wave_aux  # not used for now, but may be useful with a different approach
             # create column with normalized kernel for relevant slit
             kernel = data_aux[slit] / np.sum(data_aux[slit])
@@ -389,10 +569,8 @@ class LSF(object):
                                       kernels_dict[wa_name]['rel_pix'], kernels_dict[wa_name]['kernel'])
             data_table['{}A'.format(wa_name)] = kernel_aux
 
-        pixel_scale = pixel_scale_dict[grating]  # read from dictionary defined above
-        # import pdb; pdb.set_trace()
-        # todo: work out a cleverer approach to this whole issue of having different rel_pix, pixel_scales, etc
-        return pixel_scale, data_table
+
+        return data_table
 
     def load_gauss_data(self):
         """Instantiate Gaussian LSF object with given configuration
@@ -414,7 +592,7 @@ class LSF(object):
         ### need to provide fwhm in pixels (and convert to standard deviation)
         fwhm_pix = fwhm / pixel_scale
         stddev_pix = fwhm_pix / (2.0 * (2.0*np.log(2.0))**0.5)
-        xarr = np.arange(-50,51,0.2)
+        xarr = np.linspace(-50., 50., 501)  # symmetric about 0
         kern = norm.pdf(xarr,scale = stddev_pix)
 
         data_table = Table()
@@ -452,8 +630,8 @@ class LSF(object):
 
         # create Columns to store the LSF and wavelength
         lsf_vals = Column(name='kernel', data=self._data['lsf_vals'])
-        wv_array = [(self.pixel_scale * self._data['rel_pix'][i] + wv0).value
-                    for i in range(len(self._data))]
+        wv0 = wv0.to('AA').value
+        wv_array = wv0 + self.pixel_scale_at(wv0) * np.asarray(self._data['rel_pix'])
         wv = Column(name='wv', data=wv_array, unit=u.AA)
         # create lsf Table
         lsf = Table()
@@ -467,11 +645,113 @@ class LSF(object):
 
 
 
+    def tabulated_kernels(self, wv0):
+        """LSF kernels at wavelengths wv0, on the relative pixels of the tables
+
+        Tabulated kernels are linearly interpolated between the two
+        wavelengths bracketing each wv0;  up to one table spacing
+        beyond the tabulated range the kernel of the nearest
+        wavelength is used.  A single kernel (e.g. Gaussian) is
+        valid at any wavelength.
+
+        Parameters
+        ----------
+        wv0 : ndarray, shape(nwv,)
+            Wavelengths in Angstroms
+
+        Returns
+        -------
+        kernels : ndarray, shape(nwv, len(self._data))
+            Not normalized
+        """
+        wv0 = np.atleast_1d(np.asarray(wv0, dtype=float))
+        if len(self._data.colnames) == 2:
+            return np.tile(np.asarray(self._data['lsf_vals'], dtype=float), (wv0.size, 1))
+        col_waves, kernels = self._col_waves, self._kernels
+        dwv_blue = np.abs(col_waves[1] - col_waves[0])
+        dwv_red = np.abs(col_waves[-1] - col_waves[-2])
+        # we don't want to extrapolate wildly, but allow LSF instantiations for wv0 outside range of 'col_waves'
+        too_far = (col_waves[0] - wv0 >= dwv_blue) | (wv0 - col_waves[-1] >= dwv_red)
+        if np.any(too_far):
+            raise ValueError("wv0={:.2f}A too far outside range of defined LSFs. "
+                             "Perhaps you've chosen the wrong grating?".format(wv0[too_far][0]))
+        if np.any((col_waves[0] - wv0 > dwv_blue/2.) | (wv0 - col_waves[-1] > dwv_red/2.)):
+            warnings.warn(
+                "LSF may result from extrapolation outside wavelength range characterized for current grating.")
+        # linear interpolation between the 2 bracketing kernels;  the
+        # shortest (longest) wv LSF definition below (above) the range
+        ind_blue = np.clip(np.searchsorted(col_waves, wv0, side='right') - 1, 0, len(col_waves) - 2)
+        frac = np.clip((wv0 - col_waves[ind_blue]) / (col_waves[ind_blue + 1] - col_waves[ind_blue]), 0., 1.)
+        return (1. - frac)[:, np.newaxis] * kernels[ind_blue] + frac[:, np.newaxis] * kernels[ind_blue + 1]
+
+    def get_kernels(self, wv0, rel_pix, dwv=None, kind='Akima'):
+        """LSF kernels at many central wavelengths, on a shared relative pixel grid
+
+        The batched counterpart of get_lsf(), with plain arrays:
+        kernel j is the LSF at wv0[j] evaluated at the wavelengths
+        wv0[j] + rel_pix * dwv[j].  The tabulated kernels are
+        interpolated in wavelength as in interpolate_to_wv0(), then
+        in relative pixel with all of the kernels at once.
+
+        Parameters
+        ----------
+        wv0 : float, ndarray or Quantity, shape(nwv,)
+            Central wavelengths;  floats are taken in Angstroms
+        rel_pix : ndarray, shape(npix,)
+            Relative pixels of the kernels, e.g. np.arange(-n, n+1)
+        dwv : float or ndarray, shape(nwv,), optional
+            Size of the pixels of `rel_pix` in Angstroms at each wv0.
+            Default is the pixel scale of the LSF tables
+        kind : str, optional
+            Interpolation of the LSF onto `rel_pix`, either
+            ('linear', 'Akima');  default is `Akima`.
+
+        Returns
+        -------
+        kernels : ndarray, shape(nwv, npix)
+            Each normalized to unit sum, and 0 beyond the tabulated LSF
+        """
+        if kind not in ['linear', 'Akima', 'akima']:
+            raise ValueError('Only `linear` or `Akima` interpolation available.')
+        if isinstance(wv0, Quantity):
+            wv0 = wv0.to('AA').value
+        wv0 = np.atleast_1d(np.asarray(wv0, dtype=float))
+        rel_pix = np.asarray(rel_pix, dtype=float)
+        # positions in the pixels of the LSF tables
+        if dwv is None:
+            lsf_pix = np.tile(rel_pix, (wv0.size, 1))
+        else:
+            if isinstance(dwv, Quantity):
+                dwv = dwv.to('AA').value
+            scale = np.asarray(dwv, dtype=float) / self.pixel_scale_at(wv0)
+            lsf_pix = rel_pix[np.newaxis, :] * np.atleast_1d(scale)[:, np.newaxis]
+        tab_pix = np.asarray(self._data['rel_pix'], dtype=float)
+
+        # make sure rel_pix is dense enough to sample the LSF kernel
+        nsample = np.sum(np.abs(lsf_pix) <= np.max(tab_pix), axis=1)
+        if np.any(nsample < 10):  # as in interpolate_to_wv_array()
+            raise ValueError('The input `rel_pix` is undersampling the LSF kernel! Try a finer grid.')
+
+        kernels = self.tabulated_kernels(wv0)
+        if kind == 'linear':
+            ind = np.clip(np.searchsorted(tab_pix, lsf_pix, side='right') - 1, 0, len(tab_pix) - 2)
+            frac = (lsf_pix - tab_pix[ind]) / (tab_pix[ind + 1] - tab_pix[ind])
+            lsf_vals = (1. - frac) * np.take_along_axis(kernels, ind, axis=1) + \
+                frac * np.take_along_axis(kernels, ind + 1, axis=1)
+            lsf_vals[(lsf_pix < tab_pix[0]) | (lsf_pix > tab_pix[-1])] = 0.
+        else:
+            lsf_vals = interp_Akima_rows(lsf_pix, tab_pix, kernels, fill_value=0.)
+
+        # make sure the kernels are never negative, and normalize
+        lsf_vals = np.maximum(lsf_vals, 0.)
+        lsf_vals /= np.sum(lsf_vals, axis=1)[:, np.newaxis]
+        return lsf_vals
+
     def interpolate_to_wv0(self, wv0):
         """Retrieves a unique LSF valid at wavelength wv0
 
-        This is done by linearly interpolating from tabulated values
-        at different wavelengths. These tabulated values (stored
+        This is done by linearly interpolating between the two tabulated
+        kernels at the wavelengths bracketing wv0. These tabulated values (stored
         internally in self._data) are usually given as calibration
         products by instrument developers and should be loaded by
         self.load_XX_data() in the initialization stage of LSF(),
@@ -495,79 +775,16 @@ class LSF(object):
 
         # get wa0 to Angstroms
         wv0 = wv0.to('AA').value
-
-        # transform to wavelength in float() form assuming Angstroms
-        col_names = self._data.keys()
-        col_waves = np.array([float(name.split('A')[0]) for name in col_names[1:]])
-
-        # find out the closest 2 columns in self._data to wv0 (on each side); these kernels will be used for interpolation
-        seps =  np.fabs(col_waves - wv0)
-
-        closest_ind = np.argsort(seps)[0]  # the 1 closest
-        if closest_ind == 0:  # lower edge
-            ind_blue = closest_ind
-        elif closest_ind == len(col_waves) - 1:  # upper edge
-            ind_blue = closest_ind - 1
-        elif (col_waves[closest_ind] - wv0) > 0:  # middle case 1
-            ind_blue = closest_ind - 1
-        else:  # middle case 2
-            ind_blue = closest_ind
-        ind_red = ind_blue + 1
-
-        # create a smaller version of self._data with the 2 most relevant columns
-        good_keys = col_names[1:]  # get rid of the first name, i.e. 'rel_pix'
-        good_keys = good_keys[ind_blue : ind_red + 1]
-        data_aux = self._data[good_keys]
-        col_waves_aux = col_waves[ind_blue : ind_red + 1]
-        lsf_vals = []
-        for row in data_aux:
-            aux_val = []
-            for i in range(0, len(row)):
-                aux_val += [row[i]]
-
-            # we don't want to extrapolate wildly, but allow LSF instantiations for wv0 outside range of 'col_waves'
-            if (wv0 >= col_waves_aux[0]) & (wv0 <= col_waves_aux[-1]):
-                f = interp1d(col_waves_aux,aux_val,bounds_error=True,kind='linear')  # no need to extrapolate
-                lsf_vals += [f(wv0)]
-
-            elif (wv0 < col_waves[0]) & ((col_waves[0] - wv0) < np.abs(col_waves[1] - col_waves[0])):
-                f = interp1d(col_waves_aux, aux_val, bounds_error=False,
-                             fill_value=aux_val[0], kind='linear')  # assign shortest wv LSF definition
-                lsf_vals += [f(wv0)]
-
-                # warning
-                if (col_waves[0] - wv0) > (np.abs(col_waves[1] - col_waves[0])/2.):
-                    warnings.warn(
-                        "LSF may result from extrapolation outside wavelength range characterized for current grating.")
-
-            elif (wv0 > col_waves[-1]) & ((wv0 - col_waves[-1]) < np.abs(col_waves[-1] - col_waves[-2])):
-                f = interp1d(col_waves_aux, aux_val, bounds_error=False,
-                             fill_value=aux_val[-1], kind='linear') #assign longest wv LSF definition
-                lsf_vals += [f(wv0)]
-
-                # warning
-                if (wv0 - col_waves[-1]) > (np.abs(col_waves[-1] - col_waves[-2])/2.):
-                    warnings.warn(
-                        "LSF may result from extrapolation outside wavelength range characterized for current grating.")
-            else:
-                raise ValueError("wv0={:.2f}A too far outside range of defined LSFs. Perhaps you've chosen the wrong grating?".format(wv0))
-        lsf_vals = np.array(lsf_vals)
+        lsf_vals = self.tabulated_kernels(np.array([wv0]))[0]
 
         # normalize
         lsf_vals /= np.sum(lsf_vals)
 
         # create Column to store the interpolated LSF
-        # lsf_vals = Column(name='{:.0f}A'.format(wv0.value),data=lsf_vals)
         lsf_vals = Column(name='kernel', data=lsf_vals)
 
         # create column of relative pixel in absolute wavelength
-        if isinstance(self.pixel_scale,np.unicode):
-            # deal with wavelength-dependent pixel scale (i.e., STIS echelle)
-            scalefac = 1./float(self.pixel_scale.split('/')[-1])
-            wv_array = [(wv0*u.AA * (1. + scalefac * self._data['rel_pix'][i])).value
-                        for i in range(len(self._data))]
-        else:
-            wv_array = [(self.pixel_scale * self._data['rel_pix'][i] + wv0*u.AA).value for i in range(len(self._data))]
+        wv_array = wv0 + self.pixel_scale_at(wv0) * np.asarray(self._data['rel_pix'])
         wv = Column(name='wv',data=wv_array, unit=u.AA)
 
         # create lsf Table
@@ -666,3 +883,183 @@ class LSF(object):
         lsf_tab.add_column(Column(name='kernel', data=lsf_vals))
 
         return lsf_tab
+
+    def pixel_scale_at(self, wv0):
+        """Pixel scale of the LSF tables at wavelength(s) wv0
+
+        Parameters
+        ----------
+        wv0 : float, ndarray or Quantity
+            Wavelength(s); floats are taken in Angstroms
+
+        Returns
+        -------
+        pixel_scale : float or ndarray
+            In Angstroms per pixel
+        """
+        wv0 = np.asarray(wv0.to('AA').value if isinstance(wv0, Quantity) else wv0, dtype=float)
+        if isinstance(self.pixel_scale, Quantity):
+            return self.pixel_scale.to('AA').value * np.ones_like(wv0)
+        # wavelength-dependent pixel scale (i.e., STIS echelle)
+        return wv0 / float(self.pixel_scale.split('/')[-1])
+
+    def default_nodes(self, wave, nnode=5):
+        """Node wavelengths at which convolution_operator() evaluates the LSF
+
+        These are the edges of `wave` plus, for tabulated LSFs, the
+        wavelengths of the tables in between; otherwise `nnode`
+        evenly spaced wavelengths.
+
+        Parameters
+        ----------
+        wave : ndarray
+            Wavelengths (Angstroms)
+        nnode : int, optional
+            Number of nodes for a single LSF kernel (e.g. Gaussian)
+
+        Returns
+        -------
+        nodes : ndarray
+        """
+        wvmin, wvmax = np.min(wave), np.max(wave)
+        if len(self._data.colnames) > 2:
+            inside = (self._col_waves > wvmin) & (self._col_waves < wvmax)
+            return np.concatenate([[wvmin], self._col_waves[inside], [wvmax]])
+        return np.linspace(wvmin, wvmax, max(nnode, 2))
+
+    def convolution_operator(self, wave, nodes=None, boundary='extend', trim=1e-6,
+                             kind='Akima', cache=True):
+        """Sparse matrix convolving values on `wave` with this LSF
+
+        The LSF kernel is evaluated with get_kernels() at each node
+        wavelength, on the local pixel spacing of `wave`.  The kernel
+        of every pixel is the linear blend of those of the two
+        neighbouring nodes, so the LSF may vary across the spectrum
+        and `wave` need not be linear.  The kernels fill a banded
+        matrix, i.e. row i holds the weights of the pixels about i.
+        Operators are cached on this object, keyed on `wave` and
+        the options, so models sharing a grid build it only once.
+
+        Parameters
+        ----------
+        wave : Quantity or ndarray, shape(N,)
+            Increasing wavelengths; ndarrays are taken in Angstroms
+        nodes : int or ndarray, optional
+            Node wavelengths, or their number (evenly spaced).
+            Default is given by default_nodes()
+        boundary : str, optional
+            'extend' takes the values outside `wave` to be those at
+            its edges;  'fill' takes them to be 0.
+        trim : float, optional
+            Drop the outer pixels of the kernels below trim times their maximum
+        kind : str, optional
+            Interpolation of the LSF onto the pixels (see get_kernels)
+        cache : bool, optional
+
+        Returns
+        -------
+        operator : scipy.sparse.csr_matrix, shape(N, N)
+            The convolved values are operator.dot(values)
+        """
+        from scipy import sparse
+        if isinstance(wave, Quantity):
+            wave = wave.to('AA').value
+        wave = np.asarray(wave, dtype=float)
+        if wave.ndim != 1 or np.any(np.diff(wave) <= 0.):
+            raise ValueError('`wave` must be a 1-dimensional, increasing array')
+        if boundary not in ['extend', 'fill']:
+            raise ValueError('`boundary` must be either `extend` or `fill`')
+        if nodes is None:
+            nodes = self.default_nodes(wave)
+        elif np.isscalar(nodes):
+            nodes = np.linspace(wave[0], wave[-1], max(int(nodes), 2))
+        nodes = np.atleast_1d(np.asarray(nodes.to('AA').value if isinstance(nodes, Quantity)
+                                         else nodes, dtype=float))
+        nodes = np.unique(nodes)
+        if cache:
+            sha = hashlib.sha1(np.ascontiguousarray(wave).tobytes())
+            sha.update(nodes.tobytes())
+            key = (wave.size, boundary, trim, kind, sha.hexdigest())
+            if key in self._operators:
+                self._operators[key] = self._operators.pop(key)  # Most recent
+                return self._operators[key]
+
+        npix = wave.size
+        # Kernels at the nodes, on a common number of pixels
+        dwv = np.interp(nodes, wave, np.gradient(wave))
+        extent = np.max(np.abs(self._data['rel_pix'])) * self.pixel_scale_at(nodes)
+        nhalf = int(np.max(np.ceil(extent / dwv)))
+        offs = np.arange(-nhalf, nhalf + 1)
+        kernels = self.get_kernels(nodes, offs, dwv=dwv, kind=kind)
+        if trim > 0.:
+            kmax = np.max(kernels, axis=0)
+            keep = np.where(kmax > trim * np.max(kmax))[0]
+            ntrim = min(keep[0], 2 * nhalf - keep[-1])
+            kernels = kernels[:, ntrim:kernels.shape[1] - ntrim]
+            offs = offs[ntrim:offs.size - ntrim]
+        # Row i weighs pixel i+m by kernel[-m]
+        kernels = kernels[:, ::-1]
+        if nodes.size == 1:
+            nodes = np.concatenate([nodes, nodes + 1.])
+            kernels = np.concatenate([kernels, kernels])
+
+        # Blend the neighbouring nodes
+        inode = np.clip(np.searchsorted(nodes, wave, side='right') - 1, 0, nodes.size - 2)
+        t = np.clip((wave - nodes[inode]) / (nodes[inode + 1] - nodes[inode]), 0., 1.)
+        weights = (1. - t)[:, np.newaxis] * kernels[inode] + t[:, np.newaxis] * kernels[inode + 1]
+        weights /= np.sum(weights, axis=1)[:, np.newaxis]
+        cols = np.arange(npix)[:, np.newaxis] + offs
+        if boundary == 'fill':
+            weights[(cols < 0) | (cols >= npix)] = 0.
+        cols = np.clip(cols, 0, npix - 1)
+        rows = np.repeat(np.arange(npix), offs.size)
+        operator = sparse.csr_matrix((weights.ravel(), (rows, cols.ravel())), shape=(npix, npix))
+        operator.eliminate_zeros()
+
+        if cache:
+            self._operators[key] = operator
+            while len(self._operators) > lsf_operator_cache_size:
+                self._operators.popitem(last=False)
+        return operator
+
+    def convolve_spectrum(self, spec, flux=None, **kwargs):
+        """Convolve a spectrum, or model fluxes, with this LSF
+
+        The LSF may vary with wavelength;  see convolution_operator()
+        for the method and options.
+
+        Parameters
+        ----------
+        spec : XSpectrum1D, Quantity or ndarray
+            Spectrum, or its wavelengths (ndarrays in Angstroms)
+        flux : ndarray, shape(N,) or (nmodel, N), optional
+            Values to convolve instead of the flux of `spec`, e.g.
+            a set of models on the wavelengths of `spec`
+        **kwargs :
+            Passed to convolution_operator()
+
+        Returns
+        -------
+        convolved : XSpectrum1D or ndarray
+            An XSpectrum1D when `spec` is one and `flux` is not given,
+            with its error array propagated and continuum convolved.
+            Otherwise the convolved `flux`, of the same shape
+        """
+        from linetools.spectra.xspectrum1d import XSpectrum1D
+        is_spec = isinstance(spec, XSpectrum1D)
+        wave = spec.wavelength if is_spec else spec
+        operator = self.convolution_operator(wave, **kwargs)
+        if flux is not None:
+            flux = np.asarray(flux, dtype=float)
+            if flux.shape[-1] != operator.shape[0]:
+                raise ValueError('`flux` and the wavelengths must have the same number of pixels')
+            return operator.dot(flux.T).T
+        if not is_spec:
+            raise ValueError('`flux` must be given with a wavelength array')
+        new_fx = operator.dot(spec.flux.value) * spec.flux.unit
+        new_sig = None
+        if spec.sig_is_set:
+            new_sig = np.sqrt(operator.multiply(operator).dot(spec.sig.value**2))
+        new_co = operator.dot(spec.co.value) if spec.co_is_set else None
+        return XSpectrum1D.from_tuple((spec.wavelength, new_fx, new_sig, new_co),
+                                      meta=spec.meta.copy())
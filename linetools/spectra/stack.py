@@ -0,0 +1,311 @@
+""" Streaming, memory-bounded stacking of spectra on a common wavelength grid
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+
+from astropy import units as u
+
+
+class StreamingStack(object):
+    """ Accumulates a stack of spectra sharing one wavelength array
+
+    Spectra are added one chunk at a time (e.g. the output of
+    rebin_to_rest or slices of a lazy/file-backed XSpectrum1D) and
+    only per-pixel running sums are kept, so memory does not grow
+    with the number of spectra.  Accumulated are:
+
+    * the mean, weighted mean and inverse-variance weighted mean
+    * approximate percentiles (e.g. the median) with the P^2
+      algorithm of Jain & Chlamtac (1985), five markers per percentile
+    * Poisson bootstrap replicates of the three means, for errors
+
+    Pixels are used when unmasked, with finite flux and, if an
+    error array is given, sig > 0 (as in smash_spectra).
+
+    Parameters
+    ----------
+    wave : Quantity or ndarray, shape (npix,)
+      Common wavelength array
+    percentiles : list of float, optional
+      Percentiles (0-100) to estimate, e.g. [50.] for the median
+    nboot : int, optional
+      Number of bootstrap replicates
+    seed : int, optional
+      Seed for the bootstrap weights
+    flux_unit : Unit, optional
+    """
+    methods = ('average', 'weighted', 'ivar')
+
+    def __init__(self, wave, percentiles=None, nboot=0, seed=None,
+                 flux_unit=u.dimensionless_unscaled):
+        wave = u.Quantity(wave)
+        if wave.unit == u.dimensionless_unscaled:
+            wave = wave * u.AA
+        self.wave = wave
+        self.npix = wave.size
+        self.flux_unit = flux_unit
+        self.nspec = 0
+        # Running sums
+        self.count = np.zeros(self.npix, dtype=int)
+        self._sums = {}
+        for key in ['f', 'f2', 'w', 'wf', 'w2var', 'ivar', 'ivarf']:
+            self._sums[key] = np.zeros(self.npix)
+        # Percentiles
+        if percentiles is None:
+            percentiles = []
+        self.percentiles = np.atleast_1d(np.asarray(percentiles, dtype=float))
+        if np.any((self.percentiles < 0.) | (self.percentiles > 100.)):
+            raise ValueError("Percentiles must be within 0-100")
+        nq = self.percentiles.size
+        p = (self.percentiles / 100.)[:, np.newaxis, np.newaxis]
+        self._dn = np.concatenate([0.*p, p/2., p, (1+p)/2., 1.+0.*p], axis=1)
+        self._q = np.zeros((nq, 5, self.npix))
+        self._n = np.zeros((nq, 5, self.npix))
+        self._nd = np.zeros((nq, 5, self.npix))
+        # Bootstrap
+        self.nboot = nboot
+        self._rstate = np.random.RandomState(seed)
+        self._boot = {}
+        for method in self.methods:
+            self._boot[method] = np.zeros((2, nboot, self.npix))
+
+    def __repr__(self):
+        return '<StreamingStack: nspec={:d}, npix={:d}, percentiles={}, nboot={:d}>'.format(
+            self.nspec, self.npix, list(self.percentiles), self.nboot)
+
+    def add(self, flux, sig=None, weights=None):
+        """ Add a set of spectra to the stack
+
+        Parameters
+        ----------
+        flux : XSpectrum1D or ndarray, shape (npix,) or (nspec, npix)
+          An XSpectrum1D must have the wavelengths of the stack;
+          its data array (not normalized) and mask are used
+        sig : ndarray, optional
+          Error array, same shape as flux
+        weights : float or ndarray, optional
+          Weights of the 'weighted' mean.  Either one per spectrum,
+          shape (nspec,), or one per pixel, the shape of flux.
+          Default is 1
+        """
+        from linetools.spectra.xspectrum1d import XSpectrum1D
+        if isinstance(flux, XSpectrum1D):
+            spec = flux
+            if spec.totpix != self.npix or not np.allclose(
+                    np.ma.getdata(spec.data['wave']) * spec.units['wave'].to(self.wave.unit),
+                    self.wave.value):
+                raise IOError("Wavelengths of the input spectra differ from those of the stack")
+            flux = spec.data['flux']
+            sig = np.ma.getdata(spec.data['sig'])
+            if np.all(np.isnan(sig)):
+                sig = None
+        mask = np.atleast_2d(np.ma.getmaskarray(flux))
+        flux = np.atleast_2d(np.ma.getdata(flux)).astype(float)
+        if flux.shape[1] != self.npix:
+            raise IOError("Input flux must have {:d} pixels".format(self.npix))
+        nspec = flux.shape[0]
+        good = ~mask & np.isfinite(flux)
+        if sig is not None:
+            sig = np.atleast_2d(np.ma.getdata(sig)).astype(float)
+            with np.errstate(invalid='ignore'):
+                good &= sig > 0.
+        if weights is None:
+            weights = np.ones_like(flux)
+        else:
+            weights = np.asarray(weights, dtype=float)
+            if weights.ndim == 1 and weights.size == nspec and flux.shape != weights.shape:
+                weights = weights[:, np.newaxis]
+            weights = np.broadcast_to(weights, flux.shape)
+        fx = np.where(good, flux, 0.)
+        w = np.where(good, weights, 0.)
+        # Means
+        self._sums['f'] += np.sum(fx, axis=0)
+        self._sums['f2'] += np.sum(fx**2, axis=0)
+        self._sums['w'] += np.sum(w, axis=0)
+        self._sums['wf'] += np.sum(w*fx, axis=0)
+        if sig is not None:
+            var = np.where(good, sig, 0.)**2
+            ivar = np.where(good, 1. / np.where(good, var, 1.), 0.)
+            self._sums['w2var'] += np.sum(w**2 * var, axis=0)
+            self._sums['ivar'] += np.sum(ivar, axis=0)
+            self._sums['ivarf'] += np.sum(ivar * fx, axis=0)
+        else:
+            ivar = None
+        # Bootstrap;  each spectrum gets a Poisson(1) weight per replicate
+        if self.nboot > 0:
+            bw = self._rstate.poisson(1., size=(nspec, self.nboot)).astype(float)
+            for method, wts in zip(self.methods, [good.astype(float), w, ivar]):
+                if wts is None:
+                    continue
+                self._boot[method][0] += np.dot(bw.T, wts)
+                self._boot[method][1] += np.dot(bw.T, wts * fx)
+        # Percentiles
+        if self.percentiles.size > 0:
+            for ii in range(nspec):
+                self._update_p2(flux[ii], good[ii])
+                self.count += good[ii]
+        else:
+            self.count += np.sum(good, axis=0)
+        self.nspec += nspec
+
+    def _update_p2(self, x, good):
+        """ Update the P^2 markers with one spectrum
+        """
+        count = self.count.copy()  # Before this spectrum
+        # Initialization:  hold the first 5 values
+        init = good & (count < 5)
+        if np.any(init):
+            ipix = np.where(init)[0]
+            self._q[:, count[ipix], ipix] = x[ipix]
+            full = ipix[count[ipix] == 4]
+            if full.size > 0:
+                self._q[:, :, full] = np.sort(self._q[:, :, full], axis=1)
+                self._n[:, :, full] = np.arange(1., 6.)[np.newaxis, :, np.newaxis]
+                self._nd[:, :, full] = 1. + 4.*self._dn
+        active = good & (count >= 5)
+        if not np.any(active):
+            return
+        q = self._q[:, :, active]
+        n = self._n[:, :, active]
+        xa = x[active]
+        q[:, 0] = np.minimum(q[:, 0], xa)
+        q[:, 4] = np.maximum(q[:, 4], xa)
+        # Cell of x and new marker positions
+        k = np.sum(q[:, 1:4] <= xa, axis=1)
+        n += np.arange(5)[np.newaxis, :, np.newaxis] > k[:, np.newaxis, :]
+        self._nd[:, :, active] += self._dn
+        nd = self._nd[:, :, active]
+        # Adjust the middle markers
+        for i in [1, 2, 3]:
+            d = nd[:, i] - n[:, i]
+            up = (d >= 1.) & (n[:, i+1] - n[:, i] > 1.)
+            down = (d <= -1.) & (n[:, i-1] - n[:, i] < -1.)
+            move = up | down
+            if not np.any(move):
+                continue
+            ds = np.where(up, 1., -1.)
+            # Parabolic
+            qp = q[:, i] + ds / (n[:, i+1] - n[:, i-1]) * (
+                (n[:, i] - n[:, i-1] + ds) * (q[:, i+1] - q[:, i]) / (n[:, i+1] - n[:, i]) +
+                (n[:, i+1] - n[:, i] - ds) * (q[:, i] - q[:, i-1]) / (n[:, i] - n[:, i-1]))
+            # Linear
+            qn = np.where(up, q[:, i+1], q[:, i-1])
+            nn = np.where(up, n[:, i+1], n[:, i-1])
+            ql = q[:, i] + ds * (qn - q[:, i]) / (nn - n[:, i])
+            ok = (q[:, i-1] < qp) & (qp < q[:, i+1])
+            q[:, i] = np.where(move, np.where(ok, qp, ql), q[:, i])
+            n[:, i] += np.where(move, ds, 0.)
+        self._q[:, :, active] = q
+        self._n[:, :, active] = n
+
+    def mean(self, method='average'):
+        """ Stacked flux and its error
+
+        Parameters
+        ----------
+        method : str, optional
+          'average' -- Mean;  error is the standard error of the mean
+          'weighted' -- Weighted mean;  error propagated from sig
+          'ivar' -- Inverse-variance weighted mean
+
+        Returns
+        -------
+        flux, sig : ndarrays, shape (npix,)
+          Pixels without data are 0
+        """
+        s = self._sums
+        flux = np.zeros(self.npix)
+        sig = np.zeros(self.npix)
+        if method == 'average':
+            gd = self.count > 0
+            flux[gd] = s['f'][gd] / self.count[gd]
+            gd2 = self.count > 1
+            var = (s['f2'][gd2] - self.count[gd2] * flux[gd2]**2) / (self.count[gd2] - 1)
+            sig[gd2] = np.sqrt(np.maximum(var, 0.) / self.count[gd2])
+        elif method == 'weighted':
+            gd = s['w'] != 0.
+            flux[gd] = s['wf'][gd] / s['w'][gd]
+            sig[gd] = np.sqrt(s['w2var'][gd]) / np.abs(s['w'][gd])
+        elif method == 'ivar':
+            gd = s['ivar'] > 0.
+            flux[gd] = s['ivarf'][gd] / s['ivar'][gd]
+            sig[gd] = 1. / np.sqrt(s['ivar'][gd])
+        else:
+            raise IOError("Not prepared for this method: {:s}".format(method))
+        return flux, sig
+
+    def percentile(self, q):
+        """ Approximate percentile of the stacked spectra
+
+        Exact while a pixel has fewer than 5 values
+
+        Parameters
+        ----------
+        q : float
+          One of the percentiles given at instantiation
+
+        Returns
+        -------
+        flux : ndarray, shape (npix,)
+          Pixels without data are 0
+        """
+        iq = np.where(np.isclose(self.percentiles, q))[0]
+        if iq.size == 0:
+            raise IOError("Percentile {} was not accumulated".format(q))
+        flux = self._q[iq[0], 2].copy()
+        small = np.where((self.count > 0) & (self.count < 5))[0]
+        for cnt in np.unique(self.count[small]):
+            pix = small[self.count[small] == cnt]
+            flux[pix] = np.percentile(self._q[iq[0], :cnt, pix], q, axis=1)
+        flux[self.count == 0] = 0.
+        return flux
+
+    def bootstrap_error(self, method='average'):
+        """ Bootstrap error of one of the means
+
+        Parameters
+        ----------
+        method : str, optional
+          'average', 'weighted' or 'ivar'
+
+        Returns
+        -------
+        sig : ndarray, shape (npix,)
+        """
+        if self.nboot < 2:
+            raise IOError("Need nboot > 1 for bootstrap errors")
+        if method not in self.methods:
+            raise IOError("Not prepared for this method: {:s}".format(method))
+        sumw, sumwf = self._boot[method]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(sumw != 0., sumwf / sumw, np.nan)
+        sig = np.nanstd(means, axis=0, ddof=1)
+        return np.where(np.isfinite(sig), sig, 0.)
+
+    def to_spectrum(self, method='average', bootstrap=False):
+        """ Stacked spectrum
+
+        Parameters
+        ----------
+        method : str, optional
+          'average', 'weighted', 'ivar', 'median' or 'percentileXX'
+          (e.g. 'percentile16') for accumulated percentiles
+        bootstrap : bool, optional
+          Use the bootstrap error for the means
+
+        Returns
+        -------
+        spec : XSpectrum1D
+          Medians and percentiles have no error array
+        """
+        from linetools.spectra.xspectrum1d import XSpectrum1D
+        if method == 'median':
+            flux, sig = self.percentile(50.), None
+        elif method.startswith('percentile'):
+            flux, sig = self.percentile(float(method[10:])), None
+        else:
+            flux, sig = self.mean(method)
+            if bootstrap:
+                sig = self.bootstrap_error(method)
+        return XSpectrum1D.from_tuple((self.wave, flux*self.flux_unit, sig), masking='none')
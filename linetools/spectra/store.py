@@ -0,0 +1,311 @@
+""" Chunked HDF5 store for large sets of spectra, with random access
+by index and by sky position
+"""
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import numpy as np
+import json
+import warnings
+
+from astropy import units as u
+from astropy.table import Table
+
+from linetools import utils as ltu
+
+from .xspectrum1d import XSpectrum1D
+
+
+class SpectrumStore(object):
+    """ Spectra held in an HDF5 file as chunked, compressed datasets
+
+    Each of wave, flux, sig and co is a (nspec, npix) dataset chunked
+    by rows, so reading one spectrum only decompresses its own chunk.
+    A small 'meta' table holds RA, DEC, ZEM and NPIX for every spectrum
+    and 'dec_order' indexes it by declination for sky queries.
+    Spectra of different lengths are padded;  pixels beyond NPIX are
+    masked on reading.
+
+    Parameters
+    ----------
+    filename : str or h5py.File
+    mode : str, optional
+      'r' -- Read only
+      'a' -- Read and append, creating the store if needed
+      'w' -- Create a new store (overwrites)
+    path : str, optional
+      Group holding the store
+    chunk_rows : int, optional
+      Number of spectra per chunk, used when creating the store
+    compression : str, optional
+      HDF5 compression filter, used when creating the store
+    """
+    keys = ('wave', 'flux', 'sig', 'co')
+    dtypes = dict(wave='float64', flux='float32', sig='float32', co='float32')
+    meta_dtype = [(str('RA'), 'float64'), (str('DEC'), 'float64'),
+                  (str('ZEM'), 'float64'), (str('NPIX'), 'int64')]
+
+    def __init__(self, filename, mode='r', path='/', chunk_rows=1, compression='gzip'):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("You must install h5py to use SpectrumStore")
+        if mode not in ['r', 'a', 'w']:
+            raise IOError("Invalid mode.  Use 'r', 'a' or 'w'")
+        if isinstance(filename, h5py.File):
+            self.hdf5 = filename
+            self._close = False
+        else:
+            self.hdf5 = h5py.File(filename, mode)
+            self._close = True
+        self.mode = mode
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        if path not in self.hdf5:
+            if mode == 'r':
+                raise IOError("No spectrum store at {:s}".format(path))
+            self.hdf5.create_group(path)
+        self.group = self.hdf5[path]
+        # Cached sky index
+        self._sky = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Close the HDF5 file (if opened here)
+        """
+        if self._close:
+            self.hdf5.close()
+
+    def __len__(self):
+        return self.nspec
+
+    def __repr__(self):
+        return '<SpectrumStore: file={:s}, nspec={:d}, npix={:d}>'.format(
+            self.hdf5.filename, self.nspec, self.npix)
+
+    @property
+    def nspec(self):
+        """ Number of spectra in the store
+        """
+        if 'meta' not in self.group:
+            return 0
+        return self.group['meta'].shape[0]
+
+    @property
+    def npix(self):
+        """ Number of pixels of the datasets
+        """
+        if 'flux' not in self.group:
+            return 0
+        return self.group['flux'].shape[1]
+
+    @property
+    def units(self):
+        """ dict of the wave and flux units
+        """
+        if 'units' not in self.group.attrs:
+            return None
+        units = json.loads(self.group.attrs['units'])
+        for key, item in units.items():
+            if item == 'dimensionless_unit':
+                units[key] = u.dimensionless_unscaled
+            else:
+                units[key] = getattr(u, item)
+        return units
+
+    @property
+    def meta(self):
+        """ Table of RA, DEC, ZEM and NPIX for all of the spectra
+        """
+        if self.nspec == 0:
+            return Table(np.zeros(0, dtype=self.meta_dtype))
+        return Table(self.group['meta'][:])
+
+    def _create(self, npix, units):
+        """ Create the empty datasets
+        """
+        chunks = (self.chunk_rows, npix)
+        for key in self.keys:
+            self.group.create_dataset(key, shape=(0, npix), maxshape=(None, None),
+                                      dtype=self.dtypes[key], chunks=chunks,
+                                      compression=self.compression)
+        self.group.create_dataset('meta', shape=(0,), maxshape=(None,),
+                                  dtype=self.meta_dtype, chunks=True)
+        self.group.create_dataset('dec_order', shape=(0,), maxshape=(None,),
+                                  dtype='int64', chunks=True)
+        self.group.attrs['units'] = json.dumps(ltu.jsonify(units.copy()))
+
+    def append(self, spec, coord=None, zem=None, fill_val=0.):
+        """ Add all of the spectra of an XSpectrum1D object
+
+        Parameters
+        ----------
+        spec : XSpectrum1D
+        coord : SkyCoord or coordinate input(s), optional
+          Position of each spectrum;  see linetools.utils.radec_to_coord
+        zem : float or ndarray, optional
+          Redshift of each spectrum
+        fill_val : float, optional
+          Fill value for masked pixels
+
+        Returns
+        -------
+        idx : int ndarray
+          Indices of the new spectra in the store
+        """
+        if self.mode == 'r':
+            raise IOError("Store was opened read-only")
+        nnew = spec.nspec
+        # RA, DEC, ZEM
+        ra = np.full(nnew, np.nan)
+        dec = np.full(nnew, np.nan)
+        if coord is not None:
+            coord = ltu.radec_to_coord(coord)
+            ra[:] = coord.icrs.ra.deg
+            dec[:] = coord.icrs.dec.deg
+        if zem is None:
+            zem = np.nan
+        # Units
+        if 'flux' not in self.group:
+            self._create(spec.totpix, spec.units)
+        units = self.units
+        wvscale = spec.units['wave'].to(units['wave'])
+        if spec.units['flux'] != units['flux']:
+            raise IOError("Flux units {} do not match those of the store {}".format(
+                spec.units['flux'], units['flux']))
+        # Resize
+        nold, npix = self.nspec, max(self.npix, spec.totpix)
+        for key in self.keys:
+            self.group[key].resize((nold+nnew, npix))
+            data = spec.data[key].filled(fill_val)
+            if key == 'wave':
+                data = data * wvscale
+            self.group[key][nold:, :spec.totpix] = data
+        meta = np.zeros(nnew, dtype=self.meta_dtype)
+        meta['RA'] = ra
+        meta['DEC'] = dec
+        meta['ZEM'] = zem
+        meta['NPIX'] = spec.totpix
+        self.group['meta'].resize((nold+nnew,))
+        self.group['meta'][nold:] = meta
+        # Sky index;  NaN declinations go last
+        decs = self.group['meta']['DEC']
+        self.group['dec_order'].resize((nold+nnew,))
+        self.group['dec_order'][:] = np.argsort(decs, kind='mergesort')
+        self._sky = None
+        return np.arange(nold, nold+nnew)
+
+    def __getitem__(self, item):
+        """ Read a set of spectra
+
+        Parameters
+        ----------
+        item : int, slice or int ndarray
+          Repetition is allowed
+
+        Returns
+        -------
+        XSpectrum1D
+        """
+        return self.get(item)
+
+    def get(self, item, **kwargs):
+        """ Read a set of spectra.  Only their chunks are decompressed
+
+        Parameters
+        ----------
+        item : int, slice or int ndarray
+          Repetition is allowed
+        **kwargs :
+          Passed to XSpectrum1D (e.g. masking)
+
+        Returns
+        -------
+        XSpectrum1D
+        """
+        rows = np.atleast_1d(np.arange(self.nspec)[item])
+        if len(rows) == 0:
+            raise IndexError("No spectra selected")
+        # h5py requires increasing indices
+        uni, inv = np.unique(rows, return_inverse=True)
+        npixs = self.group['meta'][list(uni)]['NPIX'][inv]
+        npix = np.max(npixs)
+        arrays = {}
+        for key in self.keys:
+            arrays[key] = self.group[key][list(uni), :npix][inv]
+        spec = XSpectrum1D(arrays['wave'], arrays['flux'], sig=arrays['sig'], co=arrays['co'],
+                           units=self.units, **kwargs)
+        # Mask the padding
+        pad = np.arange(npix) >= npixs[:, np.newaxis]
+        if np.any(pad):
+            for key in spec.data.dtype.names:
+                spec.data[key].mask = np.ma.getmaskarray(spec.data[key]) | pad
+        spec.filename = self.hdf5.filename
+        return spec
+
+    def _load_sky(self):
+        """ Read the positions, sorted by declination
+        """
+        if self._sky is None:
+            order = self.group['dec_order'][:]
+            meta = self.group['meta']
+            ra, dec = meta['RA'][order], meta['DEC'][order]
+            self._sky = order, ra, dec
+        return self._sky
+
+    def query_radius(self, coord, radius=1*u.arcsec):
+        """ Indices of the spectra within a radius of a position
+
+        Parameters
+        ----------
+        coord : SkyCoord or coordinate input
+          See linetools.utils.radec_to_coord
+        radius : Angle or Quantity, optional
+
+        Returns
+        -------
+        idx : int ndarray
+          Sorted by separation
+        """
+        from astropy.coordinates import SkyCoord
+        coord = ltu.radec_to_coord(coord).icrs
+        if self.nspec == 0:
+            return np.zeros(0, dtype=int)
+        order, ra, dec = self._load_sky()
+        rdeg = u.Quantity(radius).to('deg').value
+        # Declination band first (NaNs are sorted last)
+        i0 = np.searchsorted(dec, coord.dec.deg - rdeg, side='left')
+        i1 = np.searchsorted(dec, coord.dec.deg + rdeg, side='right')
+        if i1 <= i0:
+            return np.zeros(0, dtype=int)
+        band = SkyCoord(ra=ra[i0:i1], dec=dec[i0:i1], unit='deg')
+        sep = coord.separation(band).deg
+        gd = np.where(sep <= rdeg)[0]
+        srt = np.argsort(sep[gd], kind='mergesort')
+        return order[i0:i1][gd[srt]]
+
+    def from_coord(self, coord, radius=1*u.arcsec, **kwargs):
+        """ Read the spectra within a radius of a position
+
+        Parameters
+        ----------
+        coord : SkyCoord or coordinate input
+        radius : Angle or Quantity, optional
+        **kwargs :
+          Passed to get()
+
+        Returns
+        -------
+        spec : XSpectrum1D or None
+          None if there is no spectrum within radius
+        """
+        idx = self.query_radius(coord, radius=radius)
+        if len(idx) == 0:
+            warnings.warn("No spectrum within {} of the input position".format(radius))
+            return None
+        return self.get(idx, **kwargs)
@@ -0,0 +1,110 @@
+# Module to run tests on spectra.convolve
+from __future__ import print_function, absolute_import, \
+    division, unicode_literals
+
+import pytest
+import numpy as np
+from astropy import units as u
+from astropy.convolution import convolve, Box1DKernel
+
+from linetools.spectra import convolve as lsc
+
+
+def test_convolve_fft_rows():
+    rstate = np.random.RandomState(1)
+    for npix, ksize in [(50, 7), (2000, 301), (300, 701)]:
+        array = rstate.normal(size=(3, npix))
+        kernel = rstate.random_sample(ksize)
+        for boundary in [None, 'fill', 'extend', 'wrap']:
+            if (boundary is None) and (ksize > npix):
+                with pytest.raises(ValueError):
+                    lsc.convolve_fft_rows(array, kernel, boundary=None)
+                continue
+            for normalize_kernel in [True, False]:
+                kwargs = dict(boundary=boundary, fill_value=0.3, normalize_kernel=normalize_kernel)
+                direct = np.array([convolve(row, kernel, **kwargs) for row in array])
+                np.testing.assert_allclose(lsc.convolve_fft_rows(array, kernel, **kwargs),
+                                           direct, atol=1e-10)
+        # NaNs
+        array[:, npix//3:npix//3+4] = np.nan
+        for preserve_nan in [True, False]:
+            for nan_treatment in ['interpolate', 'fill']:
+                kwargs = dict(boundary='extend', preserve_nan=preserve_nan,
+                              nan_treatment=nan_treatment)
+                direct = np.array([convolve(row, kernel, **kwargs) for row in array])
+                np.testing.assert_allclose(lsc.convolve_fft_rows(array, kernel, **kwargs),
+                                           direct, atol=1e-10)
+    # 1D, with units
+    conv = lsc.convolve_fft_rows(np.ones(100) * u.AA, np.ones(5))
+    assert conv.unit == u.AA
+    np.testing.assert_allclose(conv.value[2:-2], 1.)
+    with pytest.raises(ValueError):
+        lsc.convolve_fft_rows(np.ones(100), np.ones(4))
+
+
+def test_convolve_method():
+    rstate = np.random.RandomState(2)
+    array = rstate.normal(size=(2, 3000))
+    # Wide kernels go through the FFT
+    fft = lsc.convolve_psf(array, 100.)
+    direct = lsc.convolve_psf(array, 100., method='direct')
+    np.testing.assert_allclose(fft, direct, atol=1e-10)
+    np.testing.assert_allclose(lsc.convolve_psf(array[0], 100., method='fft'), direct[0],
+                               atol=1e-10)
+    # Options of astropy.convolution.convolve alone
+    mask = np.zeros(3000, dtype=bool)
+    lsc.convolve_rows(array[0], np.ones(101), mask=mask)
+    with pytest.raises(ValueError):
+        lsc.convolve_rows(array, np.ones(5), method='bad')
+
+
+def test_box_smooth_rows():
+    rstate = np.random.RandomState(3)
+    array = 1. + rstate.normal(0., 0.1, size=(3, 500))
+    for nbox in [1, 4, 5, 40]:
+        kernel = Box1DKernel(nbox)
+        for boundary in [None, 'fill', 'extend', 'wrap']:
+            direct = np.array([convolve(row, kernel, boundary=boundary) for row in array])
+            np.testing.assert_allclose(lsc.box_smooth_rows(array, nbox, boundary=boundary),
+                                       direct, atol=1e-12)
+        # Variance, with the squared weights
+        weights = (kernel.array / np.sum(kernel.array))**2
+        direct = np.array([convolve(row, weights, normalize_kernel=False) for row in array**2])
+        np.testing.assert_allclose(lsc.box_smooth_rows(array**2, nbox, var=True), direct,
+                                   atol=1e-12)
+    # NaNs
+    array[:, 100:103] = np.nan
+    direct = np.array([convolve(row, Box1DKernel(5)) for row in array])
+    np.testing.assert_allclose(lsc.box_smooth_rows(array, 5), direct, atol=1e-12)
+    # 1D, with units
+    smooth = lsc.box_smooth_rows(np.ones(50) * u.AA, 3, boundary='extend')
+    assert smooth.unit == u.AA
+    np.testing.assert_allclose(smooth.value, 1.)
+
+
+def test_gauss_smooth_rows():
+    rstate = np.random.RandomState(4)
+    wave = np.arange(3000.)
+    array = 1. - 0.8*np.exp(-(wave - 1500.)**2 / 2. / 15.**2) + \
+        rstate.normal(0., 0.05, size=(2, wave.size))
+    for fwhm in [4., 30., 300.]:
+        nedge = int(2*fwhm)
+        for boundary in ['fill', 'extend', 'wrap']:
+            direct = lsc.convolve_psf(array, fwhm, boundary=boundary, method='direct')
+            recursive = lsc.convolve_psf(array, fwhm, boundary=boundary, method='recursive')
+            np.testing.assert_allclose(recursive[:, nedge:-nedge], direct[:, nedge:-nedge],
+                                       atol=5e-3)
+        # Variance
+        var = (0.05 * array)**2
+        direct = lsc.convolve_psf(var, fwhm, var=True, method='direct')
+        recursive = lsc.gauss_smooth_rows(var, fwhm, var=True)
+        np.testing.assert_allclose(recursive[:, nedge:-nedge], direct[:, nedge:-nedge], rtol=3e-2)
+    # The response has the variance of the Gaussian
+    impulse = np.zeros(401)
+    impulse[200] = 1.
+    response = lsc.gauss_smooth_rows(impulse, 20.)
+    np.testing.assert_allclose(np.sum(response), 1.)
+    sigma = np.sqrt(np.sum(response * (np.arange(401) - 200.)**2))
+    np.testing.assert_allclose(sigma, 20. / 2.354820046, rtol=1e-6)
+    with pytest.raises(ValueError):
+        lsc.gauss_smooth_rows(impulse, 1.)
@@ -119,3 +119,36 @@ def test_lsf_init_errors():
         lsf = LSF(dict(name='Gaussian', not_ps_given=0.225, FWHM=0.4))
     with pytest.raises(KeyError):
         lsf = LSF(dict(name='Gaussian', pixel_scale=0.225, not_fwhm_given=0.4))
+
+
+def test_lsf_cache():
+    from linetools.spectra import lsf as ltlsf
+    cache_dir = os.path.join(os.path.dirname(__file__), 'files', 'tmp_lsf_cache')
+    ltlsf.clear_lsf_cache(disk=True, cache_dir=cache_dir)
+    instr_config = dict(name='COS', grating='G130M', life_position='1')
+    data_path = os.path.join(ltlsf.lt_path, 'data', 'lsf', 'COS', 'fuv_G130M_lp1_empir.txt')
+    lsf = LSF(instr_config)
+    # Parsed, then read from the binary copy
+    read = lambda: lsf.read_COS_table(data_path)
+    table = ltlsf.cached_lsf_table('COS_test', [data_path], read, cache_dir=cache_dir)
+    assert os.path.isfile(os.path.join(cache_dir, 'COS_test.npz'))
+    table2 = ltlsf.cached_lsf_table('COS_test', [data_path], None, cache_dir=cache_dir)
+    assert table2.colnames == table.colnames
+    for name in table.colnames:
+        np.testing.assert_allclose(table2[name], table[name])
+    ltlsf.clear_lsf_cache(disk=True, cache_dir=cache_dir)
+    assert not os.path.isfile(os.path.join(cache_dir, 'COS_test.npz'))
+    os.rmdir(cache_dir)
+    # Interpolation between the bracketing kernels
+    kernels = lsf._kernels
+    lsf_tab = lsf.interpolate_to_wv0(1225. * u.AA)
+    frac = (1225. - lsf._col_waves[1]) / (lsf._col_waves[2] - lsf._col_waves[1])
+    kernel = (1. - frac) * kernels[1] + frac * kernels[2]
+    np.testing.assert_allclose(lsf_tab['kernel'], kernel / np.sum(kernel))
+    # Registry
+    lsf1 = LSF.from_config(instr_config)
+    lsf2 = LSF.from_config(dict(life_position='1', grating='G130M', name='COS'))
+    assert lsf1 is lsf2
+    assert LSF.from_config(dict(instr_config, life_position='2', cen_wave='1291')) is not lsf1
+    ltlsf.clear_lsf_cache()
+    assert LSF.from_config(instr_config) is not lsf1
@@ -166,3 +166,73 @@ def test_shift_to_wv0(plot=False):
     with pytest.raises(ValueError):
         thislsfX = lsf_cos.interpolate_to_wv0(3600. * u.AA)
 
+
+
+def test_convolve_spectrum():
+    from linetools.spectra.xspectrum1d import XSpectrum1D
+    from linetools.spectra import convolve as lsc
+    glsf = LSF(dict(name='Gaussian', pixel_scale=0.05, FWHM=0.15))
+    wave = np.arange(4000., 4100., 0.05)
+    rstate = np.random.RandomState(1)
+    flux = 1. + rstate.normal(0., 0.1, wave.size)
+    # A constant kernel on a linear grid
+    conv = glsf.convolve_spectrum(wave * u.AA, flux=flux)
+    np.testing.assert_allclose(conv[30:-30], lsc.convolve_psf(flux, 3.)[30:-30], atol=5e-4)
+    # Cached operator;  several models at once
+    op = glsf.convolution_operator(wave)
+    assert glsf.convolution_operator(wave * u.AA) is op
+    models = glsf.convolve_spectrum(wave, flux=np.array([flux, 2*flux]))
+    np.testing.assert_allclose(models[1], 2*conv)
+    # Spectrum, with errors
+    spec = XSpectrum1D.from_tuple((wave, flux, np.full(wave.size, 0.1)))
+    cspec = glsf.convolve_spectrum(spec, boundary='fill')
+    np.testing.assert_allclose(cspec.flux.value[30:-30], conv[30:-30])
+    assert cspec.flux.value[0] < 0.7  # filled with 0
+    ksum2 = np.sum(op.data[op.indptr[1000]:op.indptr[1001]]**2)
+    assert np.isclose(cspec.sig.value[1000], 0.1 * np.sqrt(ksum2))
+    # The kernel in pixels follows the pixel size
+    lwave = 4000. + np.cumsum(np.linspace(0.02, 0.06, wave.size))
+    op = glsf.convolution_operator(lwave, nodes=3)
+    width = [np.sum(op[ii].toarray() > 0.02) for ii in [50, wave.size-50]]
+    assert width[0] > width[1]
+    np.testing.assert_allclose(op.dot(np.ones(wave.size)), 1.)
+    # COS:  a varying LSF
+    cos_lsf = LSF(dict(name='COS', grating='G130M', life_position='1'))
+    wave = np.arange(1150., 1450., 0.00997)
+    nodes = cos_lsf.default_nodes(wave)
+    np.testing.assert_allclose(nodes[:3], [1150., 1200., 1250.])
+    op = cos_lsf.convolution_operator(wave)
+    for ii in [3000, 15000]:
+        kernel = cos_lsf.get_lsf((wave[ii] + 0.00997*np.arange(-100, 101)) * u.AA)
+        row = op[ii].toarray()[0, ii-100:ii+101]
+        assert np.abs(row - kernel[::-1]).max() < 0.05 * kernel.max()
+    with pytest.raises(ValueError):
+        cos_lsf.convolution_operator(wave[::-1])
+
+
+def test_get_kernels():
+    cos_lsf = LSF(dict(name='COS', grating='G130M', life_position='1'))
+    wv0 = np.array([1160., 1234.5, 1340.])
+    dwv = 0.8 * cos_lsf.pixel_scale_at(wv0)
+    rel_pix = np.arange(-120, 121)
+    kernels = cos_lsf.get_kernels(wv0 * u.AA, rel_pix, dwv=dwv)
+    assert kernels.shape == (3, rel_pix.size)
+    np.testing.assert_allclose(np.sum(kernels, axis=1), 1.)
+    for ii in range(3):
+        kernel = cos_lsf.get_lsf((wv0[ii] + dwv[ii] * rel_pix) * u.AA)
+        np.testing.assert_allclose(kernels[ii], kernel, atol=1e-10)
+    # Linear interpolation;  default pixels of the LSF tables
+    kernels = cos_lsf.get_kernels(wv0, rel_pix, kind='linear')
+    lsf_tab = cos_lsf.interpolate_to_wv0(1234.5 * u.AA)
+    ntab = len(lsf_tab)
+    np.testing.assert_allclose(kernels[1][120 - ntab//2:120 + ntab//2 + 1], lsf_tab['kernel'])
+    # Single kernel
+    glsf = LSF(dict(name='Gaussian', pixel_scale=0.05, FWHM=0.15))
+    kernels = glsf.get_kernels([4000., 5000.], np.arange(-10, 11))
+    np.testing.assert_allclose(kernels[0], kernels[1])
+    assert np.argmax(kernels[0]) == 10
+    # Errors
+    with pytest.raises(ValueError):
+        cos_lsf.get_kernels(wv0, rel_pix, dwv=10.)  # Undersampled
+    with pytest.raises(ValueError):
+        cos_lsf.get_kernels([1900.], rel_pix)  # Outside the tables
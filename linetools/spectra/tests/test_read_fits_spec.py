@@ -114,3 +114,71 @@ def test_errors():
 
 
 
+
+
+def test_readspecs():
+    files = [data_path('UM184_nF.fits'), data_path('NGC4151sic2a.fits'),
+             data_path('UM184_nF.fits')]
+    singles = [io.readspec(ifile) for ifile in files]
+    # Threads, collated
+    registry = io.format_registry
+    registry.clear()
+    mspec = io.readspecs(files, workers=2)
+    assert mspec.nspec == 3
+    assert len(registry) == 2
+    assert set(registry.to_table()['format']) == set(['two_file', 'binary_table'])
+    for ii, spec in enumerate(singles):
+        mspec.select = ii
+        np.testing.assert_allclose(mspec.flux.value[:spec.npix], spec.flux.value)
+    # Serial generator;  formats now come from the registry
+    specs = list(io.readspecs(files, collate=False))
+    assert len(specs) == 3
+    assert registry.hits >= 3
+    np.testing.assert_allclose(specs[1].flux.value, singles[1].flux.value)
+    assert specs[1].filename == singles[1].filename
+    # Signature
+    hdulist = fits.open(data_path('UM184_nF.fits'))
+    assert io.FormatRegistry.key(hdulist) in registry
+    assert io.detect_format(hdulist) == 'two_file'
+
+
+def test_format_registry():
+    registry = io.FormatRegistry()
+    spec = io.readspec(data_path('NGC4151sic2a.fits'), registry=registry)
+    assert registry.misses == 1
+    tbl = registry.to_table()
+    assert tbl['format'][0] == 'binary_table'
+    assert tbl['flux'][0] == 'FLUX'
+    # Cached columns
+    spec2 = io.readspec(data_path('NGC4151sic2a.fits'), registry=registry)
+    assert registry.hits == 1
+    np.testing.assert_allclose(spec2.flux.value, spec.flux.value)
+    np.testing.assert_allclose(spec2.wavelength.value, spec.wavelength.value)
+    assert spec2.wavelength.unit == spec.wavelength.unit
+    # Persist
+    registry.write(data_path('tmp_registry.json'))
+    registry2 = io.FormatRegistry(data_path('tmp_registry.json'))
+    assert list(registry2.entries.keys()) == list(registry.entries.keys())
+    spec3 = io.readspec(data_path('NGC4151sic2a.fits'), registry=registry2)
+    assert registry2.hits == 1
+    np.testing.assert_allclose(spec3.sig.value, spec.sig.value)
+    os.remove(data_path('tmp_registry.json'))
+
+
+def test_format_registry_units():
+    # Same layout, different wavelength units
+    registry = io.FormatRegistry()
+    wave = np.linspace(400., 500., 50)
+    for ii, unit in enumerate(['nm', 'Angstrom']):
+        cols = [fits.Column(name='WAVE', format='D', unit=unit, array=wave),
+                fits.Column(name='FLUX', format='D', array=np.ones_like(wave))]
+        hdulist = fits.HDUList([fits.PrimaryHDU(),
+                                fits.BinTableHDU.from_columns(cols)])
+        hdulist.writeto(data_path('tmp_units{:d}.fits'.format(ii)), overwrite=True)
+    spec_nm = io.readspec(data_path('tmp_units0.fits'), registry=registry)
+    spec_A = io.readspec(data_path('tmp_units1.fits'), registry=registry)
+    assert registry.misses == 2
+    assert spec_nm.wavelength.unit == u.nm
+    assert spec_A.wavelength.unit == u.AA
+    for ii in range(2):
+        os.remove(data_path('tmp_units{:d}.fits'.format(ii)))
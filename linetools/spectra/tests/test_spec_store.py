@@ -0,0 +1,55 @@
+# Module to run tests on the SpectrumStore
+from __future__ import print_function, absolute_import, \
+     division, unicode_literals
+import pytest
+from astropy import units as u
+import numpy as np
+
+from linetools.spectra.xspectrum1d import XSpectrum1D
+
+h5py = pytest.importorskip('h5py')
+
+
+def test_store(tmp_path):
+    from linetools.spectra.store import SpectrumStore
+    nspec, npix = 5, 50
+    wave = np.outer(np.ones(nspec), np.linspace(4000., 5000., npix))
+    flux = np.outer(np.arange(nspec), np.ones(npix))
+    sig = np.ones_like(flux) * 0.1
+    spec = XSpectrum1D(wave, flux, sig)
+    store_file = str(tmp_path / 'tmp_store.hdf5')
+    ras = np.arange(nspec) * 10.
+    decs = np.arange(nspec) - 2.
+    # Write
+    with SpectrumStore(store_file, mode='w') as store:
+        idx = store.append(spec, coord=(ras, decs), zem=1.)
+        assert list(idx) == list(range(nspec))
+        # Longer spectrum, in nm
+        spec2 = XSpectrum1D.from_tuple((np.linspace(400., 510., npix+10)*u.nm,
+                                        np.ones(npix+10)*7.))
+        store.append(spec2, coord=(33.,44.))
+    # Read
+    store = SpectrumStore(store_file)
+    assert len(store) == nspec+1
+    assert store.npix == npix+10
+    np.testing.assert_allclose(store.meta['ZEM'][:nspec], 1.)
+    # By index
+    sp = store[3]
+    assert sp.nspec == 1
+    assert sp.npix == npix
+    np.testing.assert_allclose(sp.flux.value, 3.)
+    np.testing.assert_allclose(sp.wavelength.value, wave[3])
+    sps = store[np.array([5, 1, 1])]
+    assert sps.nspec == 3
+    np.testing.assert_allclose(sps.wvmax.value, 5100.)
+    sps.select = 2
+    np.testing.assert_allclose(sps.flux.value, 1.)
+    assert sps.npix == npix
+    # By position
+    assert list(store.query_radius((20., 0.), 1*u.deg)) == [2]
+    assert len(store.query_radius((20., 0.), 20*u.deg)) == 3
+    sp = store.from_coord((33., 44.))
+    np.testing.assert_allclose(sp.flux.value, 7.)
+    with pytest.warns(UserWarning):
+        assert store.from_coord((100., 44.)) is None
+    store.close()
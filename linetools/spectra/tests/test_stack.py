@@ -0,0 +1,51 @@
+# Module to run tests on the streaming stack
+from __future__ import print_function, absolute_import, \
+     division, unicode_literals
+import pytest
+from astropy import units as u
+import numpy as np
+
+from linetools.spectra.stack import StreamingStack
+
+
+def test_streaming_stack():
+    rstate = np.random.RandomState(1234)
+    nspec, npix = 2000, 20
+    wave = np.linspace(1000., 1100., npix) * u.AA
+    flux = rstate.randn(nspec, npix) + 1.
+    sig = np.ones_like(flux)
+    sig[:, 0] = 0.  # Rejected
+    stack = StreamingStack(wave, percentiles=[16., 50.], nboot=20, seed=1)
+    for i0 in range(0, nspec, 300):
+        chunk = slice(i0, i0+300)
+        stack.add(flux[chunk], sig=sig[chunk], weights=np.ones(nspec)[chunk])
+    assert stack.nspec == nspec
+    assert stack.count[0] == 0
+    # Means
+    avg, avg_sig = stack.mean('average')
+    np.testing.assert_allclose(avg[1:], np.mean(flux[:, 1:], axis=0))
+    np.testing.assert_allclose(avg_sig[1:], np.std(flux[:, 1:], axis=0, ddof=1)/np.sqrt(nspec))
+    assert avg[0] == 0.
+    ivar, ivar_sig = stack.mean('ivar')
+    np.testing.assert_allclose(ivar[1:], avg[1:])
+    np.testing.assert_allclose(ivar_sig[1:], 1./np.sqrt(nspec))
+    # Percentiles
+    np.testing.assert_allclose(stack.percentile(50.)[1:], np.median(flux[:, 1:], axis=0), atol=0.1)
+    np.testing.assert_allclose(stack.percentile(16.)[1:], np.percentile(flux[:, 1:], 16., axis=0), atol=0.15)
+    with pytest.raises(IOError):
+        stack.percentile(84.)
+    # Bootstrap
+    boot = stack.bootstrap_error('average')
+    np.testing.assert_allclose(boot[1:], avg_sig[1:], rtol=0.6)
+    # Spectrum
+    spec = stack.to_spectrum('median')
+    assert spec.npix == npix
+    spec = stack.to_spectrum('ivar', bootstrap=True)
+    assert spec.sig_is_set
+
+
+def test_few_values():
+    stack = StreamingStack(np.arange(3.), percentiles=[50.])
+    flux = np.array([[1., 2., 3.], [3., 2., 1.], [2., 8., 2.]])
+    stack.add(flux)
+    np.testing.assert_allclose(stack.percentile(50.), np.median(flux, axis=0))
@@ -54,3 +54,23 @@ def test_ivar():
     dspec = dummy_spec(s2n=10.)
     ivar = dspec.ivar
     np.testing.assert_allclose(ivar[0].value, 100)
+
+
+def test_diagnostics_cache():
+    spec = dummy_spec(s2n=10.)
+    assert spec.npix == 2000
+    np.testing.assert_allclose(spec.wvmin.value, 4000.)
+    # Masking resets the cache
+    mask = np.zeros(spec.totpix, dtype=bool)
+    mask[:100] = True
+    spec.add_to_mask(mask)
+    assert spec.npix == 1900
+    assert spec.wvmin.value > 4000.
+    # As does setting the error array
+    sig = spec.sig.value
+    sig[-100:] = 0.
+    spec.sig = sig
+    assert spec.wvmax.value < 5000.
+    # Per select
+    spec.select = 0
+    assert spec.co_is_set is False
@@ -84,6 +84,30 @@ def test_masking():
     spec3 = XSpectrum1D.from_tuple((wave,flux,sig), masking='none')
     assert len(spec3.wavelength) == len(wave)
 
+def test_columnar():
+    wave = 3000. + np.arange(1000)
+    flux = np.ones_like(wave)
+    sig = 0.1*np.ones_like(wave)
+    sig[900:] = 0.
+    sig[800:825] = 0.
+    for masking in ['none', 'edges', 'all']:
+        spec = XSpectrum1D.from_tuple((wave,flux,sig), masking=masking)
+        cspec = XSpectrum1D.from_tuple((wave,flux,sig), masking=masking, storage='columnar')
+        assert cspec.npix == spec.npix
+        np.testing.assert_allclose(cspec.wavelength.value, spec.wavelength.value)
+        np.testing.assert_allclose(cspec.sig.value, spec.sig.value)
+    # Views on contiguous data
+    cspec = XSpectrum1D.from_tuple((wave,flux,sig), masking='edges', storage='columnar')
+    assert np.shares_memory(cspec.flux.value, cspec.data['flux'])
+    # Copies, slices and masks
+    assert cspec.copy().storage == 'columnar'
+    assert cspec[0].npix == 900
+    cspec.add_to_mask(np.arange(1000) < 10)
+    assert cspec.npix == 890
+    cspec.unmask()
+    assert cspec.npix == 1000
+
+
 def test_co_kludges():
     spec = XSpectrum1D.from_file(data_path('SDSSJ220248.31+123656.3.fits'), masking='edges')
     assert spec.co.size == 4599
@@ -122,3 +122,85 @@ def test_readwrite_metadata(spec):
     assert spec2.meta['e'] == d['e']
 
 
+
+
+def test_lazy_brick(tmp_path):
+    from astropy.io import fits
+    nspec, npix = 20, 100
+    flux = np.outer(np.arange(nspec), np.ones(npix)).astype(np.float32)
+    ivar = np.ones_like(flux) * 4.
+    ivar[:, :5] = 0.
+    wave = np.linspace(4000., 5000., npix)
+    hdul = fits.HDUList([fits.PrimaryHDU(flux), fits.ImageHDU(ivar), fits.ImageHDU(wave)])
+    for hdu, name in zip(hdul, ['FLUX', 'IVAR', 'WAVELENGTH']):
+        hdu.name = name
+    brick_file = str(tmp_path / 'tmp_brick.fits')
+    hdul.writeto(brick_file, overwrite=True)
+    # Read
+    spec = io.readspec(brick_file, lazy=True, select=3)
+    assert spec.storage == 'lazy'
+    assert spec.nspec == nspec
+    np.testing.assert_array_equal(spec.data.loaded, [3])
+    np.testing.assert_allclose(spec.flux.value, 3.)
+    np.testing.assert_allclose(spec.sig.value[5:], 0.5)
+    assert spec.wvmin.value > wave[4]
+    # Edits persist
+    spec.flux = np.ones(npix)
+    np.testing.assert_allclose(spec.flux.value, 1.)
+    # Batch slice
+    sub = spec[5:8]
+    assert sub.nspec == 3
+    np.testing.assert_allclose(sub.data['flux'][:, 10], [5., 6., 7.])
+    np.testing.assert_array_equal(spec.data.loaded, [3])
+    # Full read
+    full = io.readspec(brick_file)
+    spec.select = 10
+    np.testing.assert_allclose(spec.flux.value, full[10].flux.value)
+    assert np.ma.max(spec.data['flux']) == nspec-1
+    assert spec.data['flux'][3, 10] == 1.
+
+
+def test_lazy_all(tmp_path):
+    from astropy.io import fits
+    nspec, npix = 6, 80
+    flux = np.outer(np.arange(nspec), np.linspace(1., 2., npix))
+    ivar = np.ones_like(flux) * 4.
+    ivar[2, 60:] = 0.
+    wave = np.linspace(4000., 5000., npix)
+    hdul = fits.HDUList([fits.PrimaryHDU(flux), fits.ImageHDU(ivar), fits.ImageHDU(wave)])
+    for hdu, name in zip(hdul, ['FLUX', 'IVAR', 'WAVELENGTH']):
+        hdu.name = name
+    brick_file = str(tmp_path / 'tmp_brick.fits')
+    hdul.writeto(brick_file, overwrite=True)
+    lazy = io.readspec(brick_file, lazy=True)
+    full = io.readspec(brick_file)
+    for method, args in [('box_smooth', (3,)), ('gauss_smooth', (4.,)),
+                         ('ivar_smooth', (3,))]:
+        new = getattr(lazy, method)(*args, all=True)
+        assert new.storage == 'columnar'
+        new_full = getattr(full, method)(*args, all=True)
+        np.testing.assert_allclose(np.ma.filled(new.data['flux'], 0.),
+                                   np.ma.filled(new_full.data['flux'], 0.))
+
+
+def test_lazy_rebin_to_rest():
+    from astropy.io import fits
+    nspec, npix = 7, 100
+    flux = np.outer(np.arange(1, nspec+1), np.ones(npix))
+    ivar = np.ones_like(flux) * 4.
+    wave = np.linspace(4000., 5000., npix)
+    hdul = fits.HDUList([fits.PrimaryHDU(flux), fits.ImageHDU(ivar), fits.ImageHDU(wave)])
+    for hdu, name in zip(hdul, ['FLUX', 'IVAR', 'WAVELENGTH']):
+        hdu.name = name
+    hdul.writeto(data_path('tmp_brick_rest.fits'), overwrite=True)
+    lazy = io.readspec(data_path('tmp_brick_rest.fits'), lazy=True)
+    zarr = np.linspace(2., 2.1, nspec)
+    chunks = list(ltsu.iter_rebin_to_rest(lazy, zarr, 100*u.km/u.s, chunk_size=2, nproc=2))
+    # Not read in full
+    assert lazy.data._full is None
+    assert len(chunks) == 4
+    full = io.readspec(data_path('tmp_brick_rest.fits'))
+    rest = ltsu.rebin_to_rest(full, zarr, 100*u.km/u.s)
+    np.testing.assert_allclose(np.concatenate([chunk.data['flux'] for chunk in chunks]),
+                               rest.data['flux'])
+    os.remove(data_path('tmp_brick_rest.fits'))
@@ -119,6 +119,10 @@ def test_box_smooth(spec):
     np.testing.assert_allclose(newspec5.flux[3000].value, 0.7609909,rtol=1e-5)
     # Preserve
     newspec5p = spec.box_smooth(5, preserve=True)
+    # Errors of the mean
+    sig = spec.sig.value
+    np.testing.assert_allclose(newspec5.sig[3000].value,
+                               np.sqrt(np.sum(sig[2998:3003]**2)) / 5., rtol=1e-6)
 
 
 def test_gauss_smooth(spec):
@@ -127,6 +131,46 @@ def test_gauss_smooth(spec):
     # Test
     np.testing.assert_allclose(smth_spec.flux[3000].value, 0.749937, rtol=1e-5)
     assert smth_spec.flux.unit == spec.flux.unit
+    # Errors are propagated;  bad pixels stay bad
+    good = spec.sig.value > 0.
+    assert np.median(smth_spec.sig.value[good] / spec.sig.value[good]) < 0.6
+    assert np.all(smth_spec.sig.value[~good] == 0.)
+    # Recursive approximation
+    rec_spec = spec.gauss_smooth(4., method='recursive')
+    np.testing.assert_allclose(rec_spec.flux[3000].value, 0.749937, rtol=1e-2)
+    np.testing.assert_allclose(rec_spec.sig[3000].value, smth_spec.sig[3000].value, rtol=3e-2)
+
+
+def test_smooth_bad_sig():
+    # Pixels with sig = 0 are left out of the errors and stay bad
+    wave = np.linspace(4000., 4100., 200)*u.AA
+    sig = np.full(wave.size, 0.1)
+    sig[100] = 0.
+    bspec = XSpectrum1D.from_tuple((wave, np.ones(wave.size), sig), masking='none')
+    box = bspec.box_smooth(5)
+    assert box.sig[100].value == 0.
+    np.testing.assert_allclose(box.sig[101].value, np.sqrt(4*0.1**2)/4.)
+    np.testing.assert_allclose(box.sig[110].value, 0.1/np.sqrt(5.))
+    for method in ['direct', 'recursive']:
+        smth = bspec.gauss_smooth(4., method=method)
+        assert smth.sig[100].value == 0.
+        far = smth.sig[150].value
+        assert far < smth.sig[101].value < 0.1
+    # The flux is smoothed over the same (good) pixels as its error
+    fx = np.ones(wave.size)
+    fx[100] = 50.
+    fspec = XSpectrum1D.from_tuple((wave, fx, sig), masking='none')
+    box = fspec.box_smooth(5)
+    np.testing.assert_allclose(box.flux.value[95:106], 1.)
+    np.testing.assert_allclose(box.sig[101].value, np.sqrt(4*0.1**2)/4.)
+    for method in ['direct', 'fft', 'recursive']:
+        smth = fspec.gauss_smooth(4., method=method)
+        np.testing.assert_allclose(smth.flux.value[90:111], 1., atol=2e-2)
+        assert smth.sig[100].value == 0.
+    # All at once
+    mspec = ltsu.collate([bspec, bspec])
+    smth_all = mspec.gauss_smooth(4., all=True)
+    np.testing.assert_allclose(smth_all.data['sig'][1], bspec.gauss_smooth(4.).sig.value)
 
 
 def test_ivar_smooth(spec):
@@ -249,6 +293,66 @@ def test_wvmnx():
     assert spec.wvmax.value == 6000.
 
 
+def test_all_spectra(specmr):
+    # Batch methods match looping over select
+    for method, kwargs in [('box_smooth', dict(nbox=5)), ('gauss_smooth', dict(fwhm=4.)),
+                           ('ivar_smooth', dict(window=5))]:
+        smth_all = getattr(specmr, method)(all=True, **kwargs)
+        assert smth_all.nspec == specmr.nspec
+        for ii in range(specmr.nspec):
+            specmr.select = ii
+            smth_all.select = ii
+            smth = getattr(specmr, method)(**kwargs)
+            np.testing.assert_allclose(smth_all.flux.value, smth.flux.value, atol=1e-5)
+            if method != 'ivar_smooth':
+                np.testing.assert_allclose(smth_all.sig.value, smth.sig.value, atol=1e-5)
+    # Rebin
+    new_wv = np.arange(3000., 9000., 5) * u.AA
+    rbin_all = specmr.rebin(new_wv, all=True, do_sig=True)
+    specmr.select = 1
+    rbin = specmr.rebin(new_wv, do_sig=True)
+    rbin_all.select = 1
+    np.testing.assert_allclose(rbin_all.sig.value, rbin.sig.value)
+    # S/N
+    s2n, s2n_sig = specmr.get_local_s2n(5000*u.AA, all=True)
+    assert s2n.size == specmr.nspec
+    # Normalize
+    specmr.normalize(np.ones((specmr.nspec, specmr.totpix)), all=True)
+    assert specmr.normed and specmr.co_is_set
+
+
+def test_all_spectra_boundary(specmr):
+    # The boundary is at the last good pixel of each spectrum
+    assert len(set([np.sum(~row) for row in np.ma.getmaskarray(specmr.data['flux'])])) > 1
+    for boundary in ['extend', 'wrap']:
+        for method, kwargs in [('box_smooth', dict(nbox=5)),
+                               ('gauss_smooth', dict(fwhm=4.))]:
+            smth_all = getattr(specmr, method)(all=True, boundary=boundary, **kwargs)
+            for ii in range(specmr.nspec):
+                specmr.select = ii
+                smth_all.select = ii
+                smth = getattr(specmr, method)(boundary=boundary, **kwargs)
+                np.testing.assert_allclose(smth_all.flux.value, smth.flux.value, atol=1e-5)
+                np.testing.assert_allclose(smth_all.sig.value, smth.sig.value, atol=1e-5)
+
+
+def test_rebin_matrix():
+    wv = np.arange(100.)
+    wvh = wv[np.newaxis, :] + 0.5
+    bwv = np.arange(10., 90., 2.5)
+    matrix, outside = ltsu.rebin_matrix(wvh, bwv)
+    assert matrix.shape == (bwv.size-1, wv.size)
+    assert not np.any(outside)
+    # Conserves counts
+    np.testing.assert_allclose(matrix.dot(np.ones(wv.size)), 2.5)
+    # Cached
+    matrix2, _ = ltsu.rebin_matrix(wvh.copy(), bwv.copy())
+    assert matrix2 is matrix
+    # Two spectra
+    matrix3, _ = ltsu.rebin_matrix(np.tile(wvh, (2, 1)), bwv)
+    assert matrix3.shape == (2*(bwv.size-1), 2*wv.size)
+
+
 def test_rebin_to_rest(specmr):
     zarr = np.array([2.1,2.2])
     # Build spectra array
@@ -256,6 +360,24 @@ def test_rebin_to_rest(specmr):
     # Test
     assert rest_spec.totpix == 3716
     np.testing.assert_allclose(rest_spec.wvmin.value, 986.3506403, rtol=1e-5)
+    # Masked pixels are left out of the limits of the grid
+    specm = specmr.copy()
+    specm.data['flux'].mask[:, :200] = True
+    specm.data['wave'].mask[:, :200] = True
+    rwave = specm.data['wave'] / (1 + zarr[:, np.newaxis])
+    rest_m = ltsu.rebin_to_rest(specm, zarr, 100*u.km/u.s, chunk_size=1)
+    np.testing.assert_allclose(rest_m.data['wave'][0, 0], np.ma.min(rwave[rwave > 0.]), rtol=1e-8)
+    np.testing.assert_allclose(rest_m.data['wave'][0, -1], np.ma.max(rwave), rtol=2e-4)
+    assert rest_m.totpix < rest_spec.totpix
+    # Chunks and processes
+    rest_spec2 = ltsu.rebin_to_rest(specmr, zarr, 100*u.km/u.s, chunk_size=1, nproc=2)
+    np.testing.assert_allclose(rest_spec2.data['flux'], rest_spec.data['flux'])
+    np.testing.assert_allclose(rest_spec2.data['sig'], rest_spec.data['sig'])
+    # Options of rebin
+    rest_spec3 = ltsu.rebin_to_rest(specmr, zarr, 100*u.km/u.s, fill_value=1.)
+    assert np.any(rest_spec3.data['flux'] != rest_spec.data['flux'])
+    with pytest.raises(TypeError):
+        ltsu.rebin_to_rest(specmr, zarr, 100*u.km/u.s, fill_val=1.)
 
 
 def test_smash_spectra(specmr):
@@ -269,4 +391,23 @@ def test_smash_spectra(specmr):
     # Test
     assert stack.totpix == 3716
     np.testing.assert_allclose(stack.flux[1].value, -3.32135105133, rtol=1e-5)
+    # Streamed
+    stack2 = ltsu.smash_spectra(rest_spec, method='average', chunk_size=1)
+    np.testing.assert_allclose(stack2.flux.value, stack.flux.value, rtol=1e-4, atol=1e-6)
+    stack3 = ltsu.smash_spectra(rest_spec, method='ivar')
+    assert stack3.sig_is_set
+    # Only the approximate median is streamed
+    with pytest.raises(IOError):
+        ltsu.smash_spectra(rest_spec, method='median', chunk_size=1)
+    stack4 = ltsu.smash_spectra(rest_spec, method='approx_median', chunk_size=1)
+    assert stack4.totpix == stack.totpix
+    # Chunks of rebin_to_rest into a stack
+    from linetools.spectra.stack import StreamingStack
+    sstack = None
+    for chunk in ltsu.iter_rebin_to_rest(specmr, zarr, 100*u.km/u.s, chunk_size=1):
+        if sstack is None:
+            sstack = StreamingStack(chunk.wavelength, percentiles=[50.])
+        sstack.add(chunk)
+    assert sstack.nspec == 2
+    np.testing.assert_allclose(sstack.mean('average')[0], stack.flux.value, rtol=1e-4, atol=1e-6)
 
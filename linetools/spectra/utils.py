@@ -7,6 +7,8 @@ import numpy as np
 import json
 import warnings
 import pdb
+import hashlib
+from collections import OrderedDict
 
 from astropy import units as u
 from astropy import constants as const
@@ -18,6 +20,10 @@ try: # Python 2 & 3 compatibility
 except NameError:
     basestring = str
 
+# Rebinning matrices of the last grids used;  see rebin_matrix()
+_rebin_matrix_cache = OrderedDict()
+rebin_matrix_cache_size = 16
+
 def meta_to_disk(in_meta):
     """ Polish up the meta dict for I/O
 
@@ -142,14 +148,16 @@ def collate(spectra, **kwargs):
     nspec = 0
     units = None
     # Setup
+    all_rows = []
     for spec in spectra:
         nspec += spec.nspec
-        for ii in range(spec.nspec):
-            spec.select = ii
-            maxpix = max(maxpix, spec.npix)
-        if spec.co_is_set:
+        # Unmasked data of every spectrum, shifted to the start of each row
+        ngood, _, rows = spec._data_rows()
+        all_rows.append((ngood, rows))
+        maxpix = max(maxpix, np.max(ngood))
+        if np.any(rows['co_set']):
             flg_co = True
-        if spec.sig_is_set:
+        if np.any(rows['sig_set']):
             flg_sig = True
         # Check for identical units
         if units is None:
@@ -170,21 +178,20 @@ def collate(spectra, **kwargs):
     # Load
     meta = dict(headers=[])
     idx = 0
-    for xspec in spectra:
+    for xspec, (ngood, rows) in zip(spectra, all_rows):
         # Allow for multiple spectra in the XSpectrum1D object
-        for jj in range(xspec.nspec):
-            xspec.select = jj
-            wave[idx,:xspec.npix] = xspec.wavelength.value
-            flux[idx,:xspec.npix] = xspec.flux.value
-            if flg_sig:
-                try:  # This will fail for spectra with fully masked arrays
-                    sig[idx,:xspec.npix] = xspec.sig.value
-                except AttributeError:
-                    sig[idx,:] = 0.
-            if flg_co:
-                if xspec.co_is_set:  # Allow for a mix of continua (mainly for specdb)
-                    co[idx,:xspec.npix] = xspec.co.value
-            idx += 1
+        nrow = xspec.nspec
+        npix = min(maxpix, xspec.totpix)
+        pad = np.arange(npix) >= ngood[:, np.newaxis]
+        wave[idx:idx+nrow, :npix] = np.where(pad, 0., rows['wave'][:, :npix])
+        flux[idx:idx+nrow, :npix] = np.where(pad, 0., rows['flux'][:, :npix])
+        if flg_sig:  # Spectra without an error array (or fully masked) get 0.
+            sig[idx:idx+nrow, :npix] = np.where(pad | ~rows['sig_set'][:, np.newaxis],
+                                                0., rows['sig'][:, :npix])
+        if flg_co:  # Allow for a mix of continua (mainly for specdb)
+            co[idx:idx+nrow, :npix] = np.where(pad | ~rows['co_set'][:, np.newaxis],
+                                               0., rows['co'][:, :npix])
+        idx += nrow
         # Meta
         meta['headers'] += xspec.meta['headers']
     # Finish
@@ -194,6 +201,298 @@ def collate(spectra, **kwargs):
     return new_spec
 
 
+def compress_rows(mask, *arrays):
+    """ Shift the unmasked pixels of each row to the start of the row
+
+    The 2D analog of np.ma.compressed() for a set of (nspec, npix)
+    arrays sharing one mask.  The order of the pixels within a row
+    is preserved and the masked ones end up at the end of the row.
+
+    Parameters
+    ----------
+    mask : bool ndarray, shape (nspec, npix)
+      True for pixels to drop
+    *arrays : ndarrays, shape (nspec, npix)
+
+    Returns
+    -------
+    ngood : int ndarray, shape (nspec,)
+      Number of unmasked pixels in each row
+    order : int ndarray, shape (nspec, npix)
+      Reordering applied to the rows.  Undo it with
+      np.put_along_axis(out, order, array, axis=1)
+    out : list of ndarray
+      Reordered copies of the input arrays
+    """
+    mask = np.asarray(mask, dtype=bool)
+    ngood = mask.shape[1] - np.sum(mask, axis=1)
+    if np.all(mask[:, 1:] >= mask[:, :-1]):
+        # Masked pixels are already at the end of each row
+        order = np.broadcast_to(np.arange(mask.shape[1]), mask.shape)
+        out = [np.array(array) for array in arrays]
+        return ngood, order, out
+    order = np.argsort(mask, axis=1, kind='stable')
+    out = [np.take_along_axis(np.asarray(array), order, axis=1) for array in arrays]
+    return ngood, order, out
+
+
+def searchsorted_rows(a, v, side='left'):
+    """ np.searchsorted applied to each row of a 2D array
+
+    Parameters
+    ----------
+    a : ndarray, shape (nspec, n)
+      Each row sorted in ascending order
+    v : ndarray, shape (m,) or (nspec, m)
+      Values to insert
+    side : str, optional
+
+    Returns
+    -------
+    indices : int ndarray, shape (nspec, m)
+    """
+    nspec, n = a.shape
+    v = np.broadcast_to(v, (nspec, np.shape(v)[-1]))
+    # Offset the rows so one search of the flattened array covers them all
+    lo = min(np.min(a), np.min(v))
+    span = max(np.max(a), np.max(v)) - lo + 1.
+    offset = span * np.arange(nspec)[:, np.newaxis]
+    idx = np.searchsorted((a - lo + offset).ravel(), (v - lo + offset).ravel(), side=side)
+    return idx.reshape(v.shape) - n * np.arange(nspec)[:, np.newaxis]
+
+
+def rebin_matrix(wvh, bwv, npts=None, extrapolate=False, cache=True):
+    """ Sparse matrix rebinning the pixels of each row onto new pixels
+
+    The rebinned value of a new pixel is the sum of the input values,
+    each weighted by the fraction of its pixel inside the new one.
+    This equals differencing the linear interpolation of the cumulative
+    sum at the new pixel edges, as done originally in rebin(), without
+    the round-off of the large cumulative sums.  The rows are stacked
+    into a single block-diagonal matrix.  Matrices are cached, keyed
+    on the input grids, so rebinning many spectra on a common grid
+    (or the flux, variance and continuum of one) builds it only once.
+
+    Parameters
+    ----------
+    wvh : ndarray, shape (nspec, npix)
+      Upper edge of each input pixel;  the first pixel starts at wvh[:,0]
+      (as in the cumulative sum, its value is attributed to that edge)
+    bwv : ndarray, shape (nnew+1,) or (nspec, nnew+1)
+      Edges of the new pixels
+    npts : int ndarray, shape (nspec,), optional
+      Number of valid input pixels of each row;  the rest is padding
+      which must keep wvh sorted
+    extrapolate : bool, optional
+      Extrapolate beyond the input edges.  Otherwise new edges outside
+      them get no weight (see the returned `outside`)
+    cache : bool, optional
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix, shape (nspec*nnew, nspec*npix)
+      Applied to values.ravel() of shape (nspec, npix)
+    outside : bool ndarray, shape (nspec, nnew+1)
+      New edges beyond the input ones (where the fill value applies)
+    """
+    from scipy import sparse
+    nspec, npix = wvh.shape
+    bwv = np.broadcast_to(bwv, (nspec, np.shape(bwv)[-1]))
+    if npts is None:
+        npts = np.full(nspec, npix)
+    if cache:
+        sha = hashlib.sha1()
+        for arr in [wvh, bwv, npts]:
+            sha.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+        key = (wvh.shape, bwv.shape, extrapolate, sha.hexdigest())
+        if key in _rebin_matrix_cache:
+            _rebin_matrix_cache[key] = _rebin_matrix_cache.pop(key)  # Most recent
+            return _rebin_matrix_cache[key]
+    nnew = bwv.shape[1] - 1
+    last = (npts - 1)[:, np.newaxis]
+    # Bracketing input edges of each new edge;  the weight vector of the
+    #  cumulative sum at an edge is 1 for pixels <= lo plus t at hi
+    hi = np.clip(searchsorted_rows(wvh, bwv), 1, last)
+    lo = hi - 1
+    x_lo = np.take_along_axis(wvh, lo, axis=1)
+    x_hi = np.take_along_axis(wvh, hi, axis=1)
+    t = (bwv - x_lo) / (x_hi - x_lo)
+    if extrapolate:
+        outside = np.zeros(bwv.shape, dtype=bool)
+    else:
+        outside = (bwv < wvh[:, :1]) | (bwv > np.take_along_axis(wvh, last, axis=1))
+    cnt = np.where(outside, 0, lo + 1)
+    t[outside] = 0.
+    # New pixel i:  +1 on [cnt_a, cnt_b) (or -1 on [cnt_b, cnt_a)),
+    #  + t_b at hi_b and - t_a at hi_a
+    cnt_a, cnt_b = cnt[:, :-1].ravel(), cnt[:, 1:].ravel()
+    rowoff = np.repeat(npix * np.arange(nspec), nnew)
+    irow = np.arange(nspec * nnew)
+    start = np.minimum(cnt_a, cnt_b)
+    nrun = np.abs(cnt_b - cnt_a)
+    ntot = np.sum(nrun)
+    run_rows = np.repeat(irow, nrun)
+    run_cols = np.arange(ntot) - np.repeat(np.cumsum(nrun) - nrun, nrun) + \
+        np.repeat(start + rowoff, nrun)
+    run_vals = np.repeat(np.sign(cnt_b - cnt_a).astype(float), nrun)
+    rows = np.concatenate([run_rows, irow, irow])
+    cols = np.concatenate([run_cols, hi[:, 1:].ravel() + rowoff, hi[:, :-1].ravel() + rowoff])
+    vals = np.concatenate([run_vals, t[:, 1:].ravel(), -t[:, :-1].ravel()])
+    matrix = sparse.csr_matrix((vals, (rows, cols)), shape=(nspec*nnew, nspec*npix))
+    matrix.eliminate_zeros()
+    if cache:
+        _rebin_matrix_cache[key] = (matrix, outside)
+        while len(_rebin_matrix_cache) > rebin_matrix_cache_size:
+            _rebin_matrix_cache.popitem(last=False)
+    return matrix, outside
+
+
+def rebin_rows(wave, flux, new_wv, sig=None, co=None, mask=None, do_sig=False,
+               fill_value=0., grow_bad_sig=False, cache=True):
+    """ Rebin each row of a set of (nspec, npix) arrays
+
+    Vectorized engine behind rebin();  see that function for the
+    approach.  Masked pixels are dropped, as when rebinning the
+    compressed arrays of a single spectrum.
+
+    Parameters
+    ----------
+    wave : ndarray, shape (nspec, npix)
+    flux : ndarray, shape (nspec, npix)
+    new_wv : ndarray, shape (nnew,) or (nspec, nnew)
+      New wavelengths, in the units of wave
+    sig : ndarray, shape (nspec, npix), optional
+    co : ndarray, shape (nspec, npix), optional
+      Continuum to rebin
+    mask : bool ndarray, shape (nspec, npix), optional
+    do_sig : bool, optional
+      Rebin the error array too
+    fill_value : float, optional
+    grow_bad_sig : bool, optional
+    cache : bool, optional
+      Cache the rebinning matrix;  see rebin_matrix()
+
+    Returns
+    -------
+    new_fx, new_sig, new_co : ndarrays, shape (nspec, nnew)
+      new_sig and new_co are None unless requested
+    """
+    wave = np.atleast_2d(wave)
+    if mask is None:
+        mask = np.zeros(wave.shape, dtype=bool)
+    inputs = [wave, np.atleast_2d(flux)]
+    inputs += [np.zeros(wave.shape) if arr is None else np.atleast_2d(arr) for arr in [sig, co]]
+    ngood, _, (wv, flux, sig2, co2) = compress_rows(mask, *inputs)
+    wv = wv.astype(np.float64)
+    nspec, npix = wv.shape
+    if np.any(ngood < 2):
+        raise ValueError("Each spectrum needs at least 2 unmasked pixels to rebin.")
+    rows = np.arange(nspec)
+    last = ngood - 1
+    pad = np.arange(npix) >= ngood[:, np.newaxis]
+
+    # Endpoints of original pixels
+    wvh = (wv + np.roll(wv, -1, axis=1)) / 2.
+    wvh[rows, last] = wv[rows, last] + (wv[rows, last] - wv[rows, last-1]) / 2.
+    wvh = np.where(pad, wvh[rows, last][:, np.newaxis], wvh)  # Keep sorted
+    dwv = wvh - np.roll(wvh, 1, axis=1)
+    dwv[:, 0] = 2 * (wvh[:, 0] - wv[:, 0])
+    med_dwv = np.nanmedian(np.where(pad, np.nan, dwv), axis=1)
+
+    # Deal with nan
+    badf = ~np.isfinite(flux) & ~pad
+    if np.any(badf):
+        warnings.warn("Ignoring pixels with NAN or INF in flux")
+    ngood, _, (wv, wvh, dwv, flux, sig2, co2) = compress_rows(
+        badf | pad, wv, wvh, dwv, flux, sig2, co2)
+    last = ngood - 1
+    pad = np.arange(npix) >= ngood[:, np.newaxis]
+    wvh = np.where(pad, wvh[rows, last][:, np.newaxis], wvh)
+    dwv[pad] = 0.
+    flux = np.where(pad, 0., flux)
+
+    # Check for bad pixels (not prepared for these)
+    if sig is not None:
+        bad_sig = (sig2 <= 0.) & ~pad
+        if np.any(bad_sig):
+            if not grow_bad_sig:
+                raise IOError("Data contains rejected pixels (sig=0). Use grow_bad_sig to proceed and grow them.")
+        with np.errstate(over='ignore', invalid='ignore'):
+            bads = np.isnan(sig2) | np.isinf(sig2**2)  # Latter is for way too large values
+        bad_sig |= bads & ~pad
+
+    # Error
+    if do_sig:
+        if sig is None:
+            raise IOError("sig must be set to rebin sig")
+        var = np.where(bad_sig | pad, 0., sig2**2)
+    else:
+        var = np.ones_like(flux)
+
+    # Endpoints of new pixels, padded with the starting point
+    new_wv = np.atleast_2d(new_wv)
+    nwvh = (new_wv + np.roll(new_wv, -1, axis=1)) / 2.
+    nwvh[:, -1] = new_wv[:, -1] + (new_wv[:, -1] - new_wv[:, -2]) / 2.
+    bwv = np.concatenate([new_wv[:, :1] - (new_wv[:, 1:2] - new_wv[:, :1]) / 2., nwvh], axis=1)
+    new_dwv = np.diff(bwv, axis=1)
+    shape = (nspec, new_dwv.shape[1])
+
+    # Rebinning matrix:  fraction of each pixel within the new ones
+    extrapolate = isinstance(fill_value, basestring) and fill_value == 'extrapolate'
+    matrix, outside = rebin_matrix(wvh, bwv, npts=ngood, extrapolate=extrapolate,
+                                   cache=cache)
+
+    # Rebinned flux (preserve counts and flambda)
+    new_fx = matrix.dot((flux * dwv).ravel()).reshape(shape)
+    if not extrapolate:
+        fill = np.where(outside, fill_value, 0.)
+        new_fx += np.diff(fill, axis=1)
+    new_fx /= new_dwv
+
+    if do_sig:
+        newvar = matrix.dot((var * dwv).ravel().astype(np.float64)).reshape(shape)
+        # Preserve S/N (crudely);  the median has always included
+        #  bwv[0]-bwv[-1] (from np.roll), kept for consistency
+        med_newdwv = np.median(np.concatenate([bwv[:, :1] - bwv[:, -1:], new_dwv], axis=1), axis=1)
+        new_var = newvar / (med_newdwv/med_dwv)[:, np.newaxis] / new_dwv
+        # Create new_sig
+        new_sig = np.zeros_like(new_var)
+        gd = new_var > 0.
+        new_sig[gd] = np.sqrt(new_var[gd])
+        # Deal with bad pixels (grow_bad_sig should be True):  any new pixel
+        #  overlapping a rejected one is rejected
+        bad = (var <= 0.) & ~pad
+        if np.any(bad):
+            new_wv = np.broadcast_to(new_wv, new_dwv.shape)
+            big = max(np.max(bwv), np.max(wv + dwv)) + 1.
+            nbad = np.concatenate([np.zeros((nspec, 1), dtype=int),
+                                   np.cumsum(bad, axis=1)], axis=1)
+            i0 = searchsorted_rows(np.where(pad, big, wv + dwv/2.),
+                                   new_wv - new_dwv/2., side='right')
+            i1 = searchsorted_rows(np.where(pad, big, wv - dwv/2.),
+                                   new_wv + new_dwv/2., side='left')
+            i1 = np.maximum(i0, i1)
+            grow = (np.take_along_axis(nbad, i1, axis=1) -
+                    np.take_along_axis(nbad, i0, axis=1)) > 0
+            new_sig[grow] = 0.
+        # Zero out edge pixels -- not to be trusted
+        if np.any(~np.any(gd, axis=1)):  # Should not get here!
+            raise ValueError("Not a single good pixel?!  Something went wrong...")
+        new_sig[rows, np.argmax(gd, axis=1)] = 0.
+        new_sig[rows, gd.shape[1] - 1 - np.argmax(gd[:, ::-1], axis=1)] = 0.
+    else:
+        new_sig = None
+
+    # Continuum?
+    if co is not None:
+        newco = matrix.dot((np.where(pad, 0., co2) * dwv).ravel()).reshape(shape)
+        new_co = newco / new_dwv
+    else:
+        new_co = None
+
+    return new_fx, new_sig, new_co
+
+
 def rebin(spec, new_wv, do_sig=False, do_co=False, all=False,
           fill_value=0., grow_bad_sig=False, **kwargs):
     """ Rebin a single spectrum in an XSpectrum1D object to a new wavelength array
@@ -221,7 +520,8 @@ def rebin(spec, new_wv, do_sig=False, do_co=False, all=False,
     do_co : bool, optional
       Rebin continuum if present
     all : bool, optional
-      Rebin all spectra in the XSpectrum1D object?
+      Rebin all spectra in the XSpectrum1D object at once?
+      The result then holds nspec spectra on the new wavelength array
     grow_bad_sig : bool, optional
       Allow sig<=0. values and grow them
 
@@ -231,134 +531,54 @@ def rebin(spec, new_wv, do_sig=False, do_co=False, all=False,
       XSpectrum1D of the rebinned spectrum
     """
     from linetools.spectra.xspectrum1d import XSpectrum1D
-    from scipy.interpolate import interp1d
     # Save flux info to avoid unit issues
     funit = spec.flux.unit
-    flux = spec.flux.value
-
-    # Deal with nan
-    badf = np.any([np.isnan(flux), np.isinf(flux)], axis=0)
-    if np.sum(badf) > 0:
-        warnings.warn("Ignoring pixels with NAN or INF in flux")
-    gdf = ~badf
-    flux = flux[gdf]
-
-    # Check for bad pixels (not prepared for these)
-    if spec.sig_is_set:
-        sig = spec.sig.value
-        bad_sig = sig[gdf] <= 0.
-        if np.sum(bad_sig) > 0:
-            if not grow_bad_sig:
-                raise IOError("Data contains rejected pixels (sig=0). Use grow_bad_sig to proceed and grow them.")
-        bads = np.any([np.isnan(sig[gdf]), np.isinf(sig[gdf]**2)], axis=0)  # Latter is for way too large values
-        bad_sig[bads] = True
-
-    # Endpoints of original pixels
-    npix = len(spec.wavelength)
-    wvh = (spec.wavelength + np.roll(spec.wavelength, -1)) / 2.
-    wvh[npix - 1] = spec.wavelength[npix - 1] + \
-                    (spec.wavelength[npix - 1] - spec.wavelength[npix - 2]) / 2.
-    dwv = wvh - np.roll(wvh, 1)
-    dwv[0] = 2 * (wvh[0] - spec.wavelength[0])
-    med_dwv = np.median(dwv.value)
-
-    wvh = wvh[gdf]
-    dwv = dwv[gdf]
-
-    # Error
-    if do_sig:
-        if not spec.sig_is_set:
-            raise IOError("sig must be set to rebin sig")
-        var = sig[gdf]**2
-        var[bad_sig] = 0.
+    wv_unit = spec.units['wave']
+    new_wv = u.Quantity(new_wv)
+    if do_co and not spec.co_is_set:
+        raise IOError("Continuum must be set to request rebinning")
+
+    if all:
+        # Every spectrum at once, from the full data arrays
+        ngood, _, rows = spec._data_rows()
+        mask = np.arange(spec.totpix) >= ngood[:, np.newaxis]
+        sig = rows['sig'] if spec.sig_is_set else None
+        co = rows['co'] if do_co else None
+        wave, flux = rows['wave'], rows['flux']
     else:
-        var = np.ones_like(flux)
+        sig = spec.sig.value if spec.sig_is_set else None
+        co = spec.co.value if do_co else None
+        wave, flux = spec.wavelength.value, spec.flux.value
+        mask = None
 
-    # Cumulative Sum
-    cumsum = np.cumsum(flux * dwv)
-    cumvar = np.cumsum(var * dwv.value, dtype=np.float64)
-
-    # Interpolate (loses the units)
-    fcum = interp1d(wvh, cumsum, fill_value=fill_value, bounds_error=False)
-    fvar = interp1d(wvh, cumvar, fill_value=0., bounds_error=False)
-
-    # Endpoints of new pixels
-    nnew = len(new_wv)
-    nwvh = (new_wv + np.roll(new_wv, -1)) / 2.
-    nwvh[nnew - 1] = new_wv[nnew - 1] + \
-                     (new_wv[nnew - 1] - new_wv[nnew - 2]) / 2.
-    # Pad starting point
-    bwv = np.zeros(nnew + 1) * new_wv.unit
-    bwv[0] = new_wv[0] - (new_wv[1] - new_wv[0]) / 2.
-    bwv[1:] = nwvh
-
-    # Evaluate and put unit back
-    newcum = fcum(bwv) * dwv.unit
-    newvar = fvar(bwv) * dwv.unit
-
-    # Endpoint
-    #if (bwv[-1] > wvh[-1]):
-    #    newcum[-1] = cumsum[-1]
-    #    newvar[-1] = cumvar[-1]
-
-    # Rebinned flux, var, co
-    new_fx = (np.roll(newcum, -1) - newcum)[:-1]
-    new_var = (np.roll(newvar, -1) - newvar)[:-1]
-
-    # Normalize (preserve counts and flambda)
-    new_dwv = bwv - np.roll(bwv, 1)
-    new_fx = new_fx / new_dwv[1:]
-    # Preserve S/N (crudely)
-    med_newdwv = np.median(new_dwv.value)
-    new_var = new_var / (med_newdwv/med_dwv) / new_dwv[1:]
-
-    # Return new spectrum
-    if do_sig:
-        # Create new_sig
-        new_sig = np.zeros_like(new_var.value)
-        gd = new_var > 0.
-        new_sig[gd] = np.sqrt(new_var[gd].value)
-        # Deal with bad pixels (grow_bad_sig should be True)
-        bad = np.where(var <= 0.)[0]
-        for ibad in bad:
-            bad_new = np.where(np.abs(new_wv-spec.wavelength[ibad]) <
-                               (new_dwv[1:]+dwv[ibad])/2)[0]
-            new_sig[bad_new] = 0.
-        # Zero out edge pixels -- not to be trusted
-        igd = np.where(gd)[0]
-        if len(igd) == 0:  # Should not get here!
-            raise ValueError("Not a single good pixel?!  Something went wrong...")
-        new_sig[igd[0]] = 0.
-        new_sig[igd[-1]] = 0.
-    else:
-        new_sig = None
-
-    # Continuum?
-    if do_co:
-        if not spec.co_is_set:
-            raise IOError("Continuum must be set to request rebinning")
-        co = spec.co.value
-        co = co[gdf]
-        cumco = np.cumsum(co * dwv)
-        fco = interp1d(wvh, cumco, fill_value=0., bounds_error=False)
-        newco = fco(bwv) * dwv.unit
-        new_co = (np.roll(newco, -1) - newco)[:-1]
-        new_co = new_co / new_dwv[1:]
-    else:
-        new_co = None
+    new_fx, new_sig, new_co = rebin_rows(
+        wave, flux, new_wv.to(wv_unit).value, sig=sig, co=co, mask=mask,
+        do_sig=do_sig, fill_value=fill_value, grow_bad_sig=grow_bad_sig)
 
     # Finish
-    newspec = XSpectrum1D.from_tuple((new_wv, new_fx*funit,
-                                      new_sig, new_co),
-                                     meta=spec.meta.copy(), **kwargs)
+    if all:
+        new_wave = np.outer(np.ones(spec.nspec), new_wv.value)
+        newspec = XSpectrum1D(new_wave, new_fx, sig=new_sig, co=new_co,
+                              units=dict(wave=new_wv.unit, flux=funit),
+                              meta=spec.meta.copy(), **kwargs)
+    else:
+        newspec = XSpectrum1D.from_tuple(
+            (new_wv, new_fx[0]*funit,
+             None if new_sig is None else new_sig[0],
+             None if new_co is None else new_co[0]),
+            meta=spec.meta.copy(), **kwargs)
     # Return
     return newspec
 
 
-def rebin_to_rest(spec, zarr, dv, debug=False, **kwargs):
+def rebin_to_rest(spec, zarr, dv, debug=False, nproc=1, chunk_size=1000, fill_value=0.,
+                  grow_bad_sig=False):
     """ Shuffle an XSpectrum1D dataset to an array of
     observed wavelengths and rebin to dv pixels.
 
+    All of the spectra are rebinned together, in chunks of rows
+    to bound the memory;  see iter_rebin_to_rest().
+
     Note: This works on the unmasked data array and returns
     unmasked spectra
 
@@ -369,8 +589,13 @@ def rebin_to_rest(spec, zarr, dv, debug=False, **kwargs):
       Array of redshifts
     dv : Quantity
       Velocity width of the new pixels
-    **kwargs :
-      Passed to spec.rebin()
+    nproc : int, optional
+      Number of processes rebinning the chunks in parallel
+    chunk_size : int, optional
+      Number of spectra rebinned at once
+    fill_value : float, optional
+    grow_bad_sig : bool, optional
+      Passed to rebin_rows();  see rebin()
 
     Returns
     -------
@@ -379,50 +604,143 @@ def rebin_to_rest(spec, zarr, dv, debug=False, **kwargs):
 
     """
     from linetools.spectra.xspectrum1d import XSpectrum1D
+    chunks = list(iter_rebin_to_rest(spec, zarr, dv, debug=debug, nproc=nproc,
+                                     chunk_size=chunk_size, fill_value=fill_value,
+                                     grow_bad_sig=grow_bad_sig))
+    # Final image (worry about flambda)
+    f_flux = np.concatenate([np.ma.getdata(chunk.data['flux']) for chunk in chunks])
+    f_sig = np.concatenate([np.ma.getdata(chunk.data['sig']) for chunk in chunks])
+    f_wv = np.outer(np.ones(spec.nspec), chunks[0].data['wave'][0])
+    # Finish
+    new_spec = XSpectrum1D(f_wv, f_flux, sig=f_sig, masking='none',
+                           units=spec.units.copy())
+    new_spec.meta = spec.meta.copy()
+    # Return
+    return new_spec
+
+
+def iter_rebin_to_rest(spec, zarr, dv, debug=False, nproc=1, chunk_size=1000, fill_value=0.,
+                       grow_bad_sig=False):
+    """ Generator of the spectra of rebin_to_rest(), chunk_size at a time
+
+    Only a chunk is held in memory per process, with at most nproc
+    chunks in flight.  A lazy XSpectrum1D is read a chunk at a time,
+    twice:  first for the limits of the rest-frame wavelengths, then
+    to rebin.  The output may be fed to a StreamingStack (see
+    spectra.stack).
+
+    Parameters
+    ----------
+    spec : XSpectrum1D
+    zarr : nd.array
+      Array of redshifts
+    dv : Quantity
+      Velocity width of the new pixels
+    nproc : int, optional
+      Number of processes rebinning the chunks in parallel
+    chunk_size : int, optional
+      Number of spectra rebinned at once
+    fill_value : float, optional
+    grow_bad_sig : bool, optional
+      Passed to rebin_rows();  see rebin()
+
+    Returns
+    -------
+    Generator of XSpectrum1D, each with up to chunk_size spectra on
+    the common rest-frame wavelength array.  Not masked
+    """
+    from linetools.spectra.xspectrum1d import XSpectrum1D
 
     # Error checking
     if spec.nspec <= 1:
         raise IOError("Use spec.rebin instead")
     if spec.nspec != len(zarr):
         raise IOError("Input redshift array must have same dimension as nspec")
+    zarr = np.asarray(zarr)
 
     # Generate final wave array
     dlnlamb = np.log(1+dv/const.c)
-    z2d = np.outer(zarr, np.ones(spec.totpix))
-    wvmax = np.max(spec.data['wave']/(1+z2d))*spec.units['wave']
-
-    # Make sure to get nonzero minimum wavelength
-    wvnz = spec.data['wave'] > 0.
-    wvmin = np.min(spec.data['wave'][wvnz] /
-                   (1 + z2d[wvnz])) * spec.units['wave']
+    wvmin, wvmax = np.inf, -np.inf
+    for i0 in range(0, spec.nspec, chunk_size):
+        wave = spec.data[i0:i0+chunk_size]['wave']
+        # Masked pixels are left out
+        mask = np.ma.getmaskarray(wave)
+        wave = np.ma.getdata(wave)
+        zp1 = 1 + zarr[i0:i0+chunk_size]
+        wvmax = max(wvmax, np.max(np.max(np.where(mask, -np.inf, wave), axis=1) / zp1))
+        # Make sure to get nonzero minimum wavelength
+        wvmin = min(wvmin, np.min(np.min(np.where(mask | (wave <= 0.), np.inf, wave),
+                                         axis=1) / zp1))
+    wvmax = wvmax * spec.units['wave']
+    wvmin = wvmin * spec.units['wave']
 
     npix = int(np.round(np.log(wvmax/wvmin) / dlnlamb)) + 1
     new_wv = wvmin * np.exp(dlnlamb*np.arange(npix))
 
-    # Final image
-    f_flux = np.zeros((spec.nspec, npix))
-    f_sig = np.zeros((spec.nspec, npix))
-    f_wv = np.outer(np.ones(spec.nspec), new_wv.value)
-    # Let's loop
-    for ispec in range(spec.nspec):
-        if debug:
-            print("ispec={:d}".format(ispec))
-        # Select
-        spec.select = ispec
-        # Rebin in obs frame
-        tspec = spec.rebin(new_wv*(1+zarr[ispec]), do_sig=True, masking='none', **kwargs)
-        # Save in rest-frame (worry about flambda)
-        f_flux[ispec, :] = tspec.flux.value
-        f_sig[ispec, :] = tspec.sig.value
-    # Finish
-    new_spec = XSpectrum1D(f_wv, f_flux, sig=f_sig, masking='none',
-                           units=spec.units.copy())
-    new_spec.meta = spec.meta.copy()
-    # Return
-    return new_spec
+    def chunks():
+        for i0 in range(0, spec.nspec, chunk_size):
+            sub = spec[i0:i0+chunk_size]
+            sub.normed = spec.normed
+            # Unmasked data of the spectra
+            ngood, _, rows = sub._data_rows()
+            if not np.all(rows['sig_set']):
+                raise IOError("sig must be set to rebin sig")
+            mask = np.arange(sub.totpix) >= ngood[:, np.newaxis]
+            # Observed frame wavelengths of the new pixels
+            obs_wv = np.outer(1+zarr[i0:i0+chunk_size], new_wv.value)
+            yield (rows['wave'], rows['flux'], rows['sig'], mask, obs_wv,
+                   fill_value, grow_bad_sig)
+
+    if nproc > 1:
+        from collections import deque
+        from multiprocessing import Pool
+        pool = Pool(nproc)
+
+        def parallel():
+            # Submit no more than nproc chunks ahead of the one returned
+            pending = deque()
+            for chunk in chunks():
+                if len(pending) == nproc:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(_rebin_chunk, (chunk,)))
+            while len(pending) > 0:
+                yield pending.popleft().get()
+        results = parallel()
+    else:
+        results = (_rebin_chunk(chunk) for chunk in chunks())
+    try:
+        for ichunk, (f_flux, f_sig) in enumerate(results):
+            if debug:
+                print("chunk={:d}".format(ichunk))
+            f_wv = np.outer(np.ones(f_flux.shape[0]), new_wv.value)
+            yield XSpectrum1D(f_wv, f_flux, sig=f_sig, masking='none',
+                              units=spec.units.copy())
+    finally:
+        if nproc > 1:
+            pool.close()
+
+
+def _rebin_chunk(args):
+    """ Rebin flux and sig of a chunk of spectra for rebin_to_rest()
+    The grids differ from row to row so the matrix is not cached
 
+    Parameters
+    ----------
+    args : tuple
+      wave, flux, sig, mask, new_wv, fill_value, grow_bad_sig
 
-def smash_spectra(spec, method='average', debug=False):
+    Returns
+    -------
+    new_fx, new_sig : ndarrays
+    """
+    wave, flux, sig, mask, new_wv, fill_value, grow_bad_sig = args
+    new_fx, new_sig, _ = rebin_rows(wave, flux, new_wv, sig=sig, mask=mask, do_sig=True,
+                                    fill_value=fill_value, grow_bad_sig=grow_bad_sig,
+                                    cache=False)
+    return new_fx, new_sig
+
+
+def smash_spectra(spec, method='average', debug=False, weights=None, chunk_size=None):
     """ Collapse the data in XSpectrum1D.data
     One might call this 'stacking'
     Note: This works on the unmasked data array and returns
@@ -432,19 +750,59 @@ def smash_spectra(spec, method='average', debug=False):
     ----------
     spec : XSpectrum1D
     method : str, optional
-      Approach to the smash ['smash']
+      Approach to the smash
+      'average' -- Mean of the pixels with sig > 0
+      'median' -- Median
+      'weighted' -- Weighted mean (requires weights)
+      'ivar' -- Inverse-variance weighted mean
+      'approx_median' -- Median estimated in a single pass (P^2)
     debug : bool, optional
+    weights : ndarray, optional
+      Weights, one per spectrum (nspec,) or per pixel (nspec, npix)
+    chunk_size : int, optional
+      Stack chunk_size spectra at a time with spectra.stack.StreamingStack
+      to bound the memory.  Always done for the methods other than
+      'average' and 'median';  default then is 1000.  The exact
+      median cannot be streamed;  use 'approx_median' instead
 
     Returns
     -------
     new_spec : XSpectrum1D
+      The streamed means also have an error array
 
     """
     from linetools.spectra.xspectrum1d import XSpectrum1D
+    from linetools.spectra.stack import StreamingStack
     # Checks
     if spec.nspec <= 1:
         raise IOError("This method smashes an XSpectrum1D instance with multiple spectra")
     np.testing.assert_allclose(spec.data['wave'][0],spec.data['wave'][1])
+    if method not in ['average', 'median', 'weighted', 'ivar', 'approx_median']:
+        raise IOError("Not prepared for this smash method")
+    if method == 'weighted' and weights is None:
+        raise IOError("Must input weights for method='weighted'")
+    if method == 'median' and chunk_size is not None:
+        raise IOError("The median cannot be streamed;  use method='approx_median' with chunk_size")
+    if (chunk_size is not None) or (method not in ['average', 'median']):
+        # Streaming
+        if chunk_size is None:
+            chunk_size = 1000
+        wave = np.ma.getdata(spec.data['wave'][0]) * spec.units['wave']
+        if method == 'approx_median':
+            stack = StreamingStack(wave, percentiles=[50.], flux_unit=spec.units['flux'])
+        else:
+            stack = StreamingStack(wave, flux_unit=spec.units['flux'])
+        for i0 in range(0, spec.nspec, chunk_size):
+            if debug:
+                print("Stacking spectra {:d} onwards".format(i0))
+            sub = spec[i0:i0+chunk_size]
+            # The means require sig > 0, as for 'average'
+            sig = None if method == 'approx_median' else np.ma.getdata(sub.data['sig'])
+            stack.add(sub.data['flux'], sig=sig,
+                      weights=None if weights is None else weights[i0:i0+chunk_size])
+        new_spec = stack.to_spectrum('median' if method == 'approx_median' else method)
+        new_spec.meta = spec.meta.copy()
+        return new_spec
     # Generate mask
     stack_msk = spec.data['sig'] > 0.
     if method == 'average':
@@ -453,8 +811,6 @@ def smash_spectra(spec, method='average', debug=False):
         fin_flx = tot_flx / np.maximum(navg, 1.)
     elif method == 'median':
         fin_flx = np.median(spec.data['flux'],0)
-    else:
-        raise IOError("Not prepared for this smash method")
     # Finish
     new_spec = XSpectrum1D(spec.data['wave'][0], fin_flx, masking='none',
                            units=spec.units.copy())
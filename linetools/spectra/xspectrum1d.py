@@ -16,6 +16,7 @@ from astropy.table import QTable, Column, Table
 
 import linetools.utils as ltu
 
+from .columnar import ColumnarData, LazyData, mask_from_sig
 from .plotting import get_flux_plotrange
 from .utils import meta_to_disk
 
@@ -147,12 +148,15 @@ class XSpectrum1D(object):
         return spec
 
     def __init__(self, wave, flux, sig=None, co=None, units=None, select=0,
-                 meta=None, verbose=False, masking='none', **kwargs):
+                 meta=None, verbose=False, masking='none', storage='masked',
+                 **kwargs):
         """
         Parameters
         ----------
-        wave : ndarray  [if 2D, the first axis is nspec]
-        flux : ndarray
+        wave : ndarray or LazyData  [if 2D, the first axis is nspec]
+          A LazyData object (see spectra.columnar) requires storage='lazy'
+          and holds all of the data;  flux, sig and co are then ignored
+        flux : ndarray or None
         sig : ndarray, optional
         units : dict, optional
           Dict containing the units of wavelength, flux
@@ -168,76 +172,68 @@ class XSpectrum1D(object):
           'edges' -- Masks all data values with sig <=0 on the 'edge' of each spectrum
              e.g.   sig = [0.,0.,0.,0.2,0.,0.2,0.2,0.,0.] would have the first 3 and last 2 masked
           'all' -- Masks all data values with sig <=0
+        storage: str, optional
+          Layout of the data in memory
+          'masked' -- A single masked, structured numpy array
+          'columnar' -- Contiguous arrays per column with one shared
+             boolean mask (see spectra.columnar.ColumnarData).  The wavelength,
+             flux, etc. properties then return views instead of copies
+             when the unmasked pixels are contiguous.
+          'lazy' -- Spectra are read from disk when first accessed
+             (see spectra.columnar.LazyData and io.readspec(lazy=True))
         """
         # Error checking
-        if not isinstance(wave, np.ndarray):
-            raise IOError("Input `wave` vector must be an numpy.ndarray.")
-        if not isinstance(flux, np.ndarray):
-            raise IOError("Input `flux` vector must be an numpy.ndarray.")
-        if wave.shape[0] != flux.shape[0]:
-            raise IOError("Shape of `flux` and `wave` vectors must be identical.")
+        if storage == 'lazy':
+            if not isinstance(wave, LazyData):
+                raise IOError("Lazy storage requires a LazyData object for `wave`.")
+        else:
+            if not isinstance(wave, np.ndarray):
+                raise IOError("Input `wave` vector must be an numpy.ndarray.")
+            if not isinstance(flux, np.ndarray):
+                raise IOError("Input `flux` vector must be an numpy.ndarray.")
+            if wave.shape[0] != flux.shape[0]:
+                raise IOError("Shape of `flux` and `wave` vectors must be identical.")
         if masking not in ['none', 'edges', 'all']:
             raise IOError("Invalid masking type.")
+        if storage not in ['masked', 'columnar', 'lazy']:
+            raise IOError("Invalid storage type.")
         #if (masking != 'None') and (sig is None):
         #    warnings.warn("Must input sig array to use masking")
         self.masking = masking
+        self.storage = storage
 
         # Handle many spectra
-        if len(wave.shape) == 1:
+        if storage == 'lazy':
+            self.nspec = wave.nspec
+            self.totpix = wave.totpix
+        elif len(wave.shape) == 1:
             self.nspec = 1
             self.totpix = wave.shape[0]
         else:
             self.nspec = wave.shape[0]
             self.totpix = wave.shape[1]
         self.select = select
+        self._diagnostics = {}
 
         if verbose:
             print("We have {:d} spectra with {:d} pixels each.".format(
                 self.nspec, self.totpix))
 
-        # Data arrays are always MaskedArray
-        self.data = np.ma.empty((self.nspec,), #self.npix),
-                               dtype=[(str('wave'), 'float64', (self.totpix)),
-                                      (str('flux'), 'float32', (self.totpix)),
-                                      (str('sig'),  'float32', (self.totpix)),
-                                      (str('co'),   'float32', (self.totpix)),
-                                     ])
-        self.data['wave'] = np.reshape(wave, (self.nspec, self.totpix))
-        self.data['flux'] = np.reshape(flux, (self.nspec, self.totpix))
-
-        if co is not None:
-            if wave.shape[0] != co.shape[0]:
-                raise IOError("Shape of `wave` and `co` vectors must be identical.")
-            self.data['co'] = np.reshape(co, (self.nspec, self.totpix))
-        else:
-            self.data['co'] = np.nan
-
-        # Need to set sig last for masking
-        if sig is not None:
-            if wave.shape[0] != sig.shape[0]:
-                raise IOError("Shape of `wave` and `sig` vectors must be identical.")
-            self.data['sig'] = np.reshape(sig, (self.nspec, self.totpix))
-            if masking != 'none':
-                for kk in range(self.nspec):
-                    gdsigval = np.where(self.data['sig'][kk].data > 0.)[0]
-                    badsigval = self.data['sig'][kk].data <= 0.
-                    for key in self.data.dtype.names:
-                        if masking == 'edges':
-                            try:
-                                self.data[key][kk][0:gdsigval[0]].mask = True
-                            except IndexError:
-                                if len(gdsigval) == 0:
-                                    warnings.warn("All pixels masked.  Likely a bad spectrum")
-                                    self.data[key][kk][:].mask = True
-                                else:
-                                    pdb.set_trace()
-                            else:
-                                self.data[key][kk][gdsigval[-1]+1:].mask = True
-                        elif masking == 'all':
-                            self.data[key][kk].mask = badsigval
+        # Data arrays are always MaskedArray (or views thereof)
+        if storage == 'lazy':
+            self.data = wave
+            self.data.masking = masking
+        elif storage == 'columnar':
+            self.data = ColumnarData(self.nspec, self.totpix)
         else:
-            self.data['sig'] = np.nan
-
+            self.data = np.ma.empty((self.nspec,), #self.npix),
+                                   dtype=[(str('wave'), 'float64', (self.totpix)),
+                                          (str('flux'), 'float32', (self.totpix)),
+                                          (str('sig'),  'float32', (self.totpix)),
+                                          (str('co'),   'float32', (self.totpix)),
+                                         ])
+        if storage != 'lazy':
+            self._fill_data(wave, flux, sig=sig, co=co)
 
         # Units
         if units is not None:
@@ -267,6 +263,34 @@ class XSpectrum1D(object):
         # Filename
         self.filename = 'none'
 
+    def _fill_data(self, wave, flux, sig=None, co=None):
+        """ Fill self.data with the input arrays and mask with sig
+        """
+        self.data['wave'] = np.reshape(wave, (self.nspec, self.totpix))
+        self.data['flux'] = np.reshape(flux, (self.nspec, self.totpix))
+
+        if co is not None:
+            if wave.shape[0] != co.shape[0]:
+                raise IOError("Shape of `wave` and `co` vectors must be identical.")
+            self.data['co'] = np.reshape(co, (self.nspec, self.totpix))
+        else:
+            self.data['co'] = np.nan
+
+        # Need to set sig last for masking
+        if sig is not None:
+            if wave.shape[0] != sig.shape[0]:
+                raise IOError("Shape of `wave` and `sig` vectors must be identical.")
+            self.data['sig'] = np.reshape(sig, (self.nspec, self.totpix))
+            if self.masking != 'none':
+                badsigval = mask_from_sig(self.data['sig'], self.masking)
+                for key in self.data.dtype.names:
+                    if self.masking == 'edges':
+                        self.data[key].mask = np.ma.getmaskarray(self.data[key]) | badsigval
+                    else:
+                        self.data[key].mask = badsigval
+        else:
+            self.data['sig'] = np.nan
+
     def copy(self, select=None):
         """ Copy the spectrum
 
@@ -282,6 +306,10 @@ class XSpectrum1D(object):
         data = self.data.copy()
         units = self.units.copy()
         meta = self.meta.copy()
+        if self.storage == 'lazy':
+            # Shares the reader;  nothing new is read
+            return XSpectrum1D(data, None, units=units, meta=meta, select=select,
+                               masking=self.masking, storage='lazy')
         #
         if self.sig_is_set:
             sig = data['sig']
@@ -293,7 +321,8 @@ class XSpectrum1D(object):
         else:
             co = None
         new = XSpectrum1D(data['wave'], data['flux'], sig=sig, co=co,
-                          units=units, meta=meta, select=select)
+                          units=units, meta=meta, select=select,
+                          storage=self.storage)
         return new
 
     @property
@@ -302,36 +331,199 @@ class XSpectrum1D(object):
         """
         return self.meta['headers'][self.select]
 
+    def _compressed(self, key):
+        """ Unmasked values of one data column for the selected spectrum
+
+        For columnar and lazy storage this is a view whenever possible
+
+        Parameters
+        ----------
+        key : str
+          'wave', 'flux', 'sig' or 'co'
+
+        Returns
+        -------
+        values : ndarray
+        """
+        if self.storage in ['columnar', 'lazy']:
+            return self.data.compressed(key, self.select)
+        return self._row(key).compressed()
+
+    def _row(self, key):
+        """ One data column of the selected spectrum, masked pixels included
+
+        Writes to the returned MaskedArray (data or mask) go to self.data.
+        For lazy storage only the selected spectrum is read.
+
+        Parameters
+        ----------
+        key : str
+          'wave', 'flux', 'sig' or 'co'
+
+        Returns
+        -------
+        values : MaskedArray, shape (totpix,)
+        """
+        if self.storage == 'lazy':
+            return self.data.row(key, self.select)
+        return self.data[key][self.select]
+
+    def _data_rows(self):
+        """ Unmasked data of all spectra, shifted to the start of each row
+
+        The 2D analog of the wavelength, flux, sig and co properties,
+        used by the methods acting on all spectra at once.
+
+        Returns
+        -------
+        ngood : int ndarray, shape (nspec,)
+          Number of unmasked pixels of each spectrum
+        order : int ndarray, shape (nspec, totpix)
+          See spectra.utils.compress_rows
+        rows : dict
+          wave, flux, sig, co : ndarray, shape (nspec, totpix)
+            Flux and sig are normalized if self.normed.
+            Values beyond ngood in each row are padding.
+          sig_set, co_set : bool ndarray, shape (nspec,)
+        """
+        from .utils import compress_rows
+        keys = ['wave', 'flux', 'sig', 'co']
+        ngood, order, arrays = compress_rows(
+            np.ma.getmaskarray(self.data['flux']),
+            *[np.ma.getdata(self.data[key]) for key in keys])
+        rows = dict(zip(keys, arrays))
+        for key in ['sig', 'co']:
+            rows[key+'_set'] = (ngood > 0) & ~np.isnan(rows[key][:, 0])
+        if self.normed:
+            # Avoid dividing by zero
+            gdco = rows['co_set'][:, np.newaxis] & (rows['co'] != 0.)
+            for key in ['flux', 'sig']:
+                rows[key] = np.where(gdco, rows[key] / np.where(gdco, rows['co'], 1.), rows[key])
+        return ngood, order, rows
+
+    def _spec_from_rows(self, order, ngood, flux, sig=None, co=None):
+        """ New XSpectrum1D with the wavelengths and mask of this one
+
+        Parameters
+        ----------
+        order, ngood : ndarray
+          As returned by _data_rows()
+        flux, sig, co : ndarray, shape (nspec, totpix)
+          Laid out as the rows returned by _data_rows()
+
+        Returns
+        -------
+        XSpectrum1D
+        """
+        pad = np.arange(self.totpix) >= ngood[:, np.newaxis]
+        arrays = []
+        for arr in [flux, sig, co]:
+            if arr is None:
+                arrays.append(None)
+                continue
+            full = np.zeros(arr.shape)
+            np.put_along_axis(full, order, np.where(pad, 0., arr), axis=1)
+            arrays.append(full)
+        # The new arrays are in memory, so lazy spectra give columnar ones
+        storage = 'columnar' if self.storage == 'lazy' else self.storage
+        new = XSpectrum1D(np.ma.getdata(self.data['wave']), arrays[0], sig=arrays[1],
+                          co=arrays[2], units=self.units.copy(), meta=self.meta.copy(),
+                          storage=storage)
+        mask = np.ma.getmaskarray(self.data['flux'])
+        for key in new.data.dtype.names:
+            new.data[key].mask = mask
+        return new
+
+    def _smooth_rows(self, func, ngood, arr, boundary='fill', fill_value=0.):
+        """ Apply a smoothing function to rows laid out by _data_rows()
+
+        Parameters
+        ----------
+        func : callable
+          Smooths an array of shape (nrow, npix) along its rows
+        ngood : ndarray
+          As returned by _data_rows()
+        arr : ndarray, shape (nspec, totpix)
+        boundary : str, optional
+        fill_value : float, optional
+          Boundary options given to func.  Unless these are 'fill' and 0,
+          which the zero padding beyond ngood matches, func is applied
+          to the rows of each ngood in turn so that the boundary falls
+          at the last good pixel of each spectrum
+
+        Returns
+        -------
+        smoothed : ndarray, shape (nspec, totpix)
+        """
+        pad = np.arange(self.totpix) >= ngood[:, np.newaxis]
+        arr = np.where(pad, 0., arr)
+        if (boundary == 'fill') and (fill_value == 0.):
+            return func(arr)
+        smoothed = np.zeros_like(arr)
+        for npix in np.unique(ngood):
+            if npix == 0:
+                continue
+            rows = ngood == npix
+            smoothed[rows, :npix] = func(arr[rows, :npix])
+        return smoothed
+
+    @staticmethod
+    def _smooth_flux_sig(flux, sig, smooth, smooth_var):
+        """ Smooth the flux and propagate its errors
+
+        Pixels with sig <= 0 are bad:  they are left out (as NaNs) of
+        both the smoothed flux and variance, which renormalise the
+        kernel over the good pixels, and keep sig = 0.  Bad pixels
+        with no good one within reach keep their flux
+
+        Parameters
+        ----------
+        flux, sig : ndarray
+        smooth, smooth_var : callable
+          Smooth the flux and the variance, leaving out NaNs
+
+        Returns
+        -------
+        new_fx, new_sig : ndarray
+        """
+        with np.errstate(invalid='ignore'):
+            bad = sig <= 0.
+        new_fx = smooth(np.where(bad, np.nan, flux))
+        new_fx = np.where(bad & np.isnan(new_fx), flux, new_fx)
+        var = smooth_var(np.where(bad, np.nan, sig**2))
+        new_sig = np.where(bad, 0., np.sqrt(np.where(bad, 0., var)))
+        return new_fx, new_sig
+
     @property
     def wavelength(self):
         """ Return the wavelength array with units
         """
-        return self.data['wave'][self.select].compressed() * self.units['wave']
+        return Quantity(self._compressed('wave'), unit=self.units['wave'], copy=False)
 
     @wavelength.setter
     def wavelength(self, value):
-        gdp = ~self.data['wave'][self.select].mask
-        self.data['wave'][self.select][gdp] = value
+        gdp = ~self._row('wave').mask
+        self._row('wave')[gdp] = value
         if hasattr(value, 'unit'):
             self.units['wave'] = value.unit
+        self._reset_diagnostics()
 
     @property
     def flux(self):
         """ Return the flux with units
         """
-        #flux =  self.data[self.select]['flux'] * self.units['flux']
-        flux = self.data['flux'][self.select].compressed() * self.units['flux']
+        flux = self._compressed('flux')
         if self.normed and self.co_is_set:
-            # Avoid dividing by zero
-            co = self.data['co'][self.select].compressed()
+            # Avoid dividing by zero (and writing into the storage)
+            co = self._compressed('co')
             gdco = co != 0.
-            flux[gdco] /= co[gdco]
-        return flux
+            flux = np.where(gdco, flux / np.where(gdco, co, 1.), flux)
+        return Quantity(flux, unit=self.units['flux'], copy=False)
 
     @flux.setter
     def flux(self, value):
-        gdp = ~self.data['flux'][self.select].mask
-        self.data['flux'][self.select][gdp] = value
+        gdp = ~self._row('flux').mask
+        self._row('flux')[gdp] = value
         if hasattr(value, 'unit'):
             self.units['flux'] = value.unit
 
@@ -339,13 +531,16 @@ class XSpectrum1D(object):
     def sig_is_set(self):
         """ Returns whether the error array is set
         """
-        tmp = self.data['sig'][self.select].compressed()
-        if len(tmp) == 0:
-            return False  # All pixels masked
-        elif np.isnan(tmp[0]):
-            return False
-        else:
-            return True
+        cache = self._cache()
+        if 'sig_is_set' not in cache:
+            tmp = self._compressed('sig')
+            if len(tmp) == 0:
+                cache['sig_is_set'] = False  # All pixels masked
+            elif np.isnan(tmp[0]):
+                cache['sig_is_set'] = False
+            else:
+                cache['sig_is_set'] = True
+        return cache['sig_is_set']
 
     @property
     def sig(self):
@@ -355,21 +550,21 @@ class XSpectrum1D(object):
             warnings.warn("This spectrum does not contain an input error array")
             return np.nan
         #
-        #sig = self.data[self.select]['sig'] * self.units['flux']
-        sig = self.data['sig'][self.select].compressed() * self.units['flux']
+        sig = self._compressed('sig')
         if self.normed and self.co_is_set:
-            # Avoid dividing by zero
-            co = self.data['co'][self.select].compressed()
+            # Avoid dividing by zero (and writing into the storage)
+            co = self._compressed('co')
             gdco = co != 0.
-            sig[gdco] /= co[gdco]
-        return sig
+            sig = np.where(gdco, sig / np.where(gdco, co, 1.), sig)
+        return Quantity(sig, unit=self.units['flux'], copy=False)
 
     @sig.setter
     def sig(self, value):
         """ Set the error array to a float or same sized array
         """
-        gdp = ~self.data['sig'][self.select].mask
-        self.data['sig'][self.select][gdp] = value
+        gdp = ~self._row('sig').mask
+        self._row('sig')[gdp] = value
+        self._reset_diagnostics()
 
     @property
     def ivar(self):
@@ -389,10 +584,10 @@ class XSpectrum1D(object):
     def co_is_set(self):
         """ Returns whether a continuum is defined
         """
-        if np.isnan(self.data['co'][self.select].compressed()[0]):
-            return False
-        else:
-            return True
+        cache = self._cache()
+        if 'co_is_set' not in cache:
+            cache['co_is_set'] = not np.isnan(self._compressed('co')[0])
+        return cache['co_is_set']
 
     @property
     def co(self):
@@ -401,55 +596,87 @@ class XSpectrum1D(object):
         if not self.co_is_set:
             warnings.warn("This spectrum does not contain an input continuum array")
             return np.nan
-        return self.data['co'][self.select].compressed() * self.units['flux']
+        return Quantity(self._compressed('co'), unit=self.units['flux'], copy=False)
 
     @co.setter
     def co(self, value):
         """ Assumes units are the same as the flux
         """
-        gdp = ~self.data['co'][self.select].mask
-        self.data['co'][self.select][gdp] = value
+        gdp = ~self._row('co').mask
+        self._row('co')[gdp] = value
+        self._reset_diagnostics()
 
     @property
     def npix(self):
         """ Number of *unmasked* pixels """
-        self.set_diagnostics()  # Need to re-run in case self.select changes
-        return self._npix
-
+        return self._get_diagnostic('npix')
 
     @property
     def wvmin(self):
         """Minimum wavelength """
-        self.set_diagnostics()
-        return self._wvmin
+        return self._get_diagnostic('wvmin')
 
     @property
     def wvmax(self):
         """Maximum wavelength """
-        self.set_diagnostics()
-        return self._wvmax
+        return self._get_diagnostic('wvmax')
 
-    def set_diagnostics(self):
-        """Generate simple diagnostics on the spectrum.
+    def _cache(self):
+        """ Dict of cached diagnostics for the selected spectrum
+        """
+        return self._diagnostics.setdefault(self.select, {})
 
-        As a default, the method cuts on `good' pixels.  Useful for
-        plotting, quick comparisons, etc. It currently generates only
-        the minimum and maximum wavelengths. Sets attributes `_wvmin`
-        and `_wvmax`.
+    def _reset_diagnostics(self):
+        """ Drop the cached diagnostics of all spectra
+        Called whenever the data or the mask are modified
+        """
+        self._diagnostics = {}
+
+    def _get_diagnostic(self, key):
+        """ Return a cached diagnostic, generating it if need be
+        """
+        cache = self._cache()
+        if key not in cache:
+            self._calc_diagnostics()
+        return cache[key]
+
+    def _calc_diagnostics(self):
+        """ Fill the diagnostics cache of the selected spectrum
         """
+        cache = self._cache()
         # Cut on good pixels
+        wave = self.wavelength
         if self.sig_is_set:
-            gdpx = self.sig > 0.
+            gdpx = self._compressed('sig') > 0.
         else:
-            gdpx = np.array([True] * self.wavelength.value.size)
+            gdpx = np.ones(wave.size, dtype=bool)
         # Fill in attributes
-        self._npix = len(self.data['flux'][self.select].compressed())
+        cache['npix'] = len(self._compressed('flux'))
         if np.any(gdpx):
-            self._wvmin = np.min(self.wavelength[gdpx])
-            self._wvmax = np.max(self.wavelength[gdpx])
+            cache['wvmin'] = np.min(wave[gdpx])
+            cache['wvmax'] = np.max(wave[gdpx])
         else:
-            self._wvmin = 0.
-            self._wvmax = 0.
+            cache['wvmin'] = 0.
+            cache['wvmax'] = 0.
+        self._npix = cache['npix']
+        self._wvmin = cache['wvmin']
+        self._wvmax = cache['wvmax']
+
+    def set_diagnostics(self):
+        """Generate simple diagnostics on the spectrum.
+
+        As a default, the method cuts on `good' pixels.  Useful for
+        plotting, quick comparisons, etc. It currently generates only
+        the minimum and maximum wavelengths. Sets attributes `_wvmin`
+        and `_wvmax`.
+
+        The diagnostics (and sig_is_set, co_is_set) are cached for each
+        selected spectrum and reset when the data or mask are modified
+        with the methods of this class.  Call this method to refresh them
+        after writing into self.data directly.
+        """
+        self._reset_diagnostics()
+        self._calc_diagnostics()
 
     #  Add noise
     def add_noise(self, seed=None, s2n=None, rstate=None):
@@ -487,9 +714,9 @@ class XSpectrum1D(object):
         # Copy
         newspec = self.copy()
         # Deal with mask
-        gdp = ~self.data['flux'][self.select].mask
-        newspec.data['flux'][self.select][gdp] = self.flux.value + (rand * sig)
-        newspec.data['sig'][self.select][gdp] = np.ones_like(self.flux) * sig
+        gdp = ~self._row('flux').mask
+        newspec._row('flux')[gdp] = self.flux.value + (rand * sig)
+        newspec._row('sig')[gdp] = np.ones_like(self.flux) * sig
         #
         return newspec
 
@@ -555,9 +782,10 @@ class XSpectrum1D(object):
           Scalar sigma value to use.
         """
         self.data['sig'] = sigv
+        self._reset_diagnostics()
 
     #  Normalize
-    def normalize(self, co, verbose=False, no_check=False):
+    def normalize(self, co, verbose=False, no_check=False, all=False):
         """ Normalize the spectrum with an input continuum
 
         Parameters
@@ -567,12 +795,22 @@ class XSpectrum1D(object):
         verbose: bool [False]
         no_check: bool [False]
           Check size of array?
+        all: bool [False]
+          Set the continuum of all spectra at once.
+          co must then have shape (nspec, totpix), i.e. that of the
+          full (masked) data arrays
         """
-        if len(co) != self.npix:
+        if all:
+            if np.shape(co) != (self.nspec, self.totpix):
+                raise ValueError('normalize: Continuum needs to have shape (nspec, totpix)')
+            np.ma.getdata(self.data['co'])[...] = co
+            self._reset_diagnostics()
+        elif len(co) != self.npix:
             if no_check:
                 print('WARNING: Continuum length differs from flux')
                 if len(co) > len(self.flux):
                     self.data['co'] = co[0:self.npix]
+                    self._reset_diagnostics()
                 else:
                     raise ValueError('normalize: Continuum needs to be longer!')
             else:
@@ -781,30 +1019,17 @@ class XSpectrum1D(object):
           S/N is only crudely conserved.
           Rejected pixels are propagated.
         all : bool, optional
-          Rebin all spectra in the XSpectrum1D object?
-          Set masking='none' to have the resultant spectra all be registered, but note
-             that there will still be masking unless otherwise specified in kwargs
+          Rebin all spectra in the XSpectrum1D object (in one pass)?
+          The resultant spectra are all registered to new_wv, but note
+             that there will be masking if masking is specified in kwargs
 
         Returns
         -------
         XSpectrum1D of the rebinned spectrum
         """
-        from .utils import rebin, collate
-        #
-        if 'masking' in kwargs:
-            masking = kwargs['masking']
-        else:
-            masking = 'none'
+        from .utils import rebin
         #
-        if not all:
-            new_spec = rebin(self, new_wv, **kwargs)
-        else:
-            spec_list = []
-            for ii in range(self.nspec):
-                self.select = ii
-                spec_list.append(rebin(self, new_wv, **kwargs))
-            # Collate
-            new_spec = collate(spec_list, masking=masking)
+        new_spec = rebin(self, new_wv, all=all, **kwargs)
         # Return
         return new_spec
 
@@ -829,7 +1054,7 @@ class XSpectrum1D(object):
         return velo
 
     #  Box car smooth
-    def box_smooth(self, nbox, preserve=True, scale_sig=True, **kwargs):
+    def box_smooth(self, nbox, preserve=True, scale_sig=True, all=False, **kwargs):
         """ Box car smooth the spectrum
 
         Parameters
@@ -840,27 +1065,71 @@ class XSpectrum1D(object):
           If True, perform a convolution to ensure the new spectrum
           has the same number of pixels as the original.
         scale_sig : bool, optional
-          If True, scale the smoothed sig array down by np.sqrt(nbox)
+          If True, propagate the errors, i.e. sig**2 is summed with the
+          squared weights of the box.  Pixels with sig <= 0 are then
+          left out of both the flux and its error, and keep sig = 0.
+          Otherwise sig is smoothed as the flux
+        all : bool, optional
+          Smooth all of the spectra at once (requires preserve=True)
+          The result holds nspec spectra with the mask of this one
         **kwargs: dict
           If preserve=True, these keywords are passed on to
-          astropy.convoution.convolve
+          linetools.spectra.convolve.box_smooth_rows (boundary, fill_value)
+          or, for other options of astropy.convolution.convolve, to
+          linetools.spectra.convolve.convolve_rows
 
         Returns
         -------
         A new XSpectrum1D instance of the smoothed spectrum
           Has the same number of pixels as the original
         """
+        from astropy.convolution import Box1DKernel
+        from linetools.spectra import convolve as lsc
+
+        def smooth(arr):
+            # O(N) cumulative sums unless other convolution options are given
+            if set(kwargs.keys()) <= set(['boundary', 'fill_value']):
+                return lsc.box_smooth_rows(arr, nbox, **kwargs)
+            return lsc.convolve_rows(arr, Box1DKernel(nbox), **kwargs)
+
+        def smooth_var(var):
+            return lsc.box_smooth_rows(var, nbox, var=True,
+                                       boundary=kwargs.get('boundary', 'fill'))
+
+        if all:
+            if not preserve:
+                raise IOError("all=True requires preserve=True")
+            ngood, order, rows = self._data_rows()
+            boundary = dict(boundary=kwargs.get('boundary', 'fill'),
+                            fill_value=kwargs.get('fill_value', 0.))
+            smooth_rows = dict(sig=None, co=None)
+            if scale_sig and np.any(rows['sig_set']):
+                smooth_rows['flux'], smooth_rows['sig'] = self._smooth_flux_sig(
+                    rows['flux'], rows['sig'],
+                    lambda arr: self._smooth_rows(smooth, ngood, arr, **boundary),
+                    lambda var: self._smooth_rows(smooth_var, ngood, var, **boundary))
+            else:
+                for key in ['flux', 'sig']:
+                    if (key == 'flux') or np.any(rows[key+'_set']):
+                        smooth_rows[key] = self._smooth_rows(smooth, ngood, rows[key],
+                                                             **boundary)
+            if np.any(rows['co_set']):
+                smooth_rows['co'] = self._smooth_rows(smooth, ngood, rows['co'], **boundary)
+            return self._spec_from_rows(order, ngood, smooth_rows['flux'],
+                                        sig=smooth_rows['sig'], co=smooth_rows['co'])
         if preserve:
-            from astropy.convolution import convolve, Box1DKernel
-            new_fx = convolve(self.flux, Box1DKernel(nbox), **kwargs)
-            if self.sig_is_set:
-                new_sig = convolve(self.sig, Box1DKernel(nbox), **kwargs)
-                if scale_sig:
-                    new_sig /= np.sqrt(nbox)
+            if self.sig_is_set and scale_sig:
+                new_fx, new_sig = self._smooth_flux_sig(self.flux.value, self.sig.value,
+                                                        smooth, smooth_var)
+                new_fx = new_fx * self.flux.unit
+            elif self.sig_is_set:
+                new_fx = smooth(self.flux)
+                new_sig = smooth(self.sig.value)
             else:
+                new_fx = smooth(self.flux)
                 new_sig = None
             if self.co_is_set:
-                new_co = convolve(self.co, Box1DKernel(nbox), **kwargs)
+                new_co = smooth(self.co)
             else:
                 new_co = None
             new_wv = self.wavelength
@@ -893,15 +1162,24 @@ class XSpectrum1D(object):
         return XSpectrum1D.from_tuple(
             (new_wv, new_fx, new_sig, new_co), meta=self.meta.copy())
 
-    def gauss_smooth(self, fwhm, **kwargs):
+    def gauss_smooth(self, fwhm, all=False, **kwargs):
         """ Smooth a spectrum with a Gaussian
 
-        Note that the uncertainty array is not smoothed.
+        The errors are propagated, i.e. sig**2 is convolved with
+        the square of the Gaussian.  Pixels with sig <= 0 are left
+        out of both the flux and its error, and keep sig = 0.
 
         Parameters
         ----------
         fwhm : float
           FWHM of the Gaussian in pixels (unitless)
+        all : bool, optional
+          Smooth all of the spectra at once
+          The result holds nspec spectra with the mask of this one
+        **kwargs : dict
+          Passed on to linetools.spectra.convolve.convolve_psf,
+          e.g. method='fft', or method='recursive' for the O(N)
+          approximation of convolve.gauss_smooth_rows
 
         Returns
         -------
@@ -910,27 +1188,47 @@ class XSpectrum1D(object):
         # Import
         from linetools.spectra import convolve as lsc
 
-        # Apply to flux
-        new_fx = lsc.convolve_psf(
-            self.flux.value, fwhm, **kwargs) * self.flux.unit
+        if all:
+            ngood, order, rows = self._data_rows()
+            boundary = dict(boundary=kwargs.get('boundary', 'fill'),
+                            fill_value=kwargs.get('fill_value', 0.))
+
+            def smooth(arr):
+                return self._smooth_rows(lambda sub: lsc.convolve_psf(sub, fwhm, **kwargs),
+                                         ngood, arr, **boundary)
+            if np.any(rows['sig_set']):
+                new_fx, new_sig = self._smooth_flux_sig(
+                    rows['flux'], rows['sig'], smooth, lambda var: self._smooth_rows(
+                        lambda sub: lsc.convolve_psf(sub, fwhm, var=True, **kwargs),
+                        ngood, var, **boundary))
+            else:
+                new_fx, new_sig = smooth(rows['flux']), None
+            return self._spec_from_rows(order, ngood, new_fx, sig=new_sig)
 
-        # Get the right sigma
+        # Apply to flux, propagating the errors
         if self.sig_is_set:
-            new_sig = self.sig.value
+            new_fx, new_sig = self._smooth_flux_sig(
+                self.flux.value, self.sig.value,
+                lambda arr: lsc.convolve_psf(arr, fwhm, **kwargs),
+                lambda var: lsc.convolve_psf(var, fwhm, var=True, **kwargs))
         else:
+            new_fx = lsc.convolve_psf(self.flux.value, fwhm, **kwargs)
             new_sig = None
+        new_fx = new_fx * self.flux.unit
 
         # Return
         return XSpectrum1D.from_tuple(
             (self.wavelength, new_fx, new_sig), meta=self.meta.copy())
 
-    def ivar_smooth(self, window):
+    def ivar_smooth(self, window, all=False):
         """ Inverse variance smoothing -- port of ivarsmooth from IDL
 
         Parameters
         ----------
         window -- int
           smoothing length in pixels (turned into odd number if even)
+        all -- bool, optional
+          Smooth all of the spectra at once
 
         Returns
         -------
@@ -942,6 +1240,8 @@ class XSpectrum1D(object):
             raise IOError("Input window must be int")
         #
         halfwindow = np.floor((window-1)/2).astype(int)
+        if all:
+            return self._ivar_smooth_all(halfwindow)
         ivar = 1./self.sig**2
 
         shiftarr = np.zeros((self.npix, 2*halfwindow+1))
@@ -972,6 +1272,37 @@ class XSpectrum1D(object):
         return XSpectrum1D.from_tuple(
                 (self.wavelength, smoothflux, newsig), meta=self.meta.copy())
 
+    def _ivar_smooth_all(self, halfwindow):
+        """ ivar_smooth() of all the spectra at once
+        """
+        from astropy.convolution import Box1DKernel
+        from linetools.spectra.convolve import convolve_rows
+        ngood, order, rows = self._data_rows()
+        pad = np.arange(self.totpix) >= ngood[:, np.newaxis]
+        flux = np.where(pad, 0., rows['flux'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ivar = np.where(pad, 0., 1./rows['sig']**2)
+            fivar = flux*ivar
+        # Sum over the window;  pixels beyond either end do not contribute
+        nwin = 2*halfwindow+1
+        pivar = np.pad(ivar, ((0, 0), (halfwindow, halfwindow)), mode='constant')
+        pfivar = np.pad(fivar, ((0, 0), (halfwindow, halfwindow)), mode='constant')
+        outivar = np.zeros_like(ivar)
+        smoothflux = np.zeros_like(ivar)
+        with np.errstate(invalid='ignore'):
+            for i in range(nwin):
+                outivar += pivar[:, i:i+self.totpix]
+                smoothflux += pfivar[:, i:i+self.totpix]
+            nzero = outivar > 0
+            smoothflux[nzero] = smoothflux[nzero]/outivar[nzero]
+        # Spectra without any good pixel
+        nogood = ~np.any(nzero, axis=1)
+        if np.any(nogood):
+            smoothflux[nogood] = convolve_rows(flux[nogood], Box1DKernel(nwin))
+        with np.errstate(divide='ignore'):
+            newsig = np.sqrt(1./outivar)
+        return self._spec_from_rows(order, ngood, smoothflux, sig=newsig)
+
     def stitch(self, idx=None, scale=1.):
         """ Combine two or more spectra within the .data array
         Simple logic is used to order them by wavelength if the
@@ -993,11 +1324,9 @@ class XSpectrum1D(object):
         """
         from linetools.spectra import utils as ltsu
         if idx is None:
-            wvmx = []
-            for ii in range(self.nspec):
-                wvmx.append(np.max(self.data['wave'][ii]))
+            wvmx = np.ma.max(self.data['wave'], axis=1)
             # Sort
-            idx = np.argsort(np.array(wvmx))
+            idx = np.argsort(np.ma.getdata(wvmx))
         # Splice the first two
         spec = ltsu.splice_two(self.copy(select=idx[0]),
                                self.copy(select=idx[1]))
@@ -1007,7 +1336,7 @@ class XSpectrum1D(object):
         # Return
         return spec
 
-    def get_local_s2n(self, wv0, npix=50, flux_th=0., debug=False):
+    def get_local_s2n(self, wv0, npix=50, flux_th=0., debug=False, all=False):
         """It computes the local average signal-to-noise (s2n) over npix pixels around wv0.
         If `flux_th` is given, pixels with fluxes below spec.flux*flux_th are masked out, and
         the range is increased until having npix pixels for doing the calculation.
@@ -1030,14 +1359,20 @@ class XSpectrum1D(object):
                 b. If continuum is not defined, we approximate the continuum by smoothing
                    the spectrum convolving it with a Gaussian kernel of FWHM (in pixels) given
                    by the maximum between 10*npix and 500.
+        all : bool, optional
+            Perform the calculation for all of the spectra at once.
+            wv0 may then be a Quantity array with one value per spectrum
+            and an array flux_th must have shape (nspec, totpix).
 
         Returns
         -------
-        s2n : float
+        s2n : float (ndarray of shape (nspec,) if all=True)
             Local average signal-to-noise
-        s2n_sig : float
+        s2n_sig : float (ndarray of shape (nspec,) if all=True)
             Standard deviation of the s2n measurement
         """
+        if all:
+            return self._get_local_s2n_all(wv0, npix=npix, flux_th=flux_th)
 
         # Do some checks
         if (wv0 < self.wvmin) or (wv0 > self.wvmax):
@@ -1080,6 +1415,58 @@ class XSpectrum1D(object):
         s2n = fl_aux / er_aux
         return np.mean(s2n.value), np.std(s2n.value)
 
+    def _get_local_s2n_all(self, wv0, npix=50, flux_th=0.):
+        """ get_local_s2n() for all of the spectra at once
+        """
+        from linetools.spectra import convolve as lsc
+        from .utils import compress_rows
+        npix = int(npix)
+        ngood, order, rows = self._data_rows()
+        pad = np.arange(self.totpix) >= ngood[:, np.newaxis]
+        wave, flux, sig = rows['wave'], rows['flux'], rows['sig']
+        wv0 = np.broadcast_to(u.Quantity(wv0, self.units['wave']).value, (self.nspec,))
+
+        # Do some checks
+        if not np.all(rows['sig_set']):
+            raise ValueError("Spectrum has not defined an error array; cannot compute signal-to-noise.")
+        gdsig = (sig > 0.) & ~pad
+        wvmin = np.min(np.where(gdsig, wave, np.inf), axis=1)
+        wvmax = np.max(np.where(gdsig, wave, -np.inf), axis=1)
+        if np.any((wv0 < wvmin) | (wv0 > wvmax)):
+            raise IOError("`wv0` is outside spectral range.")
+
+        # if flux_th is float, then check whether continuum exists
+        # otherwise we estimate it.
+        if isinstance(flux_th, float):
+            if np.all(rows['co_set']):
+                flux_limit = rows['co'] * flux_th
+            else:  # here we estimate the continuum by smoothing the original spectrum
+                n_smooth = np.max([10*npix, 500])
+                co = lsc.convolve_psf(np.where(pad, 0., flux), n_smooth)
+                flux_limit = co * flux_th
+        # if it is not float, it should be array like self.data['flux']
+        else:
+            if np.shape(flux_th) != (self.nspec, self.totpix):
+                raise ValueError('`flux_th` must be either float or array of shape (nspec, totpix).')
+            _, _, (flux_limit,) = compress_rows(np.ma.getmaskarray(self.data['flux']),
+                                                np.asarray(flux_th))
+
+        # find pixel index for wv0
+        ind = np.argmin(np.where(pad, np.inf, np.fabs(wv0[:, np.newaxis] - wave)), axis=1)
+
+        # define the wavelength window with at least npix pixels
+        cond_gd_flux = (flux > flux_limit) & gdsig
+        if np.any(np.sum(cond_gd_flux, axis=1) < npix):
+            raise ValueError("The spectrum does not satisfy the conditions, try different input parameters.")
+        # grab the npix good pixels closest to ind (ties go to the bluer pixel)
+        idx_diff = np.where(cond_gd_flux, np.abs(np.arange(self.totpix) - ind[:, np.newaxis]),
+                            self.totpix)
+        gd_idx = np.argsort(idx_diff, axis=1, kind='stable')[:, :npix]
+
+        # define the chunk of spectra to look at
+        s2n = np.take_along_axis(flux, gd_idx, axis=1) / np.take_along_axis(sig, gd_idx, axis=1)
+        return np.mean(s2n, axis=1), np.std(s2n, axis=1)
+
     def write(self, outfil, FITS_TABLE=False, **kwargs):
         """  Wrapper for writing
         Parses the extension to choose the file format
@@ -1159,7 +1546,7 @@ class XSpectrum1D(object):
 
         # Flux
         if select:
-            prihdu = fits.PrimaryHDU(self.data['flux'][self.select].filled(fill_val))
+            prihdu = fits.PrimaryHDU(self._row('flux').filled(fill_val))
             #prihdu = fits.PrimaryHDU(self.data[self.select]['flux'])
         else:
             prihdu = fits.PrimaryHDU(self.data['flux'].filled(fill_val))
@@ -1169,7 +1556,7 @@ class XSpectrum1D(object):
         # Error  (packing LowRedux style)
         if self.sig_is_set:
             if select:
-                sighdu = fits.ImageHDU(self.data['sig'][self.select].filled(fill_val))
+                sighdu = fits.ImageHDU(self._row('sig').filled(fill_val))
             else:
                 sighdu = fits.ImageHDU(self.data['sig'].filled(fill_val))
             sighdu.name = 'ERROR'
@@ -1177,7 +1564,7 @@ class XSpectrum1D(object):
 
         # Wavelength
         if select:
-            wvhdu = fits.ImageHDU(self.data['wave'][self.select].filled(fill_val))
+            wvhdu = fits.ImageHDU(self._row('wave').filled(fill_val))
         else:
             wvhdu = fits.ImageHDU(self.data['wave'].filled(fill_val))
         wvhdu.name = 'WAVELENGTH'
@@ -1185,7 +1572,7 @@ class XSpectrum1D(object):
 
         if self.co_is_set:
             if select:
-                cohdu = fits.ImageHDU(self.data['co'][self.select].filled(fill_val))
+                cohdu = fits.ImageHDU(self._row('co').filled(fill_val))
             else:
                 cohdu = fits.ImageHDU(self.data['co'].filled(fill_val))
             cohdu.name = 'CONTINUUM'
@@ -1600,11 +1987,12 @@ class XSpectrum1D(object):
         if add_mask.dtype.name != 'bool':
             raise IOError("Input mask must be bool")
         if compressed:
-            gdp = np.where(~self.data['wave'][self.select].mask)[0]
+            gdp = np.where(~self._row('wave').mask)[0]
         else:
             gdp = np.arange(self.totpix)
         for key in self.data.dtype.names:
-            self.data[key][self.select].mask[gdp] += add_mask
+            self._row(key).mask[gdp] += add_mask
+        self._reset_diagnostics()
 
     def unmask(self):
         """ Set all mask values to False
@@ -1612,6 +2000,7 @@ class XSpectrum1D(object):
         """
         warnings.warn("Setting entire mask to False. Be careful..")
         self.data.mask = False
+        self._reset_diagnostics()
 
     def __getitem__(self, item):
         """ Slice the XSpectrum1D object using a set of input indices
@@ -1631,9 +2020,11 @@ class XSpectrum1D(object):
             newdata = self.data[np.array([item])]
         else:
             newdata = self.data[item]
-        # Create
+        # Create;  only the sliced spectra are read for lazy storage
+        storage = 'columnar' if self.storage == 'lazy' else self.storage
         return XSpectrum1D(newdata['wave'], newdata['flux'], newdata['sig'], newdata['co'],
-                           units=self.units, meta=self.meta, masking=self.masking)
+                           units=self.units, meta=self.meta, masking=self.masking,
+                           storage=storage)
 
 
     def __dir__(self):
@@ -751,7 +751,7 @@ class AbsLine(SpectralLine):
             raise NotImplementedError('AbsLine {} has not set its oscillator strength.'.format(self.__repr__))
         return laa.get_tau0(self.wrest, fosc, N, b)
 
-    def get_Wr_from_N_b(self, N, b):
+    def get_Wr_from_N_b(self, N, b, method='draine'):
         """It returns the rest-frame equivalent width for a given
         N and b. It uses the approximation given by Draine 2011 book
         (eq. 9.27), which comes from atomic physics considerations
@@ -764,6 +764,8 @@ class AbsLine(SpectralLine):
             Column density
         b : Quantity or Quantity array of same shape as N
             Doppler parameter
+        method : str, optional
+            'draine' or 'cog';  see linetools.analysis.absline.Wr_from_N_b()
 
         Returns
         -------
@@ -783,7 +785,7 @@ class AbsLine(SpectralLine):
             gamma = self.data['gamma']
         except KeyError:
             raise NotImplementedError('AbsLine {} has not set its gamma value.'.format(self.__repr__))
-        return laa.Wr_from_N_b(N, b, self.wrest, fosc, gamma)
+        return laa.Wr_from_N_b(N, b, self.wrest, fosc, gamma, method=method)
 
     def get_Wr_from_N(self, N):
         """It returns the approximated rest-frame equivalent width for